@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for podcast.py, run against a local stand-in server (bench/server.py).
+
+Measures feed parse time and memory (xmltodict dicts versus Episode records), download throughput, tagging time per episode,
+end-to-end cron run time and startup time (bench/startup.py). Results are written as JSON so they can be compared
+across commits with bench/compare.py.
+
+usage: python bench/bench.py [--quick] [--out FILE]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+root_folder = os.path.dirname(bench_folder)
+sys.path.insert(0, root_folder)
+sys.path.insert(0, bench_folder)
+
+from server import BenchServer
+from startup import bench_startup
+
+
+def git_commit() -> str:
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root_folder, text=True).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return 'unknown'
+
+
+def setup_env(tmp:str, server:BenchServer) -> None:
+  """
+  Points podcast.py at a temporary library and the local server. Must run before podcast is imported.
+  """
+  os.environ.update({
+    'podcast_folder': os.path.join(tmp, 'library'),
+    'state_folder': os.path.join(tmp, 'state'),
+    'connectivity_url': f'{server.base}/',
+    'log_level': os.getenv('bench_log_level', 'warning'),
+    'log_file': os.path.join(tmp, 'podcast.log'),
+    'subscriptions': ''
+  })
+  os.makedirs(os.environ['podcast_folder'])
+  os.chdir(tmp)
+
+
+def best_of(runs:int, func) -> float:
+  """
+  Returns the fastest of several timed runs.
+  """
+  times = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    func()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+
+def bench_feed_parse(server:BenchServer, sizes:list[int]) -> dict:
+  import xmltodict
+  import requests
+  from podcast import Podcast
+
+  results = {}
+  for items in sizes:
+    url = server.feed_url(f'parse{items}', items=items)
+    body = requests.get(url).content
+    parse_s = best_of(3, lambda: xmltodict.parse(body))
+    init_s = best_of(3, lambda: Podcast(url))
+
+    tracemalloc.start()
+    podcast = Podcast(url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del podcast
+
+    results[str(items)] = {
+      'feed_bytes': len(body),
+      'parse_s': parse_s,
+      'init_s': init_s,
+      'peak_mb': peak / 1_048_576
+    }
+  return results
+
+
+def bench_download(server:BenchServer, tmp:str, sizes_mb:list[int]) -> dict:
+  from lib.download import dl_with_progress_bar
+
+  results = {}
+  for size_mb in sizes_mb:
+    size = size_mb * 1_048_576
+    url = server.media_url(f'dl{size_mb}', size)
+    path = os.path.join(tmp, f'dl{size_mb}.mp3')
+    seconds = best_of(3, lambda: dl_with_progress_bar(url, path))
+    results[f'{size_mb}MB'] = {'seconds': seconds, 'mb_per_s': size_mb / seconds}
+    os.remove(path)
+  return results
+
+
+def traced(func) -> tuple[int, int]:
+  """
+  Runs func and returns (bytes still allocated by its result, peak bytes while it ran).
+  """
+  tracemalloc.start()
+  result = func()
+  current, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  del result
+  return current, peak
+
+
+def bench_episode_memory(server:BenchServer, sizes:list[int]) -> dict:
+  """
+  Memory held by a feed's items as xmltodict dicts versus Episode records.
+  """
+  import xmltodict
+  import requests
+  from lib.episode import parse_feed
+
+  results = {}
+  for items in sizes:
+    body = requests.get(server.feed_url(f'memory{items}', items=items)).content
+    dict_retained, dict_peak = traced(lambda: xmltodict.parse(body)['rss']['channel']['item'])
+    episode_retained, episode_peak = traced(lambda: parse_feed(body)[1])
+    results[str(items)] = {
+      'dict_retained_mb': dict_retained / 1_048_576,
+      'dict_peak_mb': dict_peak / 1_048_576,
+      'episode_retained_mb': episode_retained / 1_048_576,
+      'episode_peak_mb': episode_peak / 1_048_576,
+      'parse_s': best_of(3, lambda: parse_feed(body))
+    }
+  return results
+
+
+def bench_tagging(server:BenchServer, tmp:str, count:int) -> dict:
+  import requests
+  from lib.episode import parse_feed
+  from lib.Coverart import Coverart
+  from lib.download import dl_with_progress_bar
+  from lib.update_id3 import update_ID3, id3Image
+
+  folder = os.path.join(tmp, 'tagging')
+  os.makedirs(folder)
+  Coverart(url=f'{server.base}/art.jpg?px=1400').save(folder)
+  cover = Coverart(location=os.path.join(folder, 'cover.jpg'))
+
+  source = os.path.join(folder, 'source.mp3')
+  dl_with_progress_bar(server.media_url('tag', 20 * 1_048_576), source)
+  _, episodes = parse_feed(requests.get(server.feed_url('tag', items=count)).content)
+
+  files = []
+  for ndx in range(count):
+    path = os.path.join(folder, f'{ndx}.mp3')
+    shutil.copyfile(source, path)
+    files.append(path)
+
+  start = time.perf_counter()
+  for ndx, path in enumerate(files):
+    update_ID3('Bench Feed tag', episodes[ndx], path, count - ndx, lambda file: id3Image(file, cover.bytes()))
+  seconds = time.perf_counter() - start
+
+  shutil.rmtree(folder)
+  return {'episodes': count, 'seconds': seconds, 'ms_per_episode': seconds / count * 1000}
+
+
+def bench_cron_run(server:BenchServer, feeds:int) -> dict:
+  import podcast
+
+  os.environ['subscriptions'] = ','.join(server.feed_url(f'cron{ndx}', items=50, size=2 * 1_048_576) for ndx in range(feeds))
+  argv = sys.argv
+  sys.argv = ['podcast.py']
+  try:
+    start = time.perf_counter()
+    podcast.main()
+    cold_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    podcast.main()
+    noop_s = time.perf_counter() - start
+  finally:
+    sys.argv = argv
+    os.environ['subscriptions'] = ''
+
+  return {'feeds': feeds, 'cold_s': cold_s, 'noop_s': noop_s}
+
+
+def main() -> None:
+  args = sys.argv[1:]
+  quick = '--quick' in args
+  out = args[args.index('--out') + 1] if '--out' in args else None
+
+  tmp = tempfile.mkdtemp(prefix='podcast-bench-')
+  server = BenchServer().start()
+  setup_env(tmp, server)
+
+  commit = git_commit()
+  results = {}
+  try:
+    print('feed parse...', file=sys.stderr)
+    results['feed_parse'] = bench_feed_parse(server, [10, 100, 1000] if quick else [10, 100, 1000, 10000])
+    print('episode memory...', file=sys.stderr)
+    results['episode_memory'] = bench_episode_memory(server, [1000] if quick else [1000, 10000])
+    print('download...', file=sys.stderr)
+    results['download'] = bench_download(server, tmp, [10] if quick else [10, 100])
+    print('tagging...', file=sys.stderr)
+    results['tagging'] = bench_tagging(server, tmp, 5 if quick else 25)
+    print('cron run...', file=sys.stderr)
+    results['cron_run'] = bench_cron_run(server, 3 if quick else 10)
+    print('startup...', file=sys.stderr)
+    results['startup'] = bench_startup(server, 3 if quick else 10)
+  finally:
+    server.stop()
+    os.chdir(root_folder)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+  report = {
+    'commit': commit,
+    'timestamp': time.time(),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'quick': quick,
+    'results': results
+  }
+
+  out = out or os.path.join(bench_folder, 'results', f'{commit}.json')
+  os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+  with open(out, 'w') as f:
+    json.dump(report, f, indent=2)
+  print(json.dumps(report, indent=2))
+  print(f'Results written to {out}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Compares two benchmark result files written by bench/bench.py.
+
+usage: python bench/compare.py BASELINE.json CANDIDATE.json
+"""
+import sys
+import json
+
+
+def flatten(data:dict, prefix:str = '') -> dict:
+  """
+  Flattens nested results into 'a.b.c' keys, keeping only numbers.
+  """
+  flat = {}
+  for key, value in data.items():
+    name = f'{prefix}.{key}' if prefix else key
+    if isinstance(value, dict):
+      flat.update(flatten(value, name))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+      flat[name] = value
+  return flat
+
+
+def main() -> None:
+  if len(sys.argv) != 3:
+    print(__doc__.strip())
+    sys.exit(1)
+
+  with open(sys.argv[1]) as f:
+    baseline = json.load(f)
+  with open(sys.argv[2]) as f:
+    candidate = json.load(f)
+
+  a = flatten(baseline['results'])
+  b = flatten(candidate['results'])
+
+  print(f'{"metric":<45} {baseline["commit"]:>12} {candidate["commit"]:>12} {"change":>9}')
+  for key in sorted(set(a) | set(b)):
+    if key not in a or key not in b:
+      print(f'{key:<45} {a.get(key, "-"):>12} {b.get(key, "-"):>12}')
+      continue
+    change = (b[key] - a[key]) / a[key] * 100 if a[key] else 0
+    print(f'{key:<45} {a[key]:>12.4g} {b[key]:>12.4g} {change:>+8.1f}%')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+A local stand-in WebSub hub for testing 'podcast.py websub' without a public hub.
+
+Accepts subscribe/unsubscribe requests, verifies intent against the subscriber's callback,
+grants leases, and pushes signed content notifications when a topic is published.
+
+usage: python bench/hub.py [PORT]
+  POST /  hub.mode=subscribe|unsubscribe, hub.topic, hub.callback, hub.lease_seconds, hub.secret
+  POST /  hub.mode=publish, hub.url=TOPIC     notify the topic's subscribers
+"""
+import hmac
+import time
+import secrets
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlencode, urlparse, parse_qs, parse_qsl, urlunparse
+
+import requests
+
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args) -> None:
+    pass
+
+  def __send(self, status:int, body:bytes = b'') -> None:
+    self.send_response(status)
+    self.send_header('Content-Type', 'text/plain')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_POST(self) -> None:
+    body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+    form = {key: values[0] for key, values in parse_qs(body).items()}
+    hub = self.server.hub
+    mode = form.get('hub.mode')
+
+    if mode == 'publish':
+      topic = form.get('hub.url') or form.get('hub.topic')
+      if not topic:
+        return self.__send(400, b'hub.url missing')
+      threading.Thread(target=hub.publish, args=(topic,), daemon=True).start()
+      return self.__send(204)
+
+    if mode not in ('subscribe', 'unsubscribe') or not form.get('hub.topic') or not form.get('hub.callback'):
+      return self.__send(400, b'hub.mode, hub.topic and hub.callback are required')
+
+    hub.requests.append(form)
+    if hub.options.get('sync'):
+      verified = hub.verify(form)
+      return self.__send(204 if verified else 409)
+    threading.Thread(target=hub.verify, args=(form,), daemon=True).start()
+    self.__send(202)
+
+
+class LocalHub:
+  """
+  A WebSub hub on a background thread.
+
+  Options:
+    lease (int): Longest lease granted, in seconds (default 3600).
+    sync (bool): Verify intent before answering the subscription request.
+    deny (set[str]): Topics whose subscriptions are denied.
+    method (str): Signature method for X-Hub-Signature (default sha256).
+  """
+  def __init__(self, host:str = '127.0.0.1', port:int = 0, **options) -> None:
+    self.__httpd = ThreadingHTTPServer((host, port), Handler)
+    self.__httpd.daemon_threads = True
+    self.__httpd.hub = self
+    self.__lock = threading.Lock()
+    self.options = options
+    self.url = f'http://{host}:{self.__httpd.server_address[1]}/'
+    self.requests = []
+    # callback URL -> {'topic', 'secret', 'expires'}
+    self.subscribers = {}
+    self.deliveries = []
+
+  def verify(self, form:dict) -> bool:
+    """
+    Verifies a subscription request with the subscriber's callback, and records it if confirmed.
+    """
+    topic = form['hub.topic']
+    callback = form['hub.callback']
+
+    if topic in self.options.get('deny', ()):
+      self.__callback(callback, {'hub.mode': 'denied', 'hub.topic': topic, 'hub.reason': 'denied by test hub'})
+      return False
+
+    lease = min(int(form.get('hub.lease_seconds') or 3600), self.options.get('lease', 3600))
+    challenge = secrets.token_hex(16)
+    params = {'hub.mode': form['hub.mode'], 'hub.topic': topic, 'hub.challenge': challenge}
+    if form['hub.mode'] == 'subscribe':
+      params['hub.lease_seconds'] = str(lease)
+
+    res = self.__callback(callback, params)
+    if res is None or not res.ok or res.text != challenge:
+      return False
+
+    with self.__lock:
+      if form['hub.mode'] == 'subscribe':
+        self.subscribers[callback] = {'topic': topic, 'secret': form.get('hub.secret'), 'expires': time.time() + lease}
+      else:
+        self.subscribers.pop(callback, None)
+    return True
+
+  def __callback(self, callback:str, params:dict):
+    url = urlparse(callback)
+    query = urlencode(parse_qsl(url.query) + list(params.items()))
+    try:
+      return requests.get(urlunparse(url._replace(query=query)), timeout=10)
+    except requests.exceptions.RequestException:
+      return None
+
+  def publish(self, topic:str, content:bytes = None, content_type:str = 'application/rss+xml') -> list[int]:
+    """
+    Pushes the topic's content to its subscribers (fetching it from the topic URL if not given).
+
+    Returns:
+      list[int]: The status code of each delivery (None if it failed).
+    """
+    if content is None:
+      res = requests.get(topic, timeout=10)
+      content, content_type = res.content, res.headers.get('Content-Type', content_type)
+
+    now = time.time()
+    with self.__lock:
+      targets = [(callback, sub) for callback, sub in self.subscribers.items() if sub['topic'] == topic and sub['expires'] > now]
+
+    method = self.options.get('method', 'sha256')
+    statuses = []
+    for callback, sub in targets:
+      headers = {
+        'Content-Type': content_type,
+        'Link': f'<{self.url}>; rel="hub", <{topic}>; rel="self"'
+      }
+      if sub['secret']:
+        digest = hmac.new(sub['secret'].encode(), content, getattr(hashlib, method)).hexdigest()
+        headers['X-Hub-Signature'] = f'{method}={digest}'
+      try:
+        status = requests.post(callback, data=content, headers=headers, timeout=10).status_code
+      except requests.exceptions.RequestException:
+        status = None
+      statuses.append(status)
+      self.deliveries.append({'callback': callback, 'topic': topic, 'status': status})
+    return statuses
+
+  def start(self) -> 'LocalHub':
+    threading.Thread(target=self.__httpd.serve_forever, daemon=True).start()
+    return self
+
+  def stop(self) -> None:
+    self.__httpd.shutdown()
+    self.__httpd.server_close()
+
+
+if __name__ == '__main__':
+  import sys
+  hub = LocalHub(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8001).start()
+  print(f'Hub on {hub.url} (ctrl+c to stop)')
+  try:
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    hub.stop()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Feed parsing benchmark.
+
+Serves N large synthetic feeds from a local stand-in server and refreshes them all at once,
+the way the catalog refresh does ('catalog_concurrency' threads loading Podcast objects),
+once with every feed parsed on its fetching thread and once with large feeds sent to the
+parser process pool (lib/parse_pool.py). Reports the wall time of each and the speedup.
+
+It then times a regular run's feed loading: the feeds one at a time on one thread, as a run
+used to, against podcast.load_feeds (concurrent fetches, large feeds to the pool).
+
+The pool only helps with more than one core, run it on the machine you care about.
+
+usage: python bench/parse.py [--feeds 200] [--items 400] [--threads 8] [--workers N]
+                             [--threshold 1000000] [--latency 0] [--output FILE]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+root_folder = os.path.dirname(bench_folder)
+
+
+def refresh(urls:list[str], threads:int) -> float:
+  """
+  Loads every feed on a thread pool and returns the wall time in seconds.
+  """
+  from concurrent.futures import ThreadPoolExecutor
+  from podcast import Podcast
+  from lib import parse_pool
+  start = time.perf_counter()
+  with parse_pool.concurrent(), ThreadPoolExecutor(max_workers=threads) as executor:
+    list(executor.map(lambda url: Podcast(url, probe=False), urls))
+  return time.perf_counter() - start
+
+
+def run(urls:list[str], sequential:bool) -> float:
+  """
+  Loads every feed the way a regular run does and returns the wall time in seconds.
+  """
+  import podcast
+  start = time.perf_counter()
+  if sequential:
+    for url in urls:
+      podcast.Podcast(url, probe=False)
+  else:
+    podcast.load_feeds(urls, probe=False)
+  return time.perf_counter() - start
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Benchmark parsing large feeds on threads vs a process pool.')
+  parser.add_argument('--feeds', type=int, default=200)
+  parser.add_argument('--items', type=int, default=400, help='items per feed (400 is about 1.4 MB)')
+  parser.add_argument('--threads', type=int, default=8, help='feeds refreshed at once')
+  parser.add_argument('--workers', type=int, help='parser processes (default one per CPU)')
+  parser.add_argument('--threshold', type=int, default=1_000_000, help='feed size in bytes sent to the pool')
+  parser.add_argument('--latency', type=float, default=0, help='seconds the server waits before answering')
+  parser.add_argument('--output', help='results JSON (default: print only)')
+  args = parser.parse_args()
+
+  sys.path[:0] = [root_folder, bench_folder]
+  from server import BenchServer
+  server = BenchServer(latency=args.latency).start()
+  urls = [server.feed_url(f'parse{ndx}', items=args.items, size=65536) for ndx in range(args.feeds)]
+
+  tmp = tempfile.mkdtemp(prefix='podcast-parse-')
+  os.makedirs(os.path.join(tmp, 'library'))
+  os.environ.update(
+    podcast_folder=os.path.join(tmp, 'library'),
+    state_folder=os.path.join(tmp, 'state'),
+    log_file=os.path.join(tmp, 'podcast.log'),
+    log_level=os.getenv('bench_log_level', 'warning'),
+    parse_pool_threshold=str(args.threshold),
+    # only the parsing is compared
+    catalog='0'
+  )
+
+  results = {'options': vars(args), 'cpus': os.cpu_count()}
+  try:
+    # the server generates each feed once, a warm-up keeps that out of both timings
+    os.environ['parse_pool_workers'] = '0'
+    results['feed_bytes'] = len(__import__('requests').get(urls[0]).content)
+    refresh(urls, args.threads)
+
+    results['threads_seconds'] = refresh(urls, args.threads)
+    os.environ['parse_pool_workers'] = str(args.workers or os.cpu_count())
+    results['pool_seconds'] = refresh(urls, args.threads)
+
+    os.environ['feed_concurrency'] = str(args.threads)
+    results['run_sequential_seconds'] = run(urls, True)
+    results['run_seconds'] = run(urls, False)
+  finally:
+    server.stop()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+  results['speedup'] = results['threads_seconds'] / results['pool_seconds']
+  print(f'{args.feeds} feeds of {results["feed_bytes"] / 1e6:.1f} MB, {results["cpus"]} CPUs: '
+        f'threads {results["threads_seconds"]:.1f}s, process pool {results["pool_seconds"]:.1f}s, '
+        f'speedup {results["speedup"]:.2f}x')
+  print(f'Regular run: one feed at a time {results["run_sequential_seconds"]:.1f}s, '
+        f'load_feeds {results["run_seconds"]:.1f}s, '
+        f'speedup {results["run_sequential_seconds"] / results["run_seconds"]:.2f}x')
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,325 @@
+import io
+import re
+import sys
+import time
+import random
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from email.utils import formatdate
+
+# one silent MPEG-1 layer III frame, 128 kbps 44.1 kHz, no padding
+mp3_frame = bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)
+
+description = '<p>' + 'Synthetic episode description with <a href="https://example.com">links</a>. ' * 40 + '</p>'
+
+def media_bytes(start:int, end:int) -> bytes:
+  """
+  Returns bytes start..end (inclusive) of a synthetic MP3 made of repeated frames.
+  """
+  first = start // len(mp3_frame)
+  last = end // len(mp3_frame)
+  data = mp3_frame * (last - first + 1)
+  offset = start - first * len(mp3_frame)
+  return data[offset:offset + end - start + 1]
+
+
+def feed_xml(base:str, feed_id:str, items:int, size:int, published:float = None, self_url:str = None, hub:str = None,
+             redirect:bool = False) -> bytes:
+  """
+  Builds a synthetic RSS feed.
+
+  Args:
+    base (str): The server's base URL.
+    feed_id (str): Used in the feed title and enclosure URLs.
+    items (int): Number of items.
+    size (int): Enclosure size in bytes.
+    published (float): Timestamp of the newest item (optional). Items are a day apart.
+    self_url (str): The feed's own URL for <atom:link rel="self"> (default base/feed/<id>.xml).
+    hub (str): A WebSub hub to advertise (optional).
+    redirect (bool): Point enclosures at /r/, which redirects to the media, like a tracking prefix.
+
+  Returns:
+    bytes: The feed XML.
+  """
+  published = published or time.time()
+  media = f'{base}/r/media' if redirect else f'{base}/media'
+  out = io.StringIO()
+  out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+  out.write('<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd" xmlns:atom="http://www.w3.org/2005/Atom">')
+  out.write(f'<channel><title>Bench Feed {feed_id}</title><link>{base}</link>')
+  self_url = (self_url or f'{base}/feed/{feed_id}.xml').replace('&', '&amp;')
+  out.write(f'<atom:link href="{self_url}" rel="self" type="application/rss+xml"/>')
+  if hub:
+    out.write(f'<atom:link href="{hub}" rel="hub"/>')
+  out.write(f'<image><url>{base}/art.jpg</url><title>Bench Feed {feed_id}</title></image>')
+  out.write(f'<itunes:image href="{base}/art.jpg"/>')
+  for ndx in range(items, 0, -1):
+    date = formatdate(published - (items - ndx) * 86400)
+    out.write('<item>')
+    out.write(f'<title>Episode {ndx}</title>')
+    out.write(f'<guid isPermaLink="false">{feed_id}-{ndx}</guid>')
+    out.write(f'<pubDate>{date}</pubDate>')
+    out.write(f'<description><![CDATA[{description}]]></description>')
+    out.write(f'<itunes:subtitle>Episode {ndx} of feed {feed_id}</itunes:subtitle>')
+    out.write(f'<itunes:episode>{ndx}</itunes:episode>')
+    out.write(f'<itunes:duration>{size * 8 // 128000}</itunes:duration>')
+    out.write(f'<enclosure url="{media}/{feed_id}-{ndx}.mp3?size={size}" length="{size}" type="audio/mpeg"/>')
+    out.write('</item>')
+  out.write('</channel></rss>')
+  return out.getvalue().encode('utf-8')
+
+
+def fraction(key:str) -> float:
+  """
+  Maps a key to a stable number in [0, 1), so per-feed behaviour is the same on every request.
+  """
+  return int(hashlib.md5(key.encode()).hexdigest()[:8], 16) / 2 ** 32
+
+
+def artwork(px:int) -> bytes:
+  """
+  Returns a JPEG of the given size.
+  """
+  from PIL import Image
+  buffer = io.BytesIO()
+  Image.new('RGB', (px, px), (30, 120, 200)).save(buffer, format='JPEG')
+  return buffer.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+  """
+  Serves synthetic feeds, media and artwork.
+
+  GET /feed/<id>.xml?items=N&size=BYTES    RSS feed with N items
+  GET /media/<id>.mp3?size=BYTES           MP3 data with Range and ETag support
+  GET /r/<path>                             302 redirect to /<path>
+  GET /art.jpg?px=N                         JPEG artwork
+  GET /                                     200 OK (connectivity check)
+
+  Server level options (see BenchServer) add throttling, latency and errors.
+  """
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args) -> None:
+    pass
+
+  def __send(self, status:int, body:bytes, content_type:str, extra:dict = None, length:bool = True) -> None:
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    if length:
+      self.send_header('Content-Length', str(len(body)))
+    else:
+      # the end of the body is the end of the connection
+      self.send_header('Connection', 'close')
+      self.close_connection = True
+    for key, value in (extra or {}).items():
+      self.send_header(key, value)
+    self.end_headers()
+    if self.command != 'HEAD':
+      self.__write(body)
+
+  def __write(self, body:bytes) -> None:
+    throttle = self.server.options.get('throttle')
+    if not throttle:
+      self.wfile.write(body)
+      return
+    # bytes per second, written in 64 KB slices
+    chunk = 65536
+    for start in range(0, len(body), chunk):
+      self.wfile.write(body[start:start + chunk])
+      time.sleep(chunk / throttle)
+
+  def do_HEAD(self) -> None:
+    self.do_GET()
+
+  def do_GET(self) -> None:
+    url = urlparse(self.path)
+    query = parse_qs(url.query)
+    self.server.count(url.path)
+
+    options = self.server.options
+    if options.get('latency') or options.get('latency_jitter'):
+      time.sleep(options.get('latency', 0) + random.uniform(0, options.get('latency_jitter', 0)))
+
+    if url.path == '/':
+      return self.__send(200, b'ok', 'text/plain')
+
+    if options.get('error_rate') and random.random() < options['error_rate']:
+      return self.__send(503, b'unavailable', 'text/plain')
+
+    if url.path.startswith('/r/'):
+      return self.__send(302, b'', 'text/plain', {'Location': self.server.base + self.path[2:]})
+
+    match = re.fullmatch(r'/feed/([\w-]+)\.xml', url.path)
+    if match:
+      feed_id = match.group(1)
+      items = int(query.get('items', ['10'])[0]) + self.server.added.get(feed_id, 0) + self.server.published(feed_id)
+      size = int(query.get('size', ['1048576'])[0])
+      hub = options.get('hub')
+      redirect = fraction(feed_id) < options.get('redirect_rate', 0)
+      body = self.server.cached(('feed', feed_id, items, size, self.path),
+                                lambda: feed_xml(self.server.base, feed_id, items, size, self_url=self.server.base + self.path,
+                                                 hub=hub, redirect=redirect))
+      return self.__send(200, body, 'application/rss+xml')
+
+    match = re.fullmatch(r'/media/([\w-]+)\.mp3', url.path)
+    if match:
+      return self.__media(match.group(1), int(query.get('size', ['1048576'])[0]))
+
+    if url.path == '/art.jpg':
+      px = int(query.get('px', ['600'])[0])
+      body = self.server.cached(('art', px), lambda: artwork(px))
+      return self.__send(200, body, 'image/jpeg')
+
+    self.__send(404, b'not found', 'text/plain')
+
+  def __media(self, media_id:str, size:int) -> None:
+    etag = '"' + hashlib.md5(f'{media_id}-{size}'.encode()).hexdigest() + '"'
+    extra = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+
+    if self.headers.get('If-None-Match') == etag:
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+
+    start, end = 0, size - 1
+    status = 200
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+    if match and self.server.options.get('ranges', True):
+      if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+      else:
+        start = size - int(match.group(2))
+      end = min(end, size - 1)
+      if start > end:
+        return self.__send(416, b'', 'text/plain', {'Content-Range': f'bytes */{size}'})
+      status = 206
+      extra['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    self.__send(status, media_bytes(start, end) if size else b'', 'audio/mpeg', extra,
+                length=self.server.options.get('content_length', True))
+
+
+class _HTTPServer(ThreadingHTTPServer):
+  def handle_error(self, request, client_address) -> None:
+    # clients dropping keep-alive connections aren't worth a traceback
+    if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+      super().handle_error(request, client_address)
+
+
+class BenchServer:
+  """
+  A local HTTP server standing in for feed hosts and CDNs, run on a background thread.
+
+  Options:
+    throttle (int): Limit media and feed transfers to this many bytes per second.
+    latency (float): Seconds to wait before answering each request.
+    latency_jitter (float): Up to this many seconds more, at random.
+    error_rate (float): Fraction of feed and media requests answered with 503.
+    redirect_rate (float): Fraction of feeds whose enclosures go through a redirect.
+    cadence (float): Every feed publishes a new episode this often (seconds), at a different offset per feed.
+    cache (bool): Keep generated feeds in memory (default True).
+    ranges (bool): Honour Range requests (default True).
+    content_length (bool): Send a Content-Length with media (default True).
+    hub (str): A WebSub hub URL every feed advertises.
+  """
+  def __init__(self, host:str = '127.0.0.1', port:int = 0, **options) -> None:
+    self.__httpd = _HTTPServer((host, port), Handler)
+    self.__httpd.daemon_threads = True
+    self.__httpd.options = options
+    self.__httpd.base = f'http://{host}:{self.__httpd.server_address[1]}'
+    self.__httpd.requests = {}
+    self.__httpd.first_request = None
+    self.__httpd.cache = {}
+    self.__httpd.added = {}
+    self.__lock = threading.Lock()
+    self.__httpd.count = self.__count
+    self.__httpd.cached = self.__cached
+    self.__httpd.published = self.__published
+    self.__started = time.time()
+    self.__thread = None
+
+  def __count(self, path:str) -> None:
+    with self.__lock:
+      self.__httpd.requests[path] = self.__httpd.requests.get(path, 0) + 1
+      if self.__httpd.first_request is None:
+        self.__httpd.first_request = time.time()
+
+  def __published(self, feed_id:str) -> int:
+    cadence = self.__httpd.options.get('cadence')
+    if not cadence:
+      return 0
+    return int((time.time() - self.__started + fraction(feed_id) * cadence) // cadence)
+
+  def __cached(self, key, build):
+    if not self.__httpd.options.get('cache', True):
+      return build()
+    body = self.__httpd.cache.get(key)
+    if body is None:
+      body = build()
+      self.__httpd.cache[key] = body
+    return body
+
+  @property
+  def base(self) -> str:
+    return self.__httpd.base
+
+  @property
+  def options(self) -> dict:
+    return self.__httpd.options
+
+  @property
+  def requests(self) -> dict:
+    return self.__httpd.requests
+
+  @property
+  def first_request(self) -> float:
+    """
+    When the first request since start or reset() arrived (time.time()), or None.
+    """
+    return self.__httpd.first_request
+
+  def reset(self) -> None:
+    """
+    Clears request counts and the first request time.
+    """
+    with self.__lock:
+      self.__httpd.requests.clear()
+      self.__httpd.first_request = None
+
+  def add_episodes(self, feed_id:str, count:int = 1) -> None:
+    """
+    Publishes new episodes on a feed (newer than the ones it had).
+    """
+    with self.__lock:
+      self.__httpd.added[feed_id] = self.__httpd.added.get(feed_id, 0) + count
+
+  def feed_url(self, feed_id:str, items:int = 10, size:int = 1_048_576) -> str:
+    return f'{self.base}/feed/{feed_id}.xml?items={items}&size={size}'
+
+  def media_url(self, media_id:str, size:int) -> str:
+    return f'{self.base}/media/{media_id}.mp3?size={size}'
+
+  def start(self) -> 'BenchServer':
+    self.__thread = threading.Thread(target=self.__httpd.serve_forever, daemon=True)
+    self.__thread.start()
+    return self
+
+  def stop(self) -> None:
+    self.__httpd.shutdown()
+    self.__httpd.server_close()
+
+
+if __name__ == '__main__':
+  server = BenchServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8000).start()
+  print(f'Serving on {server.base} (ctrl+c to stop)')
+  try:
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    server.stop()
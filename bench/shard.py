@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Sharded deployment check.
+
+Runs several podcast.py processes as separate nodes (own state folder, shared library and
+'shard_dir') against a local stand-in server, the way cron runs them on several boxes. Each
+round starts every node at once and reports how many feeds each refreshed, feeds nobody
+refreshed and feeds refreshed more than once. One node joins after the first round and is
+stopped at the end. Once its leases run out the remaining nodes are expected to take its feeds
+over. Finally the shared journal players sync from is checked for every node's downloads.
+
+Exits with status 1 if a feed is refreshed twice in a round, the cluster doesn't converge
+to refreshing every feed exactly once, or the journal misses an episode.
+
+usage: python bench/shard.py [--feeds 60] [--nodes 3] [--lease 20]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+root_folder = os.path.dirname(bench_folder)
+
+
+def node_env(tmp:str, node:str, base:dict) -> dict:
+  return dict(base,
+    shard_node=node,
+    state_folder=os.path.join(tmp, 'state', node),
+    metrics_dir=os.path.join(tmp, 'metrics', node),
+    log_file=os.path.join(tmp, f'{node}.log'))
+
+
+def run_round(tmp:str, nodes:list[str], base:dict) -> dict[str, list[str]]:
+  """
+  Runs podcast.py on every node at once.
+
+  Returns:
+    dict[str, list[str]]: The feeds each node refreshed.
+  """
+  processes = {}
+  for node in nodes:
+    env = node_env(tmp, node, base)
+    shutil.rmtree(env['metrics_dir'], ignore_errors=True)
+    processes[node] = subprocess.Popen([sys.executable, os.path.join(root_folder, 'podcast.py')], cwd=root_folder,
+                                       env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  refreshed = {}
+  for node, process in processes.items():
+    process.wait()
+    try:
+      with open(os.path.join(node_env(tmp, node, base)['metrics_dir'], 'metrics.json')) as f:
+        feeds = json.load(f)['feeds']
+    except (OSError, ValueError):
+      feeds = {}
+    refreshed[node] = [url for url, entry in feeds.items() if 'feed_refresh' in entry['phases']]
+  return refreshed
+
+
+def report(name:str, refreshed:dict[str, list[str]], urls:list[str]) -> dict:
+  counts = {url: 0 for url in urls}
+  for feeds in refreshed.values():
+    for url in feeds:
+      counts[url] += 1
+  result = {
+    'per_node': {node: len(feeds) for node, feeds in refreshed.items()},
+    'missed': sum(1 for count in counts.values() if count == 0),
+    'duplicated': sum(1 for count in counts.values() if count > 1)
+  }
+  nodes = ', '.join(f'{node} {count}' for node, count in result['per_node'].items())
+  print(f'{name}: {nodes} | missed {result["missed"]}, refreshed twice {result["duplicated"]}', flush=True)
+  return result
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Run several podcast.py nodes sharing one shard directory.')
+  parser.add_argument('--feeds', type=int, default=60)
+  parser.add_argument('--nodes', type=int, default=3)
+  parser.add_argument('--lease', type=float, default=20, help='shard_lease in seconds')
+  parser.add_argument('--output', help='results JSON (default: print only)')
+  args = parser.parse_args()
+
+  sys.path[:0] = [root_folder, bench_folder]
+  from server import BenchServer
+  server = BenchServer().start()
+  urls = [server.feed_url(f'shard{ndx}', items=2, size=65536) for ndx in range(args.feeds)]
+
+  tmp = tempfile.mkdtemp(prefix='podcast-shard-')
+  base = dict(os.environ,
+    podcast_folder=os.path.join(tmp, 'library'),
+    shard_dir=os.path.join(tmp, 'shard'),
+    shard_lease=str(args.lease),
+    log_level=os.getenv('bench_log_level', 'info'),
+    connectivity_url=f'{server.base}/',
+    subscriptions=','.join(urls),
+    catalog='0')
+  os.makedirs(base['podcast_folder'])
+
+  nodes = [f'node{ndx}' for ndx in range(args.nodes)]
+  rounds = {}
+  failed = False
+  try:
+    name = f'{len(nodes) - 1} nodes'
+    rounds[name] = report(name, run_round(tmp, nodes[:-1], base), urls)
+    # the joining node waits for the others to hand its feeds over on their next run
+    for ndx in range(3):
+      name = f'all nodes, round {ndx + 1}'
+      rounds[name] = report(name, run_round(tmp, nodes, base), urls)
+
+    stopped, nodes = nodes[-1], nodes[:-1]
+    print(f'stopping {stopped}, waiting {args.lease:.0f}s for its leases to expire', flush=True)
+    time.sleep(args.lease + 1)
+    for ndx in range(3):
+      name = f'without {stopped}, round {ndx + 1}'
+      rounds[name] = report(name, run_round(tmp, nodes, base), urls)
+
+    failed = any(result['duplicated'] for result in rounds.values())
+    for name in ('all nodes, round 3', f'without {stopped}, round 3'):
+      failed = failed or rounds[name]['missed'] > 0
+
+    # players sync from one journal, it has to list what every node downloaded
+    with open(os.path.join(base['shard_dir'], 'state', 'journal.jsonl')) as f:
+      journaled = {json.loads(line)['path'] for line in list(f)[1:]}
+    library = {os.path.join(folder, name) for folder in os.listdir(base['podcast_folder'])
+               for name in os.listdir(os.path.join(base['podcast_folder'], folder)) if name.endswith('.mp3')}
+    print(f'journal: {len(library & journaled)} of {len(library)} episodes', flush=True)
+    failed = failed or not library <= journaled
+  finally:
+    server.stop()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+  print('FAILED' if failed else 'OK')
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'options': vars(args), 'rounds': rounds}, f, indent=2)
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+  main()
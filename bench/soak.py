@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Soak test for podcast.py at thousands of subscriptions.
+
+Serves N synthetic feeds from local stand-in servers (spread over several loopback addresses,
+so each looks like its own host) with latency, errors, redirects and a publishing cadence, then
+runs podcast.py the way cron does, back to back or every --interval seconds, until --duration
+is up. While each run is going its memory, open file descriptors, sockets and threads are
+sampled from /proc.
+
+Reports throughput, p50/p99 time per feed and the resource samples, and exits with status 1
+when a resource keeps growing: within a run (samples late in the run well above early ones)
+or across runs (peak memory climbing run after run).
+
+usage: python bench/soak.py [--feeds 1000] [--duration 1h] [--interval 0] [--hosts 8]
+                            [--latency 0.05] [--jitter 0.2] [--error-rate 0.02]
+                            [--redirect-rate 0.3] [--cadence 3600] [--size 65536]
+                            [--max-rss-growth 64] [--max-fd-growth 32] [--output FILE]
+
+Linux only (reads /proc).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+root_folder = os.path.dirname(bench_folder)
+
+
+def parse_duration(value:str) -> float:
+  """
+  Parses '90', '90s', '15m' or '2h' into seconds.
+  """
+  units = {'s': 1, 'm': 60, 'h': 3600}
+  if value[-1] in units:
+    return float(value[:-1]) * units[value[-1]]
+  return float(value)
+
+
+def percentile(values:list[float], pct:float) -> float:
+  if not values:
+    return None
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def process_sample(pid:int) -> dict:
+  """
+  Reads a process's resident memory, open file descriptors, sockets and threads from /proc.
+
+  Returns:
+    dict: 'rss_mb', 'fds', 'sockets' and 'threads', or None if the process is gone.
+  """
+  try:
+    with open(f'/proc/{pid}/status') as f:
+      status = dict(line.split(':', 1) for line in f if ':' in line)
+    fds = sockets = 0
+    for fd in os.listdir(f'/proc/{pid}/fd'):
+      fds += 1
+      try:
+        sockets += os.readlink(f'/proc/{pid}/fd/{fd}').startswith('socket:')
+      except OSError:
+        pass
+  except (OSError, ValueError):
+    return None
+  return {
+    'rss_mb': int(status['VmRSS'].split()[0]) / 1024,
+    'fds': fds,
+    'sockets': sockets,
+    'threads': int(status['Threads'])
+  }
+
+
+class Sampler:
+  """
+  Samples a process on a background thread until it exits.
+  """
+  def __init__(self, pid:int, every:float) -> None:
+    self.samples = []
+    self.__pid = pid
+    self.__every = every
+    self.__start = time.time()
+    self.__thread = threading.Thread(target=self.__run, daemon=True)
+    self.__thread.start()
+
+  def __run(self) -> None:
+    while True:
+      sample = process_sample(self.__pid)
+      if not sample:
+        return
+      self.samples.append(dict(sample, t=round(time.time() - self.__start, 2)))
+      time.sleep(self.__every)
+
+  def join(self) -> None:
+    self.__thread.join()
+
+
+def grows(values:list[float], limit:float) -> bool:
+  """
+  Decides if a series grows without bound: after a warm-up (the first fifth) the last third
+  sits more than 'limit' above the first third and keeps climbing.
+  """
+  values = values[len(values) // 5:]
+  if len(values) < 6:
+    return False
+  third = len(values) // 3
+  early, late = values[:third], values[-third:]
+  return min(late) - max(early) > limit and late[-1] >= max(late[:-1] or late)
+
+
+def cron_run(env:dict, every:float) -> dict:
+  """
+  Runs podcast.py once, sampling it while it runs.
+
+  Returns:
+    dict: Duration, per feed times, errors and resource samples of the run.
+  """
+  start = time.time()
+  process = subprocess.Popen([sys.executable, os.path.join(root_folder, 'podcast.py')], cwd=root_folder, env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  sampler = Sampler(process.pid, every)
+  process.wait()
+  sampler.join()
+  seconds = time.time() - start
+
+  try:
+    with open(os.path.join(env['metrics_dir'], 'metrics.json')) as f:
+      data = json.load(f)
+  except (OSError, ValueError):
+    data = {'feeds': {}, 'counters': {}}
+  # a feed is loaded (fetched and parsed) with the others first, then its downloads run
+  feed_times = [entry['phases'].get('feed_load', 0) + entry['phases']['feed_refresh']
+                for entry in data['feeds'].values() if 'feed_refresh' in entry['phases']]
+
+  samples = sampler.samples
+  return {
+    'start': start,
+    'seconds': seconds,
+    'exit_code': process.returncode,
+    'feeds': len(feed_times),
+    'feeds_per_second': len(feed_times) / seconds if seconds else None,
+    'feed_p50_ms': (percentile(feed_times, 50) or 0) * 1000,
+    'feed_p99_ms': (percentile(feed_times, 99) or 0) * 1000,
+    'bytes_downloaded': data['counters'].get('bytes_downloaded', 0),
+    'peak': {key: max((sample[key] for sample in samples), default=None) for key in ('rss_mb', 'fds', 'sockets', 'threads')},
+    'samples': samples
+  }
+
+
+def check(runs:list[dict], max_rss_growth:float, max_fd_growth:int) -> list[str]:
+  """
+  Looks for unbounded growth within each run and across runs.
+
+  Returns:
+    list[str]: Failure reasons (empty if none).
+  """
+  failures = []
+  for ndx, run in enumerate(runs):
+    samples = run['samples']
+    for key, limit in (('rss_mb', max_rss_growth), ('fds', max_fd_growth), ('sockets', max_fd_growth), ('threads', max_fd_growth)):
+      if grows([sample[key] for sample in samples], limit):
+        failures.append(f'run {ndx + 1}: {key} kept growing during the run (limit {limit})')
+    if run['exit_code'] != 0:
+      failures.append(f'run {ndx + 1}: exit code {run["exit_code"]}')
+
+  # the first run downloads every feed's backlog, steady state starts with the second
+  steady = runs[1:]
+  for key, limit in (('rss_mb', max_rss_growth), ('fds', max_fd_growth), ('sockets', max_fd_growth)):
+    peaks = [run['peak'][key] for run in steady if run['peak'][key] is not None]
+    if len(peaks) >= 3 and all(b >= a for a, b in zip(peaks, peaks[1:])) and peaks[-1] - peaks[0] > limit:
+      failures.append(f'peak {key} grew every run: {peaks[0]:g} -> {peaks[-1]:g}')
+  return failures
+
+
+def start_servers(args):
+  sys.path.insert(0, bench_folder)
+  from server import BenchServer
+  options = {
+    'latency': args.latency,
+    'latency_jitter': args.jitter,
+    'error_rate': args.error_rate,
+    'redirect_rate': args.redirect_rate,
+    'cadence': args.cadence,
+    # thousands of feeds, each with a new version every cadence, would pile up in memory
+    'cache': False
+  }
+  return [BenchServer(host=f'127.0.0.{ndx + 1}', **options).start() for ndx in range(args.hosts)]
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Soak test podcast.py against thousands of synthetic feeds.')
+  parser.add_argument('--feeds', type=int, default=1000)
+  parser.add_argument('--duration', default='1h', help='e.g. 90s, 15m, 6h')
+  parser.add_argument('--interval', type=float, default=0, help='seconds from the start of one run to the next (0: back to back)')
+  parser.add_argument('--hosts', type=int, default=8, help='loopback addresses to spread feeds over')
+  parser.add_argument('--latency', type=float, default=0.05)
+  parser.add_argument('--jitter', type=float, default=0.2)
+  parser.add_argument('--error-rate', type=float, default=0.02)
+  parser.add_argument('--redirect-rate', type=float, default=0.3)
+  parser.add_argument('--cadence', type=float, default=3600, help='seconds between new episodes per feed')
+  parser.add_argument('--items', type=int, default=3, help='episodes per feed at the start')
+  parser.add_argument('--size', type=int, default=65536, help='episode size in bytes')
+  parser.add_argument('--sample-every', type=float, default=1.0)
+  parser.add_argument('--max-rss-growth', type=float, default=64, help='MB')
+  parser.add_argument('--max-fd-growth', type=int, default=32)
+  parser.add_argument('--output', help='results JSON (default bench/results/soak-<time>.json)')
+  args = parser.parse_args()
+
+  servers = start_servers(args)
+  urls = [servers[ndx % len(servers)].feed_url(f'soak{ndx}', items=args.items, size=args.size) for ndx in range(args.feeds)]
+
+  tmp = tempfile.mkdtemp(prefix='podcast-soak-')
+  env = dict(os.environ,
+    podcast_folder=os.path.join(tmp, 'library'),
+    state_folder=os.path.join(tmp, 'state'),
+    metrics_dir=os.path.join(tmp, 'metrics'),
+    log_file=os.path.join(tmp, 'podcast.log'),
+    log_level=os.getenv('bench_log_level', 'warning'),
+    connectivity_url=f'{servers[0].base}/',
+    subscriptions=','.join(urls))
+  os.makedirs(env['podcast_folder'])
+
+  deadline = time.time() + parse_duration(args.duration)
+  runs = []
+  try:
+    while time.time() < deadline:
+      run = cron_run(env, args.sample_every)
+      runs.append(run)
+      print(f'run {len(runs)}: {run["feeds"]} feeds in {run["seconds"]:.1f}s, {run["feeds_per_second"] or 0:.1f} feeds/s, '
+            f'p50 {run["feed_p50_ms"]:.0f}ms p99 {run["feed_p99_ms"]:.0f}ms, peak rss {run["peak"]["rss_mb"] or 0:.1f}MB '
+            f'fds {run["peak"]["fds"]} sockets {run["peak"]["sockets"]} threads {run["peak"]["threads"]}', flush=True)
+      wait = run['start'] + args.interval - time.time()
+      if wait > 0 and time.time() + wait < deadline:
+        time.sleep(wait)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    for server in servers:
+      server.stop()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+  failures = check(runs, args.max_rss_growth, args.max_fd_growth)
+  results = {'options': vars(args), 'runs': runs, 'failures': failures}
+  output = args.output or os.path.join(bench_folder, 'results', time.strftime('soak-%Y%m%d-%H%M%S.json'))
+  os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+  with open(output, 'w') as f:
+    json.dump(results, f, indent=2)
+  print(f'Results written to {output}')
+
+  for failure in failures:
+    print(f'FAIL: {failure}')
+  sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for podcast.py.
+
+Measures the `python -X importtime` total for importing podcast.py, the modules that
+cost the most, and the time from process start to the first network request and to
+the end of a no-op cron run (every episode already downloaded).
+
+usage: python bench/startup.py [--runs N]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+root_folder = os.path.dirname(bench_folder)
+
+
+def importtime(top:int = 10) -> dict:
+  """
+  Imports podcast in a fresh interpreter with -X importtime.
+
+  Returns:
+    dict: 'total_ms' and the 'top' first level imports by cumulative time.
+  """
+  result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import podcast'],
+                          cwd=root_folder, capture_output=True, text=True, check=True)
+  modules = {}
+  total = 0
+  # children are printed before their parent, so collect first level imports until 'podcast' shows up
+  for line in result.stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+      continue
+    _, cumulative, name = line[len('import time:'):].split('|')
+    depth = (len(name) - len(name.lstrip()) - 1) // 2
+    if depth == 1:
+      modules[name.strip()] = int(cumulative)
+    elif depth == 0:
+      if name.strip() == 'podcast':
+        total = int(cumulative)
+        break
+      modules = {}
+  ranked = sorted(modules.items(), key=lambda item: -item[1])[:top]
+  return {'total_ms': total / 1000, 'top': {name: us / 1000 for name, us in ranked}}
+
+
+def cron_run(server) -> dict:
+  """
+  Runs podcast.py as cron would and times it from process start.
+
+  Returns:
+    dict: 'first_request_ms' and 'total_ms'.
+  """
+  server.reset()
+  start = time.time()
+  subprocess.run([sys.executable, os.path.join(root_folder, 'podcast.py')],
+                 cwd=root_folder, capture_output=True, check=True)
+  total = time.time() - start
+  first = server.first_request
+  return {
+    'first_request_ms': (first - start) * 1000 if first else None,
+    'total_ms': total * 1000
+  }
+
+
+def bench_startup(server, runs:int) -> dict:
+  """
+  Best of several runs. Expects the environment to point at a bench library and server (bench.setup_env).
+  """
+  imports = [importtime() for _ in range(runs)]
+  best_import = min(imports, key=lambda result: result['total_ms'])
+
+  feeds = os.environ.get('subscriptions', '')
+  os.environ['subscriptions'] = server.feed_url('startup', items=3, size=65536)
+  try:
+    # first run downloads the episodes, the rest find nothing new
+    cron_run(server)
+    runs = [cron_run(server) for _ in range(runs)]
+  finally:
+    os.environ['subscriptions'] = feeds
+
+  return {
+    'import_ms': best_import['total_ms'],
+    'import_top_ms': best_import['top'],
+    'first_request_ms': min(run['first_request_ms'] for run in runs),
+    'noop_run_ms': min(run['total_ms'] for run in runs)
+  }
+
+
+def main() -> None:
+  sys.path.insert(0, bench_folder)
+  from server import BenchServer
+  from bench import setup_env
+
+  args = sys.argv[1:]
+  runs = int(args[args.index('--runs') + 1]) if '--runs' in args else 5
+
+  tmp = tempfile.mkdtemp(prefix='podcast-startup-')
+  server = BenchServer().start()
+  setup_env(tmp, server)
+  try:
+    print(json.dumps(bench_startup(server, runs), indent=2))
+  finally:
+    server.stop()
+    os.chdir(root_folder)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main()
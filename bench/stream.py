@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Play-while-downloading benchmark.
+
+Serves an episode from a throttled local stand-in server and compares how long a player waits
+before it can start: the whole download (what playing from the library needs) against the first
+bytes through the stream server (podcast.py stream). Also times a seek far ahead of the download
+and checks the streamed bytes against the source.
+
+usage: python bench/stream.py [--size 20000000] [--throttle 1000000] [--output FILE]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import xml.etree.ElementTree as ET
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+root_folder = os.path.dirname(bench_folder)
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Benchmark time to first audio, streamed vs downloaded.')
+  parser.add_argument('--size', type=int, default=20_000_000, help='episode size in bytes')
+  parser.add_argument('--throttle', type=int, default=1_000_000, help='server bytes per second')
+  parser.add_argument('--output', help='results JSON (default: print only)')
+  args = parser.parse_args()
+
+  sys.path[:0] = [root_folder, bench_folder]
+  import requests
+  from server import BenchServer, media_bytes
+  server = BenchServer(throttle=args.throttle).start()
+
+  tmp = tempfile.mkdtemp(prefix='podcast-stream-')
+  os.makedirs(os.path.join(tmp, 'library'))
+  os.environ.update(
+    podcast_folder=os.path.join(tmp, 'library'),
+    state_folder=os.path.join(tmp, 'state'),
+    log_file=os.path.join(tmp, 'podcast.log'),
+    log_level=os.getenv('bench_log_level', 'warning'),
+    connectivity_url=server.base,
+    stream_idle='1',
+    catalog='0',
+    dedup='0'
+  )
+
+  results = {'options': vars(args)}
+  stream = None
+  try:
+    from podcast import Podcast
+    from lib.stream_server import StreamServer
+
+    # two feeds with the same media, so the streamed one isn't a duplicate of the downloaded one
+    feeds = {name: server.feed_url(name, items=1, size=args.size) for name in ('download', 'stream')}
+    podcasts = {url: Podcast(url, probe=False) for url in feeds.values()}
+    enclosure = {url: ET.fromstring(requests.get(url).content).find('channel/item/enclosure').get('url') for url in feeds.values()}
+
+    start = time.perf_counter()
+    podcasts[feeds['download']].downloadNewest(False)
+    results['download_seconds'] = time.perf_counter() - start
+
+    stream = StreamServer(lambda feed, url: podcasts[feed].streamEpisode(url), port=0).start()
+    local = stream.url(feeds['stream'], enclosure[feeds['stream']])
+    start = time.perf_counter()
+    with requests.get(local, stream=True) as response:
+      first = next(response.iter_content(4096))
+    results['first_byte_seconds'] = time.perf_counter() - start
+
+    offset = args.size * 3 // 4
+    start = time.perf_counter()
+    seek = requests.get(local, headers={'Range': f'bytes={offset}-{offset + 65535}'})
+    results['seek_seconds'] = time.perf_counter() - start
+    results['bytes_match'] = (first == media_bytes(0, len(first) - 1)
+                              and seek.content == media_bytes(offset, offset + 65535))
+  finally:
+    if stream:
+      stream.stop()
+    server.stop()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+  print(f'{args.size / 1e6:.0f} MB at {args.throttle / 1e6:.1f} MB/s: '
+        f'download {results["download_seconds"]:.1f}s, stream first byte {results["first_byte_seconds"]:.2f}s, '
+        f'seek to 75% {results["seek_seconds"]:.2f}s, bytes {"match" if results["bytes_match"] else "DIFFER"}')
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Player sync benchmark.
+
+Builds a synthetic library (source) and player tree with controlled mtimes around
+'old_date', then times a sync engine for three scenarios:
+
+  cold    empty player, every recent episode is copied
+  noop    player already up to date
+  delta   a few new episodes in the library and a few player episodes gone past old_date
+
+After the cold sync the player has a cursor into the library journal and the other two
+only apply journal entries. --no-journal scans every folder each time instead.
+
+For each it reports wall time, the engine's scan/plan/copy/delete phases (from metrics),
+file system calls made through the os module, and the bytes and files copied and deleted.
+
+The default engine is lib/update_player.py's updatePlayer. Any function with the same
+signature can be compared against it with --engine module:function.
+
+Put the player tree on another file system (a USB stick, or a loopback mounted FAT or
+exFAT image) with --target.
+
+usage: python bench/sync.py [--files 100,1000,10000] [--per-podcast 50] [--recent 0.2]
+                            [--delta 0.01] [--size 16384] [--target DIR] [--engine MODULE:FUNC]
+                            [--no-journal]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import importlib
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+root_folder = os.path.dirname(bench_folder)
+
+# os functions that are one system call each (or close to it), counted while an engine runs
+counted_calls = ['stat', 'lstat', 'listdir', 'scandir', 'open', 'remove', 'unlink', 'rmdir', 'mkdir',
+                 'rename', 'replace', 'utime', 'chmod', 'sendfile', 'copy_file_range', 'listxattr', 'setxattr', 'getxattr']
+
+
+class CallCounter:
+  """
+  Counts calls to the os module's file system functions (and builtin open) while active.
+
+  Engines calling the os module, os.path, glob and shutil are all covered. Calls made from
+  C code (e.g. DirEntry.stat) are not, so the counts are a lower bound.
+  """
+  def __init__(self) -> None:
+    self.counts = {}
+    self.__saved = {}
+
+  def __wrap(self, name:str, func):
+    counts = self.counts
+    def counted(*args, **kwargs):
+      counts[name] = counts.get(name, 0) + 1
+      return func(*args, **kwargs)
+    return counted
+
+  def __enter__(self) -> 'CallCounter':
+    import builtins
+    import io
+    for name in counted_calls:
+      if hasattr(os, name):
+        self.__saved[(os, name)] = getattr(os, name)
+        setattr(os, name, self.__wrap(name, getattr(os, name)))
+    for module in (builtins, io):
+      self.__saved[(module, 'open')] = module.open
+      module.open = self.__wrap('open_file', module.open)
+    return self
+
+  def __exit__(self, *exc) -> bool:
+    for (module, name), func in self.__saved.items():
+      setattr(module, name, func)
+    self.__saved.clear()
+    return False
+
+
+def snapshot(folder:str) -> dict[str, tuple[int, int]]:
+  """
+  Returns path -> (size, mtime_ns) for every file under folder, except hidden ones (e.g. the sync cursor).
+  """
+  files = {}
+  for path, _, names in os.walk(folder):
+    for name in names:
+      if name.startswith('.'):
+        continue
+      stat = os.stat(os.path.join(path, name))
+      files[os.path.join(path, name)] = (stat.st_size, stat.st_mtime_ns)
+  return files
+
+
+def episode_time(recent:bool, old_date:datetime.date) -> float:
+  """
+  A random mtime inside the sync window (after old_date) or well before it.
+  """
+  cutoff = datetime.datetime.combine(old_date, datetime.time()).timestamp()
+  if recent:
+    # at least a day clear of old_date, so a slow run doesn't move files across it
+    return random.uniform(cutoff + 2 * 86400, time.time())
+  return random.uniform(cutoff - 365 * 86400, cutoff - 2 * 86400)
+
+
+def build_library(folder:str, files:int, per_podcast:int, recent:float, size:int, old_date:datetime.date) -> list[str]:
+  """
+  Writes a synthetic library: folders of mp3 files plus a cover.jpg each.
+
+  Returns:
+    list[str]: The podcast folder names.
+  """
+  data = os.urandom(size)
+  podcasts = []
+  for ndx in range(files):
+    podcast = f'Podcast {ndx // per_podcast:05d}'
+    location = os.path.join(folder, podcast)
+    if ndx % per_podcast == 0:
+      os.makedirs(location)
+      with open(os.path.join(location, 'cover.jpg'), 'wb') as f:
+        f.write(data[:4096])
+      podcasts.append(podcast)
+    path = os.path.join(location, f'Episode.{ndx:06d}.mp3')
+    with open(path, 'wb') as f:
+      f.write(data)
+    mtime = episode_time(random.random() < recent, old_date)
+    os.utime(path, (mtime, mtime))
+  return podcasts
+
+
+def make_delta(library:str, player:str, count:int, size:int, old_date:datetime.date) -> None:
+  """
+  Publishes 'count' new episodes and ages 'count' episodes already on the player (and in the library) past old_date.
+  The changes are journaled the way podcast.py journals downloads and retagging.
+  """
+  from lib import journal
+  podcasts = sorted(name for name in os.listdir(library) if not name.startswith('.'))
+  data = os.urandom(size)
+  for ndx in range(count):
+    path = os.path.join(library, random.choice(podcasts), f'New.{ndx:06d}.mp3')
+    with open(path, 'wb') as f:
+      f.write(data)
+    journal.record(journal.ADDED, path)
+
+  on_player = [os.path.join(path, name) for path, _, names in os.walk(player) for name in names if name.endswith('.mp3')]
+  for path in random.sample(on_player, min(count, len(on_player))):
+    mtime = episode_time(False, old_date)
+    source = os.path.join(library, os.path.relpath(path, os.path.join(player, 'Podcasts')))
+    for file in (path, source):
+      if os.path.exists(file):
+        os.utime(file, (mtime, mtime))
+    if os.path.exists(source):
+      journal.record(journal.RETAGGED, source)
+
+
+def run_engine(engine, player:str) -> dict:
+  """
+  Runs one sync and measures it.
+
+  Returns:
+    dict: 'seconds', 'phases' (seconds per metrics phase), 'calls', and what changed on the player.
+  """
+  from lib.metrics import metrics
+  before = snapshot(player)
+  metrics.reset()
+  with CallCounter() as counter:
+    start = time.perf_counter()
+    engine(player, None, bypass=True)
+    seconds = time.perf_counter() - start
+  after = snapshot(player)
+
+  written = [path for path, info in after.items() if before.get(path) != info]
+  deleted = [path for path in before if path not in after]
+  phases = metrics.summary()['phases']
+  return {
+    'seconds': seconds,
+    'phases': {phase.replace('player_', ''): round(value['seconds'], 6) for phase, value in phases.items() if phase != 'player_sync'},
+    'calls': dict(sorted(counter.counts.items(), key=lambda item: -item[1])),
+    'total_calls': sum(counter.counts.values()),
+    'files_copied': len(written),
+    'bytes_copied': sum(after[path][0] for path in written),
+    'files_deleted': len(deleted)
+  }
+
+
+def bench_sync(engine, files:int, args, tmp:str, target:str) -> dict:
+  from lib.old_date import old_date
+  library = os.path.join(tmp, f'library-{files}')
+  player = os.path.join(target, f'player-{files}')
+  os.makedirs(library)
+  os.makedirs(player)
+  os.environ['podcast_folder'] = library
+  # each library gets its own journal, started from the library on the first sync
+  os.environ['state_folder'] = os.path.join(tmp, f'state-{files}')
+
+  start = time.perf_counter()
+  build_library(library, files, args.per_podcast, args.recent, args.size, old_date)
+  results = {'files': files, 'build_seconds': time.perf_counter() - start}
+  try:
+    results['cold'] = run_engine(engine, player)
+    results['noop'] = run_engine(engine, player)
+    make_delta(library, player, max(1, int(files * args.delta)), args.size, old_date)
+    results['delta'] = run_engine(engine, player)
+  finally:
+    shutil.rmtree(library, ignore_errors=True)
+    shutil.rmtree(player, ignore_errors=True)
+  return results
+
+
+def load_engine(spec:str):
+  module, _, name = spec.partition(':')
+  return getattr(importlib.import_module(module), name)
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Benchmark syncing the library to a player.')
+  parser.add_argument('--files', default='100,1000,10000', help='library sizes to test, comma separated (up to 50000)')
+  parser.add_argument('--per-podcast', type=int, default=50, help='episodes per podcast folder')
+  parser.add_argument('--recent', type=float, default=0.2, help='fraction of episodes newer than old_date')
+  parser.add_argument('--delta', type=float, default=0.01, help='fraction of episodes added and aged for the delta sync')
+  parser.add_argument('--size', type=int, default=16384, help='episode size in bytes')
+  parser.add_argument('--target', help='folder to build the player tree in (default: a temp folder)')
+  parser.add_argument('--engine', default='lib.update_player:updatePlayer', help='sync function, module:function')
+  parser.add_argument('--no-journal', action='store_true', help='scan every folder on each sync instead of using the library journal')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--output', help='results JSON (default: print only)')
+  args = parser.parse_args()
+
+  random.seed(args.seed)
+  sys.path.insert(0, root_folder)
+  tmp = tempfile.mkdtemp(prefix='podcast-sync-')
+  os.environ.setdefault('log_level', os.getenv('bench_log_level', 'warning'))
+  os.environ.setdefault('log_file', os.path.join(tmp, 'podcast.log'))
+  if args.no_journal:
+    os.environ['sync_journal'] = '0'
+  engine = load_engine(args.engine)
+  from lib.metrics import metrics
+  # phase timers only record when metrics are on, a hook turns them on without writing files
+  metrics.add_hook(lambda phase: None)
+
+  results = {'engine': args.engine, 'options': vars(args), 'runs': []}
+  try:
+    for files in [int(value) for value in args.files.split(',')]:
+      run = bench_sync(engine, files, args, tmp, args.target or tmp)
+      results['runs'].append(run)
+      for scenario in ('cold', 'noop', 'delta'):
+        data = run[scenario]
+        phases = ' '.join(f'{phase} {seconds * 1000:.0f}ms' for phase, seconds in data['phases'].items())
+        print(f'{files:>6} files {scenario:<5} {data["seconds"] * 1000:8.1f}ms  {data["total_calls"]:>7} calls  '
+              f'{data["files_copied"]:>5} copied ({data["bytes_copied"] / 1048576:.1f} MB)  {data["files_deleted"]:>5} deleted  {phases}',
+              flush=True)
+  finally:
+    shutil.rmtree(tmp, ignore_errors=True)
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+  main()
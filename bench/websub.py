@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+End to end check of 'podcast.py websub' against the local stand-in hub.
+
+Runs the subscriber daemon against a feed that advertises bench/hub.py, then measures how long
+the hub takes to verify the subscription, that a polling run skips the pushed feed, and the time
+from publishing a new episode to it being on disk.
+
+usage: python bench/websub.py
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import shutil
+import tempfile
+import subprocess
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+root_folder = os.path.dirname(bench_folder)
+
+
+def wait_for(check, timeout:float = 30) -> float:
+  """
+  Polls check() until it returns True.
+
+  Returns:
+    float: Seconds waited.
+
+  Raises:
+    TimeoutError: If check() never returned True.
+  """
+  start = time.perf_counter()
+  while not check():
+    if time.perf_counter() - start > timeout:
+      raise TimeoutError
+    time.sleep(0.02)
+  return time.perf_counter() - start
+
+
+def free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1]
+
+
+def episodes(folder:str) -> int:
+  return sum(len([name for name in files if name.endswith('.mp3')]) for _, _, files in os.walk(folder))
+
+
+def bench_websub(server, hub) -> dict:
+  """
+  Expects the environment to point at a bench library and server (bench.setup_env).
+  """
+  url = server.feed_url('push', items=2, size=65536)
+  topic = url
+  port = free_port()
+  os.environ.update({
+    'subscriptions': url,
+    'websub_callback': f'http://127.0.0.1:{port}/websub',
+    'websub_check_interval': '1'
+  })
+  library = os.environ['podcast_folder']
+  results = {}
+
+  daemon = subprocess.Popen([sys.executable, os.path.join(root_folder, 'podcast.py'), 'websub'], cwd=root_folder)
+  try:
+    results['subscribe_ms'] = wait_for(lambda: any(sub['topic'] == topic for sub in hub.subscribers.values())) * 1000
+    wait_for(lambda: episodes(library) == 1)
+
+    from lib.websub import pushed_feeds
+    wait_for(lambda: url in pushed_feeds())
+    server.reset()
+    subprocess.run([sys.executable, os.path.join(root_folder, 'podcast.py')], cwd=root_folder, check=True)
+    results['poll_skipped'] = not server.requests.get('/feed/push.xml')
+
+    server.add_episodes('push')
+    start = time.perf_counter()
+    statuses = hub.publish(topic)
+    results['notify_status'] = statuses
+    wait_for(lambda: episodes(library) == 2)
+    results['publish_to_disk_ms'] = (time.perf_counter() - start) * 1000
+  finally:
+    daemon.send_signal(signal.SIGTERM)
+    daemon.wait(timeout=30)
+
+  from lib.websub import pushed_feeds
+  results['polling_resumed'] = url not in pushed_feeds()
+  return results
+
+
+def main() -> None:
+  sys.path.insert(0, bench_folder)
+  sys.path.insert(0, root_folder)
+  from server import BenchServer
+  from hub import LocalHub
+  from bench import setup_env
+
+  tmp = tempfile.mkdtemp(prefix='podcast-websub-')
+  hub = LocalHub().start()
+  server = BenchServer(hub=hub.url).start()
+  setup_env(tmp, server)
+  try:
+    print(json.dumps(bench_websub(server, hub), indent=2))
+  finally:
+    server.stop()
+    hub.stop()
+    os.chdir(root_folder)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -7,10 +7,12 @@ try:
   from headers import headers
   from logs import Logs
   from download import DownloadError
+  from metrics import metrics
 except ModuleNotFoundError:
   from lib.headers import headers
   from lib.logs import Logs
   from lib.download import DownloadError
+  from lib.metrics import metrics
 
 logger = Logs().get_logger()
 
@@ -36,9 +38,10 @@ class Coverart:
     """
     try:
       if url:
-        logger.debug(f'Downloading: {url}')
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
+        logger.debug('Downloading: %s', url)
+        with metrics.timer('artwork_fetch'):
+          response = requests.get(url, headers=headers)
+          response.raise_for_status()
 
         if not 'content-type' in response.headers and not 'image' in response.headers['content-type']:
           raise Exception(f'Not valid image content-type: {response.headers["content-type"]}')
@@ -46,7 +49,7 @@ class Coverart:
         self.__img = Image.open(BytesIO(response.content))
 
       elif location:
-        logger.debug(f'Loading: {location}')
+        logger.debug('Loading: %s', location)
         self.__img = Image.open(location)
       
       else: 
@@ -54,13 +57,14 @@ class Coverart:
 
       width, height = self.__img.size
 
-      if width > 1000 or height > 1000:
-        logger.debug(f'Resizing: {width}px X {height}px -> 1000px X 1000px')
-        self.__img.thumbnail((1000, 1000), Image.LANCZOS)
+      with metrics.timer('artwork_resize'):
+        if width > 1000 or height > 1000:
+          logger.debug('Resizing: %spx X %spx -> 1000px X 1000px', width, height)
+          self.__img.thumbnail((1000, 1000), Image.LANCZOS)
 
-      if self.__img.mode != 'RGB':
-        logger.debug(f'Converting: {self.__img.mode} -> RGB')
-        self.__img = self.__img.convert('RGB')    
+        if self.__img.mode != 'RGB':
+          logger.debug('Converting: %s -> RGB', self.__img.mode)
+          self.__img = self.__img.convert('RGB')    
 
     except requests.exceptions.RequestException as e:
       raise DownloadError(f'Error getting image data: {e}')
@@ -83,7 +87,7 @@ class Coverart:
       return
 
     try:
-      logger.info(f'Saving: {self.__cover_path}')
+      logger.info('Saving: %s', self.__cover_path)
       self.__img.save(self.__cover_path, 'JPEG')
     except OSError as e:
       raise Exception(f'Can not save cover image as JPG: {e}')
@@ -97,5 +101,6 @@ class Coverart:
     """
     logger.debug('embedding image bytes')
     bytes = BytesIO()
-    self.__img.save(bytes, format='JPEG')
+    with metrics.timer('artwork_encode'):
+      self.__img.save(bytes, format='JPEG')
     return bytes.getvalue()
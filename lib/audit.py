@@ -0,0 +1,291 @@
+import os
+import json
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+  from logs import Logs
+  from is_audio import is_audio_file
+  from state import state_path
+  from integrity import check_file, mark_damaged, record_tagged, load_manifest, damaged, truncation_ratio
+  from download import seconds_to_readable_time
+  import journal
+  import catalog
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.is_audio import is_audio_file
+  from lib.state import state_path
+  from lib.integrity import check_file, mark_damaged, record_tagged, load_manifest, damaged, truncation_ratio
+  from lib.download import seconds_to_readable_time
+  from lib import journal, catalog
+
+logger = Logs().get_logger()
+
+TRUNCATED = 'truncated'
+UNREADABLE = 'unreadable'
+UNTAGGED = 'untagged'
+NO_ARTWORK = 'no artwork'
+ORPHANED = 'orphaned'
+
+# append to the checkpoint after this many files
+checkpoint_interval = 500
+
+def library_files(folder:str) -> list[str]:
+  """
+  Lists every audio file under the podcast folder, skipping hidden folders.
+
+  Args:
+    folder (str): The podcast folder.
+
+  Returns:
+    list[str]: Paths of audio files.
+  """
+  files = []
+  for root, dirs, filenames in os.walk(folder):
+    dirs[:] = [d for d in dirs if not d.startswith('.')]
+    files.extend(os.path.join(root, f) for f in filenames if is_audio_file(f))
+  return files
+
+
+def _load_checkpoint(path:str, header:dict) -> dict:
+  # the checkpoint is a header line and one result per line, like the journal
+  done = {}
+  try:
+    with open(path, 'rb+') as f:
+      if json.loads(f.readline() or b'null') != header:
+        return None
+      position = f.tell()
+      for line in f:
+        if not line.endswith(b'\n'):
+          break
+        result = json.loads(line)
+        done[result['path']] = result
+        position += len(line)
+      # a line cut short by an interruption would swallow the next one appended
+      f.truncate(position)
+  except (OSError, ValueError):
+    return None
+  return done
+
+
+def _append_checkpoint(path:str, results:list[dict]) -> None:
+  if results:
+    with open(path, 'a', encoding='utf-8') as f:
+      f.write(''.join(json.dumps(result) + '\n' for result in results))
+
+
+def _fix(path:str, file, issues:list[str], record:dict) -> list[str]:
+  if TRUNCATED in issues or UNREADABLE in issues:
+    # only a file podcast.py downloaded has a record the next run downloads it again from,
+    # the parent flags it in the integrity manifest
+    damage = [issue for issue in (TRUNCATED, UNREADABLE) if issue in issues]
+    return damage if record and record.get('size') is not None else []
+
+  fixed = []
+  folder = os.path.dirname(path)
+
+  if UNTAGGED in issues:
+    title = os.path.splitext(os.path.basename(path))[0].replace('.', ' ')
+    file['title'] = file['title'].value or title
+    file['artist'] = file['artist'].value or os.path.basename(folder)
+    file['album'] = file['album'].value or os.path.basename(folder)
+    file['genre'] = 'Podcast'
+    fixed.append(UNTAGGED)
+
+  cover = os.path.join(folder, 'cover.jpg')
+  if NO_ARTWORK in issues and os.path.exists(cover):
+    try:
+      from update_id3 import id3Image
+      from Coverart import Coverart
+    except ModuleNotFoundError:
+      from lib.update_id3 import id3Image
+      from lib.Coverart import Coverart
+    id3Image(file, Coverart(location=cover).bytes())
+    fixed.append(NO_ARTWORK)
+
+  if fixed:
+    file.save()
+  return fixed
+
+
+def _apply(result:dict) -> None:
+  # the integrity manifest is only written here, in the parent, never from two workers at once
+  if set(result['fixed']) & {TRUNCATED, UNREADABLE}:
+    mark_damaged(result['path'])
+  elif result['fixed']:
+    record_tagged(result['path'])
+    # players syncing from the journal pick up the new tags
+    journal.record(journal.RETAGGED, result['path'])
+
+
+def audit_file(path:str, record:dict = None, length:int = None, fix:bool = False) -> dict:
+  """
+  Checks a single audio file. Runs in a worker process.
+
+  The file's size is checked against its integrity record, or against the enclosure length
+  the feed lists when podcast.py didn't record the download. Its container and frames are parsed,
+  and its tags are loaded with music_tag the same way update_ID3 does. Fixing retags the file
+  in place, the integrity manifest is left to the caller (see 'fixed').
+
+  Args:
+    path (str): The audio file.
+    record (dict): The file's integrity record (optional).
+    length (int): The episode's enclosure length in bytes (optional).
+    fix (bool): Repair what can be repaired in place.
+
+  Returns:
+    dict: The file's 'path', 'size', 'mtime', list of 'issues' and list of 'fixed' issues.
+      A fixed 'truncated' or 'unreadable' file still has to be flagged as damaged.
+  """
+  import music_tag as id3
+
+  stat = os.stat(path)
+  result = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'issues': [], 'fixed': []}
+
+  if check_file(path, record) in damaged:
+    result['issues'].append(TRUNCATED)
+  elif not record and length and stat.st_size < length * truncation_ratio:
+    # tags only add to the enclosure's size
+    result['issues'].append(TRUNCATED)
+
+  file = None
+  try:
+    file = id3.load_file(path)
+    info = file.mfile.info
+    # the duration is estimated from the size for CBR files, so only an empty or broken stream is told apart here
+    if info.length == 0 or getattr(info, 'sketchy', False):
+      result['issues'].append(TRUNCATED)
+  except Exception:
+    # a format mutagen doesn't know isn't necessarily broken, so it's reported apart from truncation
+    result['issues'].append(UNREADABLE)
+
+  if file is not None:
+    if not file['title'].value or not file['artist'].value:
+      result['issues'].append(UNTAGGED)
+    if not file['artwork'].values:
+      result['issues'].append(NO_ARTWORK)
+
+  result['issues'] = sorted(set(result['issues']))
+
+  if fix and result['issues']:
+    try:
+      result['fixed'] = _fix(path, file, result['issues'], record)
+    except Exception as e:
+      result['error'] = str(e)
+
+  return result
+
+
+def audit(folder:str, subscribed_folders:list[str] = None, fix:bool = False, workers:int = None) -> dict:
+  """
+  Audits every audio file in the library using a process pool.
+
+  Results are checkpointed to the state folder, so an interrupted audit resumes where it stopped,
+  skipping the files it already checked that haven't changed since. A finished audit removes the
+  checkpoint and the next one checks every file again.
+
+  Args:
+    folder (str): The podcast folder.
+    subscribed_folders (list[str]): Folder names of subscribed feeds (optional). Files outside them are flagged as orphaned.
+    fix (bool): Repair untagged and missing artwork files, and queue truncated or unreadable files
+      podcast.py downloaded to download again.
+    workers (int): Number of worker processes (optional). Defaults to the CPU count.
+
+  Returns:
+    dict: Issue name to list of paths.
+  """
+  checkpoint_file = state_path('audit_checkpoint.jsonl')
+  header = {'folder': folder, 'fix': fix}
+  done = _load_checkpoint(checkpoint_file, header)
+  if done is None:
+    done = {}
+    os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+    with open(checkpoint_file, 'w', encoding='utf-8') as f:
+      f.write(json.dumps(header) + '\n')
+
+  files = library_files(folder)
+  todo = []
+  for path in files:
+    previous = done.get(path)
+    try:
+      stat = os.stat(path)
+    except OSError:
+      continue
+    if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime:
+      continue
+    todo.append(path)
+
+  logger.info('Auditing %s of %s files (%s from checkpoint)', len(todo), len(files), len(files) - len(todo))
+
+  manifests = {}
+  lengths = {}
+  records = []
+  enclosures = []
+  for path in todo:
+    folder_path = os.path.dirname(path)
+    if folder_path not in manifests:
+      manifests[folder_path] = load_manifest(folder_path)
+      lengths[folder_path] = catalog.enclosure_lengths(os.path.basename(folder_path))
+    records.append(manifests[folder_path].get(os.path.basename(path)))
+    enclosures.append(lengths[folder_path].get(os.path.basename(path)))
+
+  start = time.monotonic()
+  checked = 0
+  # results not in the checkpoint yet, appended every checkpoint_interval files
+  unsaved = []
+  try:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      for result in executor.map(partial(audit_file, fix=fix), todo, records, enclosures, chunksize=32):
+        done[result['path']] = result
+        unsaved.append(result)
+        checked += 1
+        if result.get('error'):
+          logger.error('Failed fixing %s: %s', result['path'], result['error'])
+        try:
+          _apply(result)
+        except OSError as e:
+          logger.error('Failed recording the fix of %s: %s', result['path'], e)
+        if checked % checkpoint_interval == 0:
+          _append_checkpoint(checkpoint_file, unsaved)
+          unsaved = []
+          logger.info('%s/%s files checked', checked, len(todo))
+  except KeyboardInterrupt:
+    _append_checkpoint(checkpoint_file, unsaved)
+    logger.warning('Audit interrupted after %s files. Run again to resume', checked)
+    raise
+
+  elapsed = time.monotonic() - start
+  rate = checked / elapsed if elapsed > 0 else 0
+
+  report = {}
+  for path in files:
+    result = done.get(path)
+    if not result:
+      continue
+    for issue in result['issues']:
+      if issue not in result['fixed']:
+        report.setdefault(issue, []).append(path)
+
+  if subscribed_folders is not None:
+    subscribed = set(subscribed_folders)
+    for path in files:
+      if os.path.relpath(path, folder).split(os.sep)[0] not in subscribed:
+        report.setdefault(ORPHANED, []).append(path)
+
+  fixed = sum(len(done[path]['fixed']) for path in files if path in done)
+
+  logger.info('Audit complete: %s files checked in %s (%.1f files/s). %s issues fixed',
+              checked, seconds_to_readable_time(elapsed), rate, fixed)
+  for issue, paths in report.items():
+    logger.warning('%s %s files', len(paths), issue)
+    for path in paths:
+      logger.debug('%s: %s', issue, path)
+
+  # a finished audit starts fresh next time
+  try:
+    os.remove(checkpoint_file)
+  except OSError:
+    pass
+
+  return report
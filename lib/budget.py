@@ -0,0 +1,212 @@
+import os
+import re
+import time
+
+try:
+  from logs import Logs
+  from state import state_path, load_state, save_state
+  from download import bytes_to_readable_size, seconds_to_readable_time
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.state import state_path, load_state, save_state
+  from lib.download import bytes_to_readable_size, seconds_to_readable_time
+
+logger = Logs().get_logger()
+
+policies = ['newest', 'smallest', 'priority']
+
+time_units = {'s': 1, 'm': 60, 'h': 3600}
+size_units = {'b': 1, 'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3, 'tb': 1024 ** 4}
+
+def parse_budget(value:str) -> tuple[float, int]:
+  """
+  Parses a budget string into a wall-clock and a byte limit.
+
+  The string is a comma separated list of limits, e.g. '45m', '2GB' or '45m,2GB'.
+  Time units are s, m and h. Size units are B, KB, MB, GB and TB.
+
+  Args:
+    value (str): The budget string.
+
+  Returns:
+    tuple[float, int]: The time limit in seconds and the byte limit. Either may be None.
+
+  Raises:
+    ValueError: If a part of the string is not a valid limit.
+  """
+  seconds = None
+  max_bytes = None
+  for part in value.lower().split(','):
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([a-z]+)\s*', part)
+    if not match:
+      raise ValueError(f'Invalid budget: {part}')
+    amount, unit = float(match.group(1)), match.group(2)
+    if unit in time_units:
+      seconds = amount * time_units[unit]
+    elif unit in size_units:
+      max_bytes = int(amount * size_units[unit])
+    else:
+      raise ValueError(f'Invalid budget unit: {unit}')
+  return seconds, max_bytes
+
+
+def feed_priorities() -> dict[str, int]:
+  """
+  Fetches per-feed priorities from the 'feed_priority' environment variable.
+
+  The variable is a comma separated list of url=priority pairs. Feeds not listed have priority 0.
+
+  Returns:
+    dict[str, int]: Feed URL to priority.
+  """
+  priorities = {}
+  for pair in os.getenv('feed_priority', '').split(','):
+    if '=' not in pair:
+      continue
+    url, priority = pair.rsplit('=', 1)
+    try:
+      priorities[url.strip()] = int(priority)
+    except ValueError:
+      logger.error('Invalid feed priority: %s', pair)
+  return priorities
+
+
+def order_pending(pending:list[dict], policy:str) -> list[dict]:
+  """
+  Orders pending episodes by the given policy.
+
+  Args:
+    pending (list[dict]): Pending episodes with 'length', 'published' and 'priority' keys.
+    policy (str): 'newest', 'smallest' or 'priority'.
+
+  Returns:
+    list[dict]: The pending episodes, most valuable first.
+  """
+  if policy == 'smallest':
+    return sorted(pending, key=lambda item: (item['length'] is None, item['length'] or 0))
+  if policy == 'priority':
+    return sorted(pending, key=lambda item: (-item['priority'], -item['published']))
+  return sorted(pending, key=lambda item: -item['published'])
+
+
+def max_attempts() -> int:
+  """
+  Returns how many budgeted runs may fail to download an episode before it is quarantined
+  ('carryover_max_attempts', default 3).
+  """
+  return max(1, int(os.getenv('carryover_max_attempts', 3)))
+
+
+def load_carryover() -> dict[str, dict[str, int]]:
+  """
+  Loads the episodes left over from the last budgeted run.
+
+  Returns:
+    dict[str, dict[str, int]]: Feed URL to enclosure URLs and how many runs failed to download each.
+  """
+  carryover = load_state(state_path('carryover.json'), {})
+  # older runs saved a list of enclosure URLs per feed
+  return {feed: urls if isinstance(urls, dict) else dict.fromkeys(urls, 0) for feed, urls in carryover.items()}
+
+
+def load_quarantine() -> dict[str, list[str]]:
+  """
+  Loads the episodes budgeted runs gave up on after 'carryover_max_attempts' failed downloads.
+  Budgeted runs skip them until they are removed from quarantine.json in the state folder.
+
+  Returns:
+    dict[str, list[str]]: Feed URL to a list of enclosure URLs.
+  """
+  return load_state(state_path('quarantine.json'), {})
+
+
+def save_carryover(pending:list[dict], carryover:dict[str, dict[str, int]] = None) -> None:
+  """
+  Saves episodes that did not fit the budget, or failed to download, so the next run includes them.
+  A failed download counts as an attempt. Episodes that used up 'carryover_max_attempts' are
+  quarantined instead of carried over, so a broken enclosure doesn't take budget from every run.
+
+  Args:
+    pending (list[dict]): Pending episodes with 'feed' and 'url' keys, and 'failed' if the download failed.
+    carryover (dict[str, dict[str, int]]): The carryover this run started with (see load_carryover).
+  """
+  carryover = carryover or {}
+  limit = max_attempts()
+  saved = {}
+  quarantined = []
+  for item in pending:
+    attempts = carryover.get(item['feed'], {}).get(item['url'], 0) + (1 if item.get('failed') else 0)
+    if attempts >= limit:
+      quarantined.append(item)
+    else:
+      saved.setdefault(item['feed'], {})[item['url']] = attempts
+
+  try:
+    save_state(state_path('carryover.json'), saved)
+    if quarantined:
+      quarantine = load_quarantine()
+      for item in quarantined:
+        logger.warning('Giving up on %s after %s failed downloads, quarantined', item['url'], limit)
+        if item['url'] not in quarantine.setdefault(item['feed'], []):
+          quarantine[item['feed']].append(item['url'])
+      save_state(state_path('quarantine.json'), quarantine)
+  except OSError as e:
+    logger.error('Failed saving carryover: %s', e)
+
+
+class Budget:
+  """
+  Tracks time and bytes spent against the limits of a budgeted run.
+  """
+  def __init__(self, seconds:float = None, max_bytes:int = None) -> None:
+    """
+    Starts the budget clock.
+
+    Args:
+      seconds (float): The wall-clock limit in seconds (optional).
+      max_bytes (int): The byte limit (optional).
+    """
+    self.__seconds = seconds
+    self.__max_bytes = max_bytes
+    self.__start = time.monotonic()
+    self.__spent_bytes = 0
+    # time for tagging and artwork on top of the transfer itself
+    self.__overhead = float(os.getenv('budget_overhead', 5))
+
+  def fits(self, length:int, rate:float) -> bool:
+    """
+    Checks if a transfer is expected to finish inside the budget.
+
+    Args:
+      length (int): The expected size of the transfer in bytes.
+      rate (float): The expected download rate in bytes per second.
+
+    Returns:
+      bool: True if the transfer should be started.
+    """
+    if self.__max_bytes is not None and self.__spent_bytes + length > self.__max_bytes:
+      return False
+    if self.__seconds is not None and self.elapsed() + length / rate + self.__overhead > self.__seconds:
+      return False
+    return True
+
+  def spend(self, length:int) -> None:
+    """
+    Records bytes downloaded against the budget.
+
+    Args:
+      length (int): The number of bytes downloaded.
+    """
+    self.__spent_bytes += length
+
+  def elapsed(self) -> float:
+    """
+    Returns the seconds since the budget started.
+    """
+    return time.monotonic() - self.__start
+
+  def summary(self) -> str:
+    """
+    Returns a readable summary of what was spent.
+    """
+    return f'{bytes_to_readable_size(self.__spent_bytes)} in {seconds_to_readable_time(self.elapsed())}'
@@ -0,0 +1,398 @@
+import os
+import time
+import queue
+import atexit
+import sqlite3
+import datetime
+import threading
+
+try:
+  from logs import Logs
+  from state import state_path
+  from integrity import load_manifest, check_file, damaged, MISSING
+  from podcast_episode_exists import episode_location
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.state import state_path
+  from lib.integrity import load_manifest, check_file, damaged, MISSING
+  from lib.podcast_episode_exists import episode_location
+
+logger = Logs().get_logger()
+
+DOWNLOADED = 'downloaded'
+NOT_DOWNLOADED = 'not_downloaded'
+DAMAGED = 'damaged'
+NO_ENCLOSURE = 'no_enclosure'
+
+orders = {
+  'newest': 'e.published DESC, e.feed, e.position',
+  'oldest': 'e.published ASC, e.feed, e.position DESC',
+  'title': 'e.title COLLATE NOCASE, e.feed, e.position',
+  'feed': 'f.title COLLATE NOCASE, e.position'
+}
+
+schema = """
+CREATE TABLE IF NOT EXISTS feeds (
+  url TEXT PRIMARY KEY,
+  title TEXT,
+  folder TEXT,
+  image TEXT,
+  updated REAL
+);
+CREATE TABLE IF NOT EXISTS episodes (
+  feed TEXT NOT NULL,
+  position INTEGER NOT NULL,
+  number INTEGER,
+  guid TEXT,
+  title TEXT,
+  url TEXT,
+  length INTEGER,
+  type TEXT,
+  published REAL,
+  season INTEGER,
+  episode_number INTEGER,
+  episode_type TEXT,
+  duration INTEGER,
+  subtitle TEXT,
+  image TEXT,
+  filename TEXT,
+  filtered TEXT,
+  status TEXT,
+  PRIMARY KEY (feed, position)
+);
+CREATE INDEX IF NOT EXISTS episodes_published ON episodes (published);
+CREATE INDEX IF NOT EXISTS episodes_status ON episodes (status, published);
+CREATE INDEX IF NOT EXISTS episodes_feed_status ON episodes (feed, status);
+"""
+
+_local = threading.local()
+_lock = threading.Lock()
+_queue = None
+_writer = None
+
+def enabled() -> bool:
+  """
+  Checks if the catalog is turned on ('catalog' environment variable, default on).
+  """
+  return os.getenv('catalog', '1') not in ['0', 'false', 'no']
+
+
+def catalog_path() -> str:
+  return state_path('catalog.sqlite')
+
+
+def _connect() -> sqlite3.Connection:
+  # one connection per thread and database, readers don't block the writer with WAL
+  path = catalog_path()
+  connections = getattr(_local, 'connections', None)
+  if connections is None:
+    connections = _local.connections = {}
+  connection = connections.get(path)
+  if connection is None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=10)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(schema)
+    connections[path] = connection
+  return connection
+
+
+def _status(integrity:str) -> str:
+  if integrity == MISSING:
+    return NOT_DOWNLOADED
+  if integrity in damaged:
+    return DAMAGED
+  return DOWNLOADED
+
+
+def _timestamp(value) -> float:
+  if value is None or isinstance(value, (int, float)):
+    return value
+  if isinstance(value, str):
+    value = datetime.datetime.fromisoformat(value)
+  if value.tzinfo is None:
+    value = value.replace(tzinfo=datetime.timezone.utc)
+  return value.timestamp()
+
+
+def _rows(url:str, title:str, episodes:list, filtered:dict) -> tuple[str, list[tuple]]:
+  folder = os.getenv('podcast_folder') or ''
+  podcast_folder = None
+  manifest = None
+  rows = []
+  count = len(episodes)
+  for ndx, episode in enumerate(episodes):
+    filename = None
+    status = NO_ENCLOSURE
+    if episode.url:
+      podcast_folder, filename = episode_location(title, episode)
+      if manifest is None:
+        manifest = load_manifest(os.path.join(folder, podcast_folder))
+      status = _status(check_file(os.path.join(folder, podcast_folder, filename), manifest.get(filename) or {}))
+    rows.append((
+      url, ndx, count - ndx, episode.guid, episode.title, episode.url, episode.length, episode.type,
+      _timestamp(episode.published), episode.season, episode.number, episode.episode_type, episode.duration,
+      episode.subtitle, episode.image, filename, filtered.get(ndx), status
+    ))
+  return podcast_folder, rows
+
+
+def _write(task) -> None:
+  global _queue, _writer
+  with _lock:
+    if _writer is None or not _writer.is_alive():
+      _queue = queue.SimpleQueue()
+      _writer = threading.Thread(target=_write_loop, args=(_queue,), name='catalog', daemon=True)
+      _writer.start()
+      atexit.register(flush)
+    _queue.put(task)
+
+
+def _write_loop(tasks:queue.SimpleQueue) -> None:
+  while True:
+    task = tasks.get()
+    if task is None:
+      return
+    try:
+      connection = _connect()
+      with connection:
+        task(connection)
+    except sqlite3.Error as e:
+      logger.error('Failed updating the episode catalog: %s', e)
+
+
+def flush(timeout:float = 30) -> None:
+  """
+  Waits for queued catalog updates to be written and stops the background writer.
+  """
+  global _writer
+  with _lock:
+    writer, tasks = _writer, _queue
+    _writer = None
+  if writer and writer.is_alive():
+    tasks.put(None)
+    writer.join(timeout)
+
+
+def _after_fork() -> None:
+  # the writer thread doesn't survive fork, a child starts its own
+  global _writer, _queue, _lock
+  _lock = threading.Lock()
+  _writer = _queue = None
+  _local.connections = {}
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def update_feed(url:str, title:str, image:str, episodes:list, filtered:dict = None) -> None:
+  """
+  Saves a parsed feed as the catalog snapshot for that feed, on a background thread.
+  Called whenever a feed is fetched, so the catalog is as fresh as the last run.
+
+  Args:
+    url (str): The feed URL.
+    title (str): The podcast title.
+    image (str): The podcast artwork URL.
+    episodes (list[Episode]): The episodes, newest first.
+    filtered (dict): Episode index to the filter rule that excludes it.
+  """
+  if not enabled():
+    return
+  filtered = filtered or {}
+
+  def task(connection:sqlite3.Connection) -> None:
+    folder, rows = _rows(url, title, episodes, filtered)
+    connection.execute('INSERT OR REPLACE INTO feeds (url, title, folder, image, updated) VALUES (?, ?, ?, ?, ?)',
+                       (url, title, folder, image, time.time()))
+    connection.execute('DELETE FROM episodes WHERE feed = ?', (url,))
+    connection.executemany(f'INSERT INTO episodes VALUES ({", ".join("?" * 18)})', rows)
+
+  _write(task)
+
+
+def set_status(feed:str, episode_url:str, status:str) -> None:
+  """
+  Updates an episode's download status, e.g. after it was downloaded.
+  """
+  if not enabled():
+    return
+  _write(lambda connection: connection.execute('UPDATE episodes SET status = ? WHERE feed = ? AND url = ?', (status, feed, episode_url)))
+
+
+def set_file_status(folder:str, filename:str, status:str) -> None:
+  """
+  Updates the status of the episode stored under a file name, e.g. after retention deleted it.
+
+  Args:
+    folder (str): The podcast's folder name in podcast_folder.
+    filename (str): The episode's file name.
+    status (str): The new status.
+  """
+  if not enabled():
+    return
+  _write(lambda connection: connection.execute(
+    'UPDATE episodes SET status = ? WHERE filename = ? AND feed IN (SELECT url FROM feeds WHERE folder = ?)',
+    (status, filename, folder)))
+
+
+def remove_feed(url:str) -> None:
+  """
+  Drops a feed and its episodes from the catalog (e.g. after unsubscribing).
+  """
+  if not enabled():
+    return
+
+  def task(connection:sqlite3.Connection) -> None:
+    connection.execute('DELETE FROM episodes WHERE feed = ?', (url,))
+    connection.execute('DELETE FROM feeds WHERE url = ?', (url,))
+
+  _write(task)
+
+
+def published_dates(folder:str) -> dict[str, float]:
+  """
+  Returns the publication dates of a podcast folder's episodes, as of the last refresh.
+
+  Args:
+    folder (str): The podcast's folder name in podcast_folder.
+
+  Returns:
+    dict[str, float]: File name to pubDate timestamp, empty when the catalog is off.
+  """
+  if not enabled():
+    return {}
+  try:
+    rows = _connect().execute('SELECT e.filename, e.published FROM episodes e JOIN feeds f ON f.url = e.feed '
+                              'WHERE f.folder = ? AND e.filename IS NOT NULL AND e.published IS NOT NULL', (folder,))
+    return {row['filename']: row['published'] for row in rows}
+  except sqlite3.Error as e:
+    logger.error('Failed reading the episode catalog: %s', e)
+    return {}
+
+
+def enclosure_lengths(folder:str) -> dict[str, int]:
+  """
+  Returns the enclosure lengths the feed lists for a podcast folder's episodes, as of the last refresh.
+
+  Args:
+    folder (str): The podcast's folder name in podcast_folder.
+
+  Returns:
+    dict[str, int]: File name to length in bytes, empty when the catalog is off.
+  """
+  if not enabled():
+    return {}
+  try:
+    rows = _connect().execute('SELECT e.filename, e.length FROM episodes e JOIN feeds f ON f.url = e.feed '
+                              'WHERE f.folder = ? AND e.filename IS NOT NULL AND e.length > 0', (folder,))
+    return {row['filename']: row['length'] for row in rows}
+  except sqlite3.Error as e:
+    logger.error('Failed reading the episode catalog: %s', e)
+    return {}
+
+
+def _listed(value) -> list:
+  return value if isinstance(value, (list, tuple, set)) else [value]
+
+
+def _live_status(rows:list[dict]) -> None:
+  # stored statuses are as of the last refresh, the page being shown is checked against the disk
+  folder = os.getenv('podcast_folder') or ''
+  manifests = {}
+  changed = []
+  for row in rows:
+    if not row['filename']:
+      continue
+    location = os.path.join(folder, row['folder'])
+    if location not in manifests:
+      manifests[location] = load_manifest(location)
+    status = _status(check_file(os.path.join(location, row['filename']), manifests[location].get(row["filename"]) or {}))
+    if status != row['status']:
+      row['status'] = status
+      changed.append((status, row['feed'], row['position']))
+  if changed:
+    _write(lambda connection: connection.executemany('UPDATE episodes SET status = ? WHERE feed = ? AND position = ?', changed))
+
+
+def episodes(feed=None, search:str = None, status=None, episode_type=None, season=None, since=None, until=None,
+             include_filtered:bool = True, order:str = 'newest', page:int = 1, per_page:int = 50) -> dict:
+  """
+  Queries episodes from the catalog, for one feed or across feeds. Never touches the network.
+
+  Args:
+    feed (str | list[str]): Feed URL(s) (default all feeds).
+    search (str): Text to find in the title or subtitle.
+    status (str | list[str]): 'downloaded', 'not_downloaded', 'damaged' or 'no_enclosure'.
+    episode_type (str | list[str]): itunes:episodeType, e.g. 'full'.
+    season (int | list[int]): itunes:season.
+    since, until: Publication date range (timestamp, ISO string or datetime).
+    include_filtered (bool): Include episodes the filter rules exclude.
+    order (str): 'newest', 'oldest', 'title' or 'feed'.
+    page (int): Page number, from 1.
+    per_page (int): Episodes per page.
+
+  Returns:
+    dict: 'total', 'page', 'per_page', 'pages' and 'episodes' (dicts with the episode fields,
+    'feed', 'podcast', 'folder', 'filtered' and a 'status' checked against the disk).
+  """
+  if order not in orders:
+    raise ValueError(f'Invalid order: {order}. Must be one of: {", ".join(orders)}')
+  where = []
+  params = []
+  for column, value in (('e.feed', feed), ('e.status', status), ('e.episode_type', episode_type), ('e.season', season)):
+    if value is not None:
+      values = _listed(value)
+      where.append(f'{column} IN ({", ".join("?" * len(values))})')
+      params += values
+  if search:
+    where.append("(e.title LIKE ? ESCAPE '\\' OR e.subtitle LIKE ? ESCAPE '\\')")
+    pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    params += [pattern, pattern]
+  if since is not None:
+    where.append('e.published >= ?')
+    params.append(_timestamp(since))
+  if until is not None:
+    where.append('e.published <= ?')
+    params.append(_timestamp(until))
+  if not include_filtered:
+    where.append('e.filtered IS NULL')
+
+  clause = f'WHERE {" AND ".join(where)}' if where else ''
+  page = max(1, int(page))
+  per_page = max(1, int(per_page))
+  connection = _connect()
+  total = connection.execute(f'SELECT COUNT(*) FROM episodes e {clause}', params).fetchone()[0]
+  rows = connection.execute(
+    f'SELECT e.*, f.title AS podcast, f.folder AS folder FROM episodes e JOIN feeds f ON f.url = e.feed '
+    f'{clause} ORDER BY {orders[order]} LIMIT ? OFFSET ?',
+    params + [per_page, (page - 1) * per_page]
+  ).fetchall()
+  results = [dict(row) for row in rows]
+  _live_status(results)
+
+  return {
+    'total': total,
+    'page': page,
+    'per_page': per_page,
+    'pages': (total + per_page - 1) // per_page,
+    'episodes': results
+  }
+
+
+def feeds() -> list[dict]:
+  """
+  Lists the feeds in the catalog with their episode and download counts.
+
+  Returns:
+    list[dict]: 'url', 'title', 'folder', 'image', 'updated', 'episodes' and 'downloaded' per feed.
+  """
+  rows = _connect().execute(
+    'SELECT f.*, COALESCE(c.episodes, 0) AS episodes, c.downloaded FROM feeds f LEFT JOIN '
+    '(SELECT feed, COUNT(*) AS episodes, SUM(status = ?) AS downloaded FROM episodes GROUP BY feed) c '
+    'ON c.feed = f.url ORDER BY f.title COLLATE NOCASE',
+    (DOWNLOADED,)
+  ).fetchall()
+  return [dict(row, downloaded=row['downloaded'] or 0) for row in rows]
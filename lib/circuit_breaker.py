@@ -0,0 +1,196 @@
+import os
+import time
+import datetime
+import threading
+from urllib.parse import urlparse
+
+try:
+  from logs import Logs
+  from state import state_path, load_state, save_state
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.state import state_path, load_state, save_state
+
+logger = Logs().get_logger()
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# seconds a half-open trial may take before another request may try instead
+# (the trial's caller crashed, or got an answer that neither closes nor opens the circuit)
+trial_timeout = 300
+
+def host_of(url:str) -> str:
+  """
+  Returns the lowercase host name of the given URL.
+
+  Args:
+    url (str): The URL to extract the host from.
+
+  Returns:
+    str: The host name (netloc) of the URL.
+  """
+  return urlparse(url).netloc.lower()
+
+
+def is_host_failure(e:Exception) -> bool:
+  """
+  Decides if a requests exception means the host itself is failing.
+
+  Connection errors, timeouts and 5xx responses count against the host.
+  A 4xx response means the host answered, so it does not.
+
+  Args:
+    e (Exception): The exception raised by requests.
+
+  Returns:
+    bool: True if the error should count against the host.
+  """
+  response = getattr(e, 'response', None)
+  if response is not None:
+    return response.status_code >= 500
+  return True
+
+
+class CircuitBreaker:
+  """
+  A per-host circuit breaker with closed, open and half-open states.
+
+  After 'circuit_threshold' consecutive failures a host's circuit opens and requests
+  to it are skipped until 'circuit_cooldown' seconds have passed. The next request is then
+  let through as a half-open trial, and the others are skipped until it ends: success closes
+  the circuit, failure opens it again with a doubled cooldown (capped at 'circuit_max_cooldown').
+  State is persisted between runs.
+  """
+  def __init__(self, path:str = '') -> None:
+    """
+    Initializes the circuit breaker. State is loaded from disk on first use.
+
+    Args:
+      path (str): Path of the state file (optional). Defaults to 'circuits.json' in the state folder.
+    """
+    self.__path = path
+    self.__hosts = None
+    self.__lock = threading.Lock()
+    self.__threshold = int(os.getenv('circuit_threshold', 3))
+    self.__cooldown = int(os.getenv('circuit_cooldown', 1800))
+    self.__max_cooldown = int(os.getenv('circuit_max_cooldown', 86400))
+
+  def __state(self) -> dict:
+    if self.__hosts is None:
+      self.__path = self.__path or state_path('circuits.json')
+      self.__hosts = load_state(self.__path, {})
+    return self.__hosts
+
+  def __save(self) -> None:
+    try:
+      save_state(self.__path, self.__hosts)
+    except OSError as e:
+      logger.error('Failed saving circuit state: %s', e)
+
+  def state(self, url:str) -> str:
+    """
+    Returns the current state of the circuit for the URL's host.
+
+    Args:
+      url (str): Any URL on the host.
+
+    Returns:
+      str: 'closed', 'open' or 'half-open'.
+    """
+    with self.__lock:
+      return self.__state().get(host_of(url), {}).get('state', CLOSED)
+
+  def allow(self, url:str) -> bool:
+    """
+    Checks if a request to the URL's host should be attempted.
+
+    An open circuit whose cooldown has passed moves to half-open and allows one trial request.
+    Until that request reports success() or failure() (or trial_timeout passes), others are refused.
+
+    Args:
+      url (str): The URL about to be requested.
+
+    Returns:
+      bool: False if the host's circuit is open, or half-open with a trial in flight.
+    """
+    host = host_of(url)
+    now = time.time()
+    with self.__lock:
+      entry = self.__state().get(host)
+      if not entry or entry['state'] == CLOSED:
+        return True
+      if entry['state'] == OPEN and now < entry['retry_at']:
+        logger.debug('Circuit open for %s, skipping request', host)
+        return False
+      if entry['state'] == HALF_OPEN and now - entry.get('trial_at', 0) < trial_timeout:
+        logger.debug('Circuit half-open for %s with a trial in flight, skipping request', host)
+        return False
+      logger.info('Circuit half-open for %s, trying request', host)
+      entry['state'] = HALF_OPEN
+      entry['trial_at'] = now
+      self.__save()
+      return True
+
+  def success(self, url:str) -> None:
+    """
+    Records a successful request, closing the host's circuit.
+
+    Args:
+      url (str): The URL that was requested.
+    """
+    host = host_of(url)
+    with self.__lock:
+      entry = self.__state().pop(host, None)
+      if entry and entry['state'] != CLOSED:
+        logger.info('Circuit closed for %s', host)
+        self.__save()
+
+  def failure(self, url:str) -> None:
+    """
+    Records a failed request, opening the host's circuit when the threshold is reached
+    or when a half-open trial fails.
+
+    Args:
+      url (str): The URL that was requested.
+    """
+    host = host_of(url)
+    with self.__lock:
+      hosts = self.__state()
+      entry = hosts.setdefault(host, {'state': CLOSED, 'failures': 0, 'cooldown': self.__cooldown})
+      entry['failures'] += 1
+
+      if entry['state'] == HALF_OPEN:
+        entry['cooldown'] = min(entry['cooldown'] * 2, self.__max_cooldown)
+
+      if entry['state'] == HALF_OPEN or (entry['state'] == CLOSED and entry['failures'] >= self.__threshold):
+        entry['state'] = OPEN
+        entry['retry_at'] = time.time() + entry['cooldown']
+        logger.warning('Circuit opened for %s after %s failures', host, entry['failures'])
+
+      self.__save()
+
+  def open_circuits(self) -> list[tuple[str, float]]:
+    """
+    Returns the hosts with an open circuit and the time they will next be tried.
+
+    Returns:
+      list[tuple[str, float]]: (host, retry timestamp) pairs, soonest first.
+    """
+    with self.__lock:
+      return sorted(
+        [(host, entry['retry_at']) for host, entry in self.__state().items() if entry['state'] == OPEN],
+        key=lambda item: item[1]
+      )
+
+  def log_summary(self) -> None:
+    """
+    Logs the open circuits and their recovery times.
+    """
+    for host, retry_at in self.open_circuits():
+      recovery = datetime.datetime.fromtimestamp(retry_at).strftime('%Y-%m-%d %H:%M:%S')
+      logger.info('Circuit open: %s (retry after %s)', host, recovery)
+
+
+breaker = CircuitBreaker()
@@ -28,7 +28,7 @@ def copy_file(source:str, destination:str, path:str, max_retries=5, timeout=10)
   retries = 0
   while retries < max_retries:
     try:
-      logger.info(f'Copy: {source} -> {path}')
+      logger.info('Copy: %s -> %s', source, path)
       shutil.copy2(source, destination)
       # change_log.file_wrote()
       break
@@ -37,16 +37,16 @@ def copy_file(source:str, destination:str, path:str, max_retries=5, timeout=10)
       if retries < max_retries:
         time.sleep(timeout)
       else:
-        logger.info(f"{path} Maximum retries reached. Copy failed.")
+        logger.info('%s Maximum retries reached. Copy failed.', path)
         raise
     except FileNotFoundError as e:
       logger.critical('error copying missing file:', e)
     except shutil.Error as e:
-      logger.info(f"Error copying file: {str(e)}")
+      logger.info('Error copying file: %s', e)
       retries += 1
       if retries < max_retries:
-        logger.info(f"Retrying after {timeout} seconds...")
+        logger.info('Retrying after %s seconds...', timeout)
         time.sleep(timeout)
       else:
-        logger.info(f"{path} Maximum retries reached. Copy failed.")
+        logger.info('%s Maximum retries reached. Copy failed.', path)
         raise
\ No newline at end of file
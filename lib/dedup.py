@@ -0,0 +1,214 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+try:
+  from logs import Logs
+  from state import shared_state_path, load_state, save_state, file_lock
+  from resolve_url import resolve
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.state import shared_state_path, load_state, save_state, file_lock
+  from lib.resolve_url import resolve
+
+logger = Logs().get_logger()
+
+# linux ioctl to share a file's data blocks copy-on-write (btrfs, xfs, bcachefs)
+FICLONE = 0x40049409
+
+_lock = threading.Lock()
+# dedup.json path -> (its stat signature, the index) as last read, so lookups only read it again after it changed
+_cache = {}
+
+def enabled() -> bool:
+  """
+  Checks if deduplication is turned on ('dedup' environment variable, default on).
+  """
+  return os.getenv('dedup', '1') not in ['0', 'false', 'no']
+
+
+def _signature(path:str) -> tuple:
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return None
+  # save_state replaces the file, so the inode changes even when the mtime doesn't
+  return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _index() -> dict:
+  path = shared_state_path('dedup.json')
+  signature = _signature(path)
+  cached = _cache.get(path)
+  if signature and cached and cached[0] == signature:
+    return cached[1]
+  index = load_state(path, {})
+  for key in ['urls', 'validators', 'hashes']:
+    index.setdefault(key, {})
+  _cache[path] = (signature, index)
+  return index
+
+
+def tag_identity(podcast_title:str, episode, epNum) -> str:
+  """
+  Returns a key for the tags update_ID3 writes: equal keys mean two files get identical tags.
+
+  Args:
+    podcast_title (str): The podcast title (artist and album, and the fallback artwork's folder).
+    episode (Episode): The episode (title, subtitle, date, number and artwork).
+    epNum (int): The episode number.
+
+  Returns:
+    str: The key.
+  """
+  published = episode.published.year if episode.published else None
+  inputs = [podcast_title, episode.title, episode.subtitle, published, episode.number, epNum, episode.image]
+  return hashlib.sha1(json.dumps(inputs, default=str).encode('utf-8')).hexdigest()
+
+
+def _validator_key(length, etag:str) -> str:
+  if not length or not etag:
+    return None
+  return f'{length}|{etag.strip()}'
+
+
+def _existing(entry:dict, path:str) -> dict:
+  # ignore entries whose file was deleted or that point at the file being written
+  if entry and entry['path'] != path and os.path.isfile(entry['path']):
+    return entry
+  return None
+
+
+def find_before_download(url:str, path:str) -> dict:
+  """
+  Looks for an already downloaded copy of an enclosure by its final URL, or by its
+  content-length and ETag.
+
+  Args:
+    url (str): The enclosure URL.
+    path (str): Where the episode would be saved.
+
+  Returns:
+    dict: The matching entry ('path', 'podcast' and the download info), or None.
+  """
+  head = resolve(url)
+
+  index = _index()
+  entry = _existing(index['urls'].get(head['url']), path)
+  if not entry:
+    key = _validator_key(head['length'], head['etag'])
+    entry = _existing(index['validators'].get(key), path) if key else None
+  return entry
+
+
+def find_by_hash(sha256:str, path:str) -> dict:
+  """
+  Looks for an already downloaded copy with the same content hash.
+
+  Args:
+    sha256 (str): The hash of the downloaded data.
+    path (str): The file that was just downloaded.
+
+  Returns:
+    dict: The matching entry, or None.
+  """
+  return _existing(_index()['hashes'].get(sha256), path)
+
+
+def register(path:str, podcast_title:str, info:dict, tags:str = None) -> None:
+  """
+  Adds a downloaded file to the index.
+
+  Args:
+    path (str): The downloaded file.
+    podcast_title (str): The podcast the file belongs to.
+    info (dict): The download info returned by dl_with_progress_bar.
+    tags (str): The file's tag_identity (optional).
+  """
+  entry = dict(info)
+  entry['path'] = path
+  entry['podcast'] = podcast_title
+  entry['tags'] = tags
+  with _lock, file_lock(shared_state_path('dedup.json')):
+    index = _index()
+    if info.get('url'):
+      index['urls'][info['url']] = entry
+    key = _validator_key(info.get('size'), info.get('etag'))
+    if key:
+      index['validators'][key] = entry
+    if info.get('sha256'):
+      index['hashes'][info['sha256']] = entry
+    path = shared_state_path('dedup.json')
+    try:
+      save_state(path, index)
+      _cache[path] = (_signature(path), index)
+    except OSError as e:
+      # the cached index has the entry the file doesn't, the next lookup reads the file again
+      _cache.pop(path, None)
+      logger.error('Failed saving dedup index: %s', e)
+
+
+def reflink(src:str, dest:str) -> None:
+  """
+  Creates dest as a copy-on-write clone of src. The clone shares data blocks with src
+  until one of them is written, so it can carry its own tags.
+
+  Raises:
+    OSError: If the filesystem (or platform) doesn't support reflinks.
+  """
+  try:
+    import fcntl
+  except ModuleNotFoundError:
+    raise OSError('Reflinks are not supported on this platform')
+  with open(src, 'rb') as s, open(dest, 'wb') as d:
+    try:
+      fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except OSError:
+      d.close()
+      os.remove(dest)
+      raise
+
+
+def link_duplicate(src:str, dest:str, same_tags:bool, allow_copy:bool = True) -> str:
+  """
+  Stores dest as a duplicate of src without downloading it again.
+
+  A hardlink is used when the tags would be identical. Otherwise a reflink is used so the
+  copy can carry its own feed's tags, falling back to a plain copy where reflinks aren't supported.
+  An existing dest is replaced atomically.
+
+  Args:
+    src (str): The existing file.
+    dest (str): The duplicate to create.
+    same_tags (bool): True if both files get the same tags.
+    allow_copy (bool): Fall back to a plain copy if dest can't share data with src.
+
+  Returns:
+    str: 'hardlink', 'reflink' or 'copy'. None if nothing was done.
+  """
+  tmp_path = f'{dest}.dedup'
+  if os.path.exists(tmp_path):
+    os.remove(tmp_path)
+
+  method = None
+  if same_tags:
+    try:
+      os.link(src, tmp_path)
+      method = 'hardlink'
+    except OSError:
+      pass
+
+  if not method:
+    try:
+      reflink(src, tmp_path)
+      method = 'reflink'
+    except OSError:
+      if not allow_copy:
+        return None
+      shutil.copyfile(src, tmp_path)
+      method = 'copy'
+
+  os.replace(tmp_path, dest)
+  return method
@@ -1,13 +1,24 @@
+import os
 import time
+import hashlib
 import requests
-from tqdm import tqdm
 
 try:
   from logs import Logs
   from headers import headers
+  from circuit_breaker import breaker, host_of, is_host_failure, OPEN
+  from throughput import record_throughput
+  from metrics import metrics
+  from progress import progress_bar
+  from state import shared_state_path, file_lock
 except ModuleNotFoundError:
   from lib.logs import Logs
   from lib.headers import headers
+  from lib.circuit_breaker import breaker, host_of, is_host_failure, OPEN
+  from lib.throughput import record_throughput
+  from lib.metrics import metrics
+  from lib.progress import progress_bar
+  from lib.state import shared_state_path, file_lock
 
 logger = Logs().get_logger()
 
@@ -100,9 +111,26 @@ def seconds_to_readable_time(seconds: int) -> str:
   return ', '.join(time_str)
 
 
+def download_lock(path:str):
+  """
+  Returns the lock a download to 'path' holds, so two processes (a cron run and the stream server)
+  never write the same '<path>.part'. The lock file lives in the (shared) state folder, not next to
+  the episode, and is deleted when the download ends.
+
+  Yields:
+    bool: False if another download to 'path' holds it.
+  """
+  key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+  return file_lock(shared_state_path(os.path.join('locks', key)), blocking=False, remove=True)
+
+
 def dl_with_progress_bar(url: str, path: str, progress_callback=None, max_retries=3):
   """
   Downloads a file from the specified URL and shows a progress bar. It retries the download in case of errors.
+  Requests to a host with an open circuit fail immediately without retrying.
+
+  Data is written to '<path>.part' and only renamed to the final path once complete, so an interrupted
+  download never leaves a truncated file behind. A failed download removes its '.part' file. A SHA-256 hash is computed while the data streams.
 
   Args:
     url (str): The URL of the file to download.
@@ -110,35 +138,61 @@ def dl_with_progress_bar(url: str, path: str, progress_callback=None, max_retrie
     progress_callback (function, optional): A callback function that will be called with the download progress.
     max_retries (int, optional): The maximum number of retries in case of a download failure.
 
+  Returns:
+    dict: The 'size', 'sha256', 'etag', 'last_modified' and final 'url' (after redirects) of the downloaded file.
+
   Raises:
-    DownloadError: If the download fails after retrying or if an error occurs during the download process.
+    DownloadError: If the download fails after retrying, the host's circuit is open, another process is
+      downloading to the same path, or if an error occurs during the download process.
 
   Example:
     dl_with_progress_bar('https://example.com/file.mp3', '/path/to/save/file.mp3')
   """
+  with download_lock(path) as locked:
+    if not locked:
+      raise DownloadError(f'{os.path.basename(path)} is already being downloaded by another process')
+    try:
+      return _download(url, path, progress_callback, max_retries)
+    except DownloadError:
+      # retries ran out or the circuit opened, the partial data is no use to the next attempt
+      try:
+        os.remove(f'{path}.part')
+      except OSError:
+        pass
+      raise
+
+
+def _download(url: str, path: str, progress_callback, max_retries:int) -> dict:
   chunk_size = 4096  # Size of each chunk of data to download
   retries = 0  # Counter for retry attempts
+  part_path = f'{path}.part'  # Where data is written until the download is complete
 
   while retries < max_retries:
+    if not breaker.allow(url):
+      raise DownloadError(f"Circuit open for {host_of(url)}. Download skipped.")
+
     try:
       # Start a new session for the download
       session = requests.Session()
-      media = session.get(url, stream=True, headers=headers)
+      with metrics.timer('download_connect'):
+        media = session.get(url, stream=True, headers=headers)
       media.raise_for_status()  # Raise an exception if HTTP status code >= 400
 
       total_bytes = int(media.headers.get('content-length', 0))  # Get the total file size
       bytes_downloaded = 0  # Variable to track downloaded bytes
+      sha = hashlib.sha256()  # Hash of the data as it streams
       start_time = round(time.time() * 1000)  # Record the start time in milliseconds
 
       # Create a progress bar for the download
-      progress = tqdm(total=total_bytes, unit='B', unit_scale=True)
+      progress = progress_bar(total=total_bytes, unit='B', unit_scale=True)
 
       # Open the file and write chunks of data to it
-      with open(path, 'wb', buffering=chunk_size) as file:
+      with metrics.timer('download'), open(part_path, 'wb', buffering=chunk_size) as file:
         for data in media.iter_content(chunk_size):
           chunk_length = len(data)
           bytes_downloaded += chunk_length  # Update the number of bytes downloaded
           file.write(data)  # Write the chunk to the file
+          sha.update(data)  # Update the hash
           progress.update(chunk_length)  # Update the progress bar
           
           # Call the progress callback, if provided
@@ -146,38 +200,58 @@ def dl_with_progress_bar(url: str, path: str, progress_callback=None, max_retrie
             progress_callback(bytes_downloaded, total_bytes, start_time)
 
       progress.close()  # Close the progress bar when done
+      metrics.count('bytes_downloaded', bytes_downloaded)
 
       # Log total size and download rate after closing the progress bar
       if total_bytes > 0:
         elapsed_time = (round(time.time() * 1000) - start_time) / 1000  # Time in seconds
-        download_rate = total_bytes / elapsed_time
-        logger.info(f"Download completed: {bytes_to_readable_size(total_bytes)} downloaded. "
-                    f"Elapsed time: {seconds_to_readable_time(elapsed_time)}. "
-                    f"Average download rate: {bytes_to_readable_rate(download_rate)}.")
+        download_rate = total_bytes / max(elapsed_time, 0.001)
+        logger.info('Download completed: %s downloaded. Elapsed time: %s. Average download rate: %s.',
+                    bytes_to_readable_size(total_bytes), seconds_to_readable_time(elapsed_time), bytes_to_readable_rate(download_rate))
+        record_throughput(total_bytes, elapsed_time)
+
+      breaker.success(url)
 
       # Check if the downloaded bytes match the expected total
       if bytes_downloaded != total_bytes:
         logger.error("ERROR: Incomplete download detected.")
+        os.remove(part_path)
         raise DownloadError("Incomplete download.")
 
-      return  # Exit the loop if download is successful
+      os.replace(part_path, path)  # Move the complete file into place
+
+      # Exit the loop if download is successful
+      return {
+        'size': bytes_downloaded,
+        'sha256': sha.hexdigest(),
+        'etag': media.headers.get('etag'),
+        'last_modified': media.headers.get('last-modified'),
+        'url': media.url
+      }
 
     except requests.exceptions.RequestException as e:
       retries += 1  # Increment retry counter
-      logger.error(f"An error occurred during the download: {str(e)} (Retry {retries}/{max_retries})")
+      logger.error('An error occurred during the download: %s (Retry %s/%s)', e, retries, max_retries)
+
+      if is_host_failure(e):
+        breaker.failure(url)
 
       # Retry if the max retries have not been reached
       if retries >= max_retries:
-        logger.error(f"Maximum ({max_retries}) retries reached. Download failed.")
+        logger.error('Maximum (%s) retries reached. Download failed.', max_retries)
         raise DownloadError(f"Download failed after {max_retries} retries.")
+
+      # Don't wait on a host that just had its circuit opened
+      if breaker.state(url) == OPEN:
+        raise DownloadError(f"Circuit opened for {host_of(url)}. Download failed.")
       
       # Wait before retrying
       time.sleep(2)
 
     except IOError as e:
-      logger.error(f"ERROR: An I/O error occurred while writing the file: {str(e)}")
+      logger.error('ERROR: An I/O error occurred while writing the file: %s', e)
       raise DownloadError("I/O error during file write.")
 
     except DownloadError as de:
-      logger.error(f"ERROR: {str(de)}")
+      logger.error('ERROR: %s', de)
       raise  # Re-raise the custom download error
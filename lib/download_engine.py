@@ -0,0 +1,99 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+  from logs import Logs
+  from circuit_breaker import host_of
+  from resolve_url import resolve
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.circuit_breaker import host_of
+  from lib.resolve_url import resolve
+
+logger = Logs().get_logger()
+
+def download_concurrency() -> int:
+  """
+  Returns how many episodes of a feed are downloaded at once ('download_concurrency', default 4).
+  """
+  return max(1, int(os.getenv('download_concurrency', 4)))
+
+
+def per_host_concurrency() -> int:
+  """
+  Returns how many downloads may run against one host at once ('per_host_concurrency', default 2).
+  """
+  return max(1, int(os.getenv('per_host_concurrency', 2)))
+
+
+class DownloadEngine:
+  """
+  Runs episode downloads concurrently on an asyncio event loop.
+
+  Each transfer streams to disk on a worker thread, so a slow connection never holds up the
+  loop or the other transfers. At most 'concurrency' transfers run at once and at most
+  'per_host' against one host. The host is the one the enclosure URL redirects to (see
+  resolve_url), where the bytes actually come from, not the tracker it is listed under. Finished files are handed to a single tagging worker in the
+  order they finish, so tagging overlaps the downloads still running.
+
+  A failing download or tag only loses that episode, the others carry on.
+  """
+  def __init__(self, concurrency:int = None, per_host:int = None) -> None:
+    self.concurrency = concurrency or download_concurrency()
+    self.per_host = per_host or per_host_concurrency()
+
+  def run(self, jobs:list[tuple]) -> list:
+    """
+    Runs the jobs and waits for all of them.
+
+    Args:
+      jobs (list[tuple]): (url, fetch, finish) per episode. fetch() downloads the episode and returns
+        a value for finish (None if there is nothing to finish), finish(value) tags it and returns the result.
+
+    Returns:
+      list: The finish results, in job order (None for episodes that failed or had nothing to finish).
+    """
+    if not jobs:
+      return []
+    return asyncio.run(self.__run(jobs))
+
+  async def __run(self, jobs:list[tuple]) -> list:
+    loop = asyncio.get_running_loop()
+    # one thread per transfer plus the tagging worker, asyncio.run shuts it down
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency + 1, thread_name_prefix='download'))
+    slots = asyncio.Semaphore(self.concurrency)
+    hosts: dict[str, asyncio.Semaphore] = {}
+    finished = asyncio.Queue()
+    results = [None] * len(jobs)
+
+    async def fetch(ndx:int, url:str, job, finish) -> None:
+      # enclosures of different shows often share a tracker host and redirect to their own CDNs.
+      # The chain is cached, so the transfer reuses this resolution
+      resolved = (await asyncio.to_thread(resolve, url))['url']
+      # the host slot is taken first, so a busy host doesn't hold on to transfer slots
+      host = hosts.setdefault(host_of(resolved), asyncio.Semaphore(self.per_host))
+      value = None
+      async with host, slots:
+        try:
+          value = await asyncio.to_thread(job)
+        except Exception as e:
+          logger.error('Failed to download %s: %s', url, e)
+      if value is not None:
+        await finished.put((ndx, url, finish, value))
+
+    async def tag() -> None:
+      while True:
+        ndx, url, finish, value = await finished.get()
+        try:
+          results[ndx] = await asyncio.to_thread(finish, value)
+        except Exception as e:
+          logger.error('Failed to finish %s: %s', url, e)
+        finally:
+          finished.task_done()
+
+    tagger = asyncio.create_task(tag())
+    await asyncio.gather(*(fetch(ndx, url, job, finish) for ndx, (url, job, finish) in enumerate(jobs)))
+    await finished.join()
+    tagger.cancel()
+    return results
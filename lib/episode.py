@@ -0,0 +1,174 @@
+import sys
+import datetime
+
+try:
+  from pub_date import parse_pub_date
+except ModuleNotFoundError:
+  from lib.pub_date import parse_pub_date
+
+def _text(value) -> str:
+  # elements with attributes come back from xmltodict as {'@attr': ..., '#text': ...}
+  if isinstance(value, dict):
+    value = value.get('#text')
+  if isinstance(value, list):
+    value = _text(value[0]) if value else None
+  return value.strip() if isinstance(value, str) else value
+
+
+def _number(value) -> int:
+  try:
+    return int(_text(value))
+  except (TypeError, ValueError):
+    return None
+
+
+def _duration(value) -> int:
+  # itunes:duration is seconds, MM:SS or HH:MM:SS
+  value = _text(value)
+  if not isinstance(value, str):
+    return None
+  seconds = 0
+  try:
+    for part in value.split(':'):
+      seconds = seconds * 60 + float(part)
+  except ValueError:
+    return None
+  return int(seconds)
+
+
+class Episode:
+  """
+  The fields of a feed item podcast.py uses, without the rest of the item (descriptions, content, etc.).
+
+  Attributes:
+    guid (str): The item's guid (optional).
+    title (str): The episode title.
+    url (str): The enclosure URL, or None for items without an enclosure.
+    length (int): The enclosure length in bytes, or None if missing or invalid.
+    type (str): The enclosure MIME type.
+    published (datetime.datetime): The parsed pubDate, or None.
+    season (int): itunes:season, or None.
+    number (int): itunes:episode, or None.
+    image (str): itunes:image href, or None.
+    subtitle (str): itunes:subtitle, or None.
+    episode_type (str): itunes:episodeType ('full', 'trailer' or 'bonus'), or None.
+    duration (int): itunes:duration in seconds, or None.
+    description (str): The description, only kept when asked for (see parse_feed).
+  """
+  __slots__ = ('guid', 'title', 'url', 'length', 'type', 'published', 'season', 'number', 'image', 'subtitle',
+               'episode_type', 'duration', 'description')
+
+  def __init__(self, title:str, url:str, guid:str = None, length:int = None, type:str = None,
+               published:datetime.datetime = None, season:int = None, number:int = None,
+               image:str = None, subtitle:str = None, episode_type:str = None, duration:int = None,
+               description:str = None) -> None:
+    self.guid = guid
+    self.title = title
+    self.url = url
+    self.length = length
+    self.type = type
+    self.published = published
+    self.season = season
+    self.number = number
+    self.image = image
+    self.subtitle = subtitle
+    self.episode_type = episode_type
+    self.duration = duration
+    self.description = description
+
+  @classmethod
+  def from_item(cls, item:dict, description:bool = False) -> 'Episode':
+    """
+    Builds an Episode from an xmltodict feed item.
+
+    Args:
+      item (dict): The parsed <item>.
+      description (bool): Keep the description (or itunes:summary).
+
+    Returns:
+      Episode: The episode.
+    """
+    enclosure = item.get('enclosure')
+    if isinstance(enclosure, list):
+      enclosure = enclosure[0]
+    if not isinstance(enclosure, dict):
+      enclosure = {}
+
+    try:
+      published = parse_pub_date(_text(item.get('pubDate')))
+    except (ValueError, TypeError):
+      published = None
+
+    length = _number(enclosure.get('@length'))
+
+    image = item.get('itunes:image')
+    if isinstance(image, list):
+      image = image[0]
+
+    episode_type = _text(item.get('itunes:episodeType'))
+
+    return cls(
+      title=_text(item.get('title')) or '',
+      url=enclosure.get('@url'),
+      guid=_text(item.get('guid')),
+      length=length if length and length > 0 else None,
+      # every episode of a feed has the same few MIME types, share one string
+      type=sys.intern(enclosure['@type']) if enclosure.get('@type') else None,
+      published=published,
+      season=_number(item.get('itunes:season')),
+      number=_number(item.get('itunes:episode')),
+      image=image.get('@href') if isinstance(image, dict) else None,
+      subtitle=_text(item.get('itunes:subtitle')),
+      episode_type=sys.intern(episode_type.lower()) if episode_type else None,
+      duration=_duration(item.get('itunes:duration')),
+      description=_text(item.get('description') or item.get('itunes:summary')) if description else None
+    )
+
+  def __repr__(self) -> str:
+    return f'Episode({self.title!r}, {self.url!r})'
+
+
+def parse_feed(content:bytes, descriptions:bool = False) -> tuple[dict, list[Episode]]:
+  """
+  Parses an RSS feed one item at a time, so only the current item's full dict is ever held in memory.
+
+  Args:
+    content (bytes): The feed XML.
+    descriptions (bool): Keep each episode's description (they are usually the bulk of a feed).
+
+  Returns:
+    tuple[dict, list[Episode]]: The feed as {'rss': {'channel': {...}}} without its items
+    (for title and artwork lookups), and the episodes in feed order.
+
+  Raises:
+    ValueError: If the XML can't be parsed or has no channel.
+  """
+  import xmltodict
+  from xml.parsers.expat import ExpatError
+
+  channel = {}
+  episodes = []
+
+  def collect(path, value) -> bool:
+    if len(path) != 3 or path[0][0] != 'rss' or path[1][0] != 'channel':
+      return True
+    name = path[2][0]
+    if name == 'item':
+      episodes.append(Episode.from_item(value if isinstance(value, dict) else {}, descriptions))
+    elif name in channel:
+      # repeated elements (e.g. two <image>s) become a list, like xmltodict does
+      if not isinstance(channel[name], list):
+        channel[name] = [channel[name]]
+      channel[name].append(value)
+    else:
+      channel[name] = value
+    return True
+
+  try:
+    xmltodict.parse(content, item_depth=3, item_callback=collect)
+  except ExpatError as e:
+    raise ValueError(e)
+
+  if not channel and not episodes:
+    raise ValueError('No RSS channel found')
+  return {'rss': {'channel': channel}}, episodes
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import datetime
+import threading
+
+try:
+  from logs import Logs
+  from state import root_folder, shared_state_path, load_state, save_state, file_lock
+  from budget import parse_budget
+  from metrics import metrics
+  from download import bytes_to_readable_size
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.state import root_folder, shared_state_path, load_state, save_state, file_lock
+  from lib.budget import parse_budget
+  from lib.metrics import metrics
+  from lib.download import bytes_to_readable_size
+
+logger = Logs().get_logger()
+
+_lock = threading.Lock()
+_cache = {}
+_skipped = {'episodes': 0, 'bytes': 0, 'unknown_size': 0}
+# (feed, episode URL) pairs counted this run
+_counted = set()
+
+def _seconds(value) -> float:
+  if isinstance(value, (int, float)):
+    return value
+  seconds, size = parse_budget(str(value))
+  if seconds is None or size is not None:
+    raise ValueError(f'Invalid duration: {value}')
+  return seconds
+
+
+def _bytes(value) -> int:
+  if isinstance(value, (int, float)):
+    return int(value)
+  seconds, size = parse_budget(str(value))
+  if size is None or seconds is not None:
+    raise ValueError(f'Invalid size: {value}')
+  return size
+
+
+def _timestamp(value) -> float:
+  if isinstance(value, str):
+    value = datetime.datetime.fromisoformat(value)
+  # pubDates in GMT parse without a timezone
+  if value.tzinfo is None:
+    value = value.replace(tzinfo=datetime.timezone.utc)
+  return value.timestamp()
+
+
+def _listed(value) -> set:
+  return set(value) if isinstance(value, list) else {value}
+
+
+def _condition(key:str, value):
+  # returns a test of an Episode, fields the feed doesn't have never match
+  if key in ('title', 'description'):
+    pattern = re.compile(value, re.IGNORECASE)
+    return lambda episode: bool(getattr(episode, key) and pattern.search(getattr(episode, key)))
+  if key == 'episode_type':
+    types = {value.lower() for value in _listed(value)}
+    return lambda episode: episode.episode_type in types
+  if key == 'season':
+    seasons = {int(value) for value in _listed(value)}
+    return lambda episode: episode.season in seasons
+  if key in ('shorter_than', 'longer_than'):
+    limit = _seconds(value)
+    if key == 'shorter_than':
+      return lambda episode: episode.duration is not None and episode.duration < limit
+    return lambda episode: episode.duration is not None and episode.duration > limit
+  if key in ('smaller_than', 'larger_than'):
+    limit = _bytes(value)
+    if key == 'smaller_than':
+      return lambda episode: episode.length is not None and episode.length < limit
+    return lambda episode: episode.length is not None and episode.length > limit
+  if key in ('before', 'after'):
+    limit = _timestamp(value)
+    if key == 'before':
+      return lambda episode: episode.published is not None and _timestamp(episode.published) < limit
+    return lambda episode: episode.published is not None and _timestamp(episode.published) > limit
+  raise ValueError(f'Unknown filter condition: {key}')
+
+
+class Filters:
+  """
+  Compiled episode filter rules.
+
+  Rules are grouped by feed (feed URL or folder name, '*' for every feed). A rule is a dict of
+  conditions which all have to match for an episode to be skipped:
+    title, description: Regular expression, searched case-insensitively.
+    episode_type: itunes:episodeType or a list of them ('full', 'trailer', 'bonus').
+    shorter_than, longer_than: itunes:duration limit, in seconds or like '2m'.
+    smaller_than, larger_than: Enclosure length limit, in bytes or like '5MB'.
+    before, after: pubDate limit as an ISO date, e.g. '2020-01-01'.
+    season: itunes:season or a list of them.
+    name: Shown in the log instead of the conditions (optional).
+  """
+  def __init__(self, rules:dict[str, list[dict]]) -> None:
+    """
+    Raises:
+      ValueError: If a rule has an unknown condition or an invalid value.
+    """
+    self.__rules = {}
+    self.needs_description = False
+    for feed, feed_rules in rules.items():
+      compiled = []
+      for rule in feed_rules:
+        name = rule.get('name') or ', '.join(f'{key}={value}' for key, value in rule.items())
+        tests = [_condition(key, value) for key, value in rule.items() if key != 'name']
+        if not tests:
+          raise ValueError(f'Empty filter rule for {feed}')
+        self.needs_description = self.needs_description or 'description' in rule
+        compiled.append((name, tests))
+      self.__rules[feed] = compiled
+
+  def __bool__(self) -> bool:
+    return bool(self.__rules)
+
+  def match(self, episode, feed:str, folder:str = None) -> str:
+    """
+    Checks an episode against the global rules and its feed's rules.
+
+    Args:
+      episode (Episode): The episode.
+      feed (str): The feed URL.
+      folder (str): The feed's folder name (optional).
+
+    Returns:
+      str: The name of the first matching rule, or None if the episode is wanted.
+    """
+    for key in ('*', feed, folder):
+      for name, tests in self.__rules.get(key, ()) if key else ():
+        if all(test(episode) for test in tests):
+          return name
+    return None
+
+
+def filters_path() -> str:
+  """
+  Returns the rules file: 'filter_rules' from .env, defaulting to filters.json in the project folder.
+  """
+  path = os.getenv('filter_rules') or 'filters.json'
+  return path if os.path.isabs(path) else os.path.join(root_folder, path)
+
+
+def load_filters() -> Filters:
+  """
+  Loads and compiles the rules file. It is only read and compiled again when it changes,
+  so every feed of a run shares one compiled set.
+
+  Returns:
+    Filters: The rules (empty without a rules file, or if it is invalid).
+  """
+  path = filters_path()
+  try:
+    mtime = os.stat(path).st_mtime
+  except OSError:
+    return Filters({})
+
+  with _lock:
+    cached = _cache.get(path)
+    if cached and cached[0] == mtime:
+      return cached[1]
+    try:
+      with open(path, 'r', encoding='utf-8') as f:
+        filters = Filters(json.load(f))
+    except (OSError, ValueError, TypeError, AttributeError, re.error) as e:
+      logger.critical('Invalid filter rules in %s, not filtering: %s', path, e)
+      filters = Filters({})
+    _cache[path] = (mtime, filters)
+    return filters
+
+
+def record_skip(feed:str, episode, reason:str) -> None:
+  """
+  Counts an episode a run would have downloaded but a rule filtered out. Every run counts the
+  episodes it skips towards its avoided bytes (each once per run). Only the first skip of an
+  episode is logged at info level, later runs log it as debug.
+
+  Args:
+    feed (str): The feed URL.
+    episode (Episode): The filtered episode.
+    reason (str): The matching rule's name.
+  """
+  with _lock:
+    if (feed, episode.url) in _counted:
+      return
+    _counted.add((feed, episode.url))
+    metrics.count('filtered_episodes', feed=feed)
+    metrics.count('bytes_avoided', episode.length or 0, feed=feed)
+    _skipped['episodes'] += 1
+    if episode.length:
+      _skipped['bytes'] += episode.length
+    else:
+      _skipped['unknown_size'] += 1
+
+  path = shared_state_path('filtered.json')
+  with _lock, file_lock(path):
+    skipped = load_state(path, {})
+    urls = skipped.get(feed, [])
+    if episode.url in urls:
+      logger.debug('Skipping %s (filter: %s)', episode.title, reason)
+      return
+    # the last few per feed are enough, older episodes aren't offered for download again
+    skipped[feed] = (urls + [episode.url])[-100:]
+    try:
+      save_state(path, skipped)
+    except OSError as e:
+      logger.error('Failed saving filtered episodes: %s', e)
+    logger.info('Skipping %s (filter: %s)', episode.title, reason)
+
+
+def log_summary() -> None:
+  """
+  Logs how many downloads the filters avoided this run.
+  """
+  if not _skipped['episodes']:
+    return
+  unknown = f' ({_skipped["unknown_size"]} without a size)' if _skipped['unknown_size'] else ''
+  logger.info('Filters skipped %s episodes, %s not downloaded%s',
+              _skipped['episodes'], bytes_to_readable_size(_skipped['bytes']), unknown)
@@ -0,0 +1,201 @@
+import os
+import hashlib
+import threading
+
+try:
+  from logs import Logs
+  from state import load_state, save_state, file_lock
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.state import load_state, save_state, file_lock
+
+logger = Logs().get_logger()
+
+manifest_name = '.integrity.json'
+
+OK = 'ok'
+UNKNOWN = 'unknown'
+MISSING = 'missing'
+TRUNCATED = 'truncated'
+CORRUPT = 'corrupt'
+MODIFIED = 'modified'
+
+damaged = [TRUNCATED, CORRUPT]
+
+# a retagged file smaller than this share of its recorded size is treated as truncated
+truncation_ratio = 0.9
+
+_lock = threading.Lock()
+
+def manifest_path(path:str) -> str:
+  """
+  Returns the path of the integrity manifest for the folder containing the given file.
+  """
+  return os.path.join(os.path.dirname(path), manifest_name)
+
+
+def load_manifest(folder:str) -> dict:
+  """
+  Loads the integrity records of a podcast folder.
+
+  Args:
+    folder (str): The podcast folder.
+
+  Returns:
+    dict: File name to integrity record.
+  """
+  return load_state(os.path.join(folder, manifest_name), {})
+
+
+def _update(path:str, fields:dict) -> None:
+  manifest = manifest_path(path)
+  # the cron run and the stream and websub daemons all write the same folder's manifest
+  try:
+    with _lock, file_lock(manifest):
+      records = load_state(manifest, {})
+      records.setdefault(os.path.basename(path), {}).update(fields)
+      save_state(manifest, records)
+  except OSError as e:
+    logger.error('Failed saving integrity record for %s: %s', path, e)
+
+
+def record_download(path:str, info:dict) -> None:
+  """
+  Stores the size, hash and server validators of a freshly downloaded file.
+
+  Args:
+    path (str): The downloaded file.
+    info (dict): The 'size', 'sha256', 'etag' and 'last_modified' of the download, and the episode's
+      'published' timestamp (optional, used by retention).
+  """
+  record = dict(info)
+  record['tagged_size'] = None
+  record['tagged_mtime'] = None
+  record['damaged'] = False
+  _update(path, record)
+
+
+def record_tagged(path:str) -> None:
+  """
+  Stores the size and modification time of a file after its tags were written.
+
+  Tagging rewrites the file, so after this point the fast check compares against these values
+  instead of the download size.
+
+  Args:
+    path (str): The tagged file.
+  """
+  stat = os.stat(path)
+  _update(path, {'tagged_size': stat.st_size, 'tagged_mtime': stat.st_mtime})
+
+
+def mark_damaged(path:str) -> None:
+  """
+  Flags a file as damaged so the next run downloads it again.
+
+  Args:
+    path (str): The damaged file.
+  """
+  _update(path, {'damaged': True})
+
+
+def forget(path:str) -> None:
+  """
+  Drops the record of a file that was deleted on purpose (e.g. by retention).
+
+  Args:
+    path (str): The deleted file.
+  """
+  manifest = manifest_path(path)
+  try:
+    with _lock, file_lock(manifest):
+      records = load_state(manifest, {})
+      if records.pop(os.path.basename(path), None) is None:
+        return
+      save_state(manifest, records)
+  except OSError as e:
+    logger.error('Failed saving integrity record for %s: %s', path, e)
+
+
+def check_file(path:str, record:dict = None) -> str:
+  """
+  Checks a file against its integrity record using only a stat call.
+
+  Args:
+    path (str): The file to check.
+    record (dict): The file's integrity record (optional). Loaded from the manifest when not given.
+
+  Returns:
+    str: 'ok', 'unknown' (no record), 'missing', 'truncated', 'corrupt' or 'modified' (changed by another program).
+  """
+  if record is None:
+    record = load_manifest(os.path.dirname(path)).get(os.path.basename(path))
+
+  try:
+    stat = os.stat(path)
+  except FileNotFoundError:
+    return MISSING
+
+  if not record:
+    return UNKNOWN
+
+  if record.get('damaged'):
+    return CORRUPT
+
+  if record.get('tagged_size') is None:
+    if stat.st_size == record['size']:
+      return OK
+    return TRUNCATED if stat.st_size < record['size'] else CORRUPT
+
+  if stat.st_size == record['tagged_size']:
+    return OK
+  # rewriting tags changes the size a little, losing a chunk of the audio means the file was cut short
+  if stat.st_size < min(record['size'], record['tagged_size']) * truncation_ratio:
+    return TRUNCATED
+  if stat.st_mtime != record['tagged_mtime']:
+    return MODIFIED
+  return CORRUPT
+
+
+def verify_hash(path:str, record:dict = None) -> bool:
+  """
+  Compares a file's content with the hash stored at download time.
+
+  Only untagged files can be verified this way, since tagging rewrites the file.
+
+  Args:
+    path (str): The file to verify.
+    record (dict): The file's integrity record (optional).
+
+  Returns:
+    bool: True if the hash matches, False if it doesn't, None if the file can't be verified.
+  """
+  if record is None:
+    record = load_manifest(os.path.dirname(path)).get(os.path.basename(path))
+
+  if not record or not record.get('sha256') or record.get('tagged_size') is not None:
+    return None
+
+  sha = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1_048_576), b''):
+      sha.update(chunk)
+  return sha.hexdigest() == record['sha256']
+
+
+def damaged_files(folder:str) -> list[str]:
+  """
+  Lists the files in a podcast folder that are truncated or corrupted.
+
+  Args:
+    folder (str): The podcast folder.
+
+  Returns:
+    list[str]: Paths of damaged files.
+  """
+  result = []
+  for filename, record in load_manifest(folder).items():
+    path = os.path.join(folder, filename)
+    if check_file(path, record) in damaged:
+      result.append(path)
+  return result
@@ -1,10 +1,13 @@
+import os
 import requests
 from urllib.parse import urlparse
 
 try:
   from headers import headers
+  from circuit_breaker import breaker, is_host_failure
 except ModuleNotFoundError:
   from lib.headers import headers
+  from lib.circuit_breaker import breaker, is_host_failure
   
 
 # make sure URL is a valie URL scheme
@@ -18,13 +21,23 @@ def is_valid_url(url:str) -> bool:
 
 # check internet connections status
 def is_connected() -> bool:
-  return is_live_url("https://google.com")
+  return is_live_url(os.getenv('connectivity_url', 'https://google.com'), use_breaker=False)
 
 
 # make sure URL returns 200 status
-def is_live_url(url:str) -> bool:
+# hosts with an open circuit are reported as not live without making a request
+def is_live_url(url:str, use_breaker:bool = True) -> bool:
+  if use_breaker and not breaker.allow(url):
+    return False
   try:
     response = requests.get(url, timeout=5, headers=headers )
-    return response.status_code == 200
-  except requests.exceptions.RequestException:
-    return False
\ No newline at end of file
+  except requests.exceptions.RequestException as e:
+    if use_breaker and is_host_failure(e):
+      breaker.failure(url)
+    return False
+  if use_breaker:
+    if response.status_code >= 500:
+      breaker.failure(url)
+    else:
+      breaker.success(url)
+  return response.status_code == 200
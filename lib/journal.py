@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import uuid
+import datetime
+import threading
+
+try:
+  from logs import Logs
+  from state import shared_state_path, file_lock
+  from audio_formats import audio_formats
+  from integrity import load_manifest
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.state import shared_state_path, file_lock
+  from lib.audio_formats import audio_formats
+  from lib.integrity import load_manifest
+
+logger = Logs().get_logger()
+
+ADDED = 'added'
+RETAGGED = 'retagged'
+DELETED = 'deleted'
+EXPIRED = 'expired'
+
+# the journal is rewritten with only the live entries once it has this many lines (and 4x as many as live files)
+compact_after = 10_000
+
+_lock = threading.Lock()
+
+def enabled() -> bool:
+  """
+  Checks if library changes are journaled and players synced from the journal ('sync_journal', default on).
+  """
+  return os.getenv('sync_journal', '1') not in ['0', 'false', 'no']
+
+
+def journal_path() -> str:
+  return shared_state_path('journal.jsonl')
+
+
+def _locked():
+  # the journal is appended to by cron runs and the daemons, and replaced by compaction, one process at a time
+  return file_lock(journal_path())
+
+
+def _library() -> str:
+  return os.path.abspath(os.getenv('podcast_folder') or '')
+
+
+def _header() -> dict:
+  try:
+    with open(journal_path(), 'rb') as f:
+      return json.loads(f.readline())
+  except (OSError, ValueError):
+    return None
+
+
+def _write(entries:list[dict]) -> dict:
+  # starts a journal under a new id, players synced against the old one rescan
+  path = journal_path()
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  header = {'journal': uuid.uuid4().hex, 'library': _library(), 'created': time.time()}
+  tmp_path = f'{path}.{os.getpid()}.tmp'
+  with open(tmp_path, 'w', encoding='utf-8') as f:
+    for line in [header] + entries:
+      f.write(json.dumps(line) + '\n')
+  os.replace(tmp_path, path)
+  return header
+
+
+def _seed() -> list[dict]:
+  # the library as it is, for a journal started on an existing library
+  library = _library()
+  entries = []
+  for folder in sorted(os.listdir(library)) if os.path.isdir(library) else []:
+    location = os.path.join(library, folder)
+    if folder.startswith('.') or not os.path.isdir(location):
+      continue
+    manifest = load_manifest(location)
+    for name in sorted(os.listdir(location)):
+      if name.startswith('.') or os.path.splitext(name)[1] not in audio_formats:
+        continue
+      stat = os.stat(os.path.join(location, name))
+      entries.append({'op': ADDED, 'path': os.path.join(folder, name), 'size': stat.st_size,
+                      'sha256': manifest.get(name, {}).get('sha256'), 'mtime': stat.st_mtime, 't': time.time()})
+  return entries
+
+
+def _ensure() -> dict:
+  header = _header()
+  # nodes sharing the journal may mount the library at different paths
+  if header and (header.get('library') == _library() or os.getenv('shard_dir')):
+    return header
+  entries = _seed()
+  logger.info('Starting the library journal with %s files', len(entries))
+  return _write(entries)
+
+
+def _append(entries:list[dict]) -> None:
+  if not entries:
+    return
+  # one write per batch, under _locked() like everything that writes the journal
+  with open(journal_path(), 'a', encoding='utf-8') as f:
+    f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+
+
+def record(op:str, path:str, sha256:str = None) -> None:
+  """
+  Adds a library change to the journal.
+
+  Args:
+    op (str): 'added', 'retagged' or 'deleted'.
+    path (str): The file in the library.
+    sha256 (str): The file's hash, if known.
+  """
+  if not enabled():
+    return
+  entry = {'op': op, 'path': os.path.relpath(os.path.abspath(path), _library()), 'size': None,
+           'sha256': sha256, 'mtime': None, 't': time.time()}
+  if op != DELETED:
+    try:
+      stat = os.stat(path)
+    except OSError as e:
+      logger.error('Not journaling %s: %s', path, e)
+      return
+    entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime
+  try:
+    with _lock, _locked():
+      _ensure()
+      _append([entry])
+  except OSError as e:
+    logger.error('Failed journaling %s: %s', path, e)
+
+
+def record_deleted_tree(folder:str) -> None:
+  """
+  Journals the deletion of a podcast folder's audio files, before the folder is removed.
+  """
+  if not enabled() or not os.path.isdir(folder):
+    return
+  for name in os.listdir(folder):
+    if os.path.splitext(name)[1] in audio_formats:
+      record(DELETED, os.path.join(folder, name))
+
+
+def read(offset:int = 0) -> tuple[dict, list[dict], int]:
+  """
+  Reads the journal from a byte offset (0 for all of it).
+
+  Returns:
+    tuple: The header, the entries after the offset, and the offset of the end (the next reader's start).
+  """
+  entries = []
+  with _lock, _locked():
+    header = _ensure()
+    with open(journal_path(), 'rb') as f:
+      header_end = len(f.readline())
+      f.seek(max(offset, header_end))
+      position = f.tell()
+      for line in f:
+        if not line.endswith(b'\n'):
+          break
+        entries.append(json.loads(line))
+        position += len(line)
+  return header, entries, position
+
+
+def end() -> tuple[str, int]:
+  """
+  Returns the journal id and the offset of its end.
+  """
+  with _lock, _locked():
+    header = _ensure()
+    return header['journal'], os.path.getsize(journal_path())
+
+
+def replay(entries:list[dict]) -> dict[str, dict]:
+  """
+  Reduces entries to the latest entry per file, dropping deleted and expired files.
+
+  Returns:
+    dict: Relative path to its latest entry.
+  """
+  live = {}
+  for entry in entries:
+    if entry['op'] in (DELETED, EXPIRED):
+      live.pop(entry['path'], None)
+    else:
+      live[entry['path']] = entry
+  return live
+
+
+def latest(entries:list[dict]) -> dict[str, dict]:
+  """
+  Reduces entries to the latest entry per file, keeping deletions.
+
+  Returns:
+    dict: Relative path to its latest entry.
+  """
+  return {entry['path']: entry for entry in entries}
+
+
+def expire(cutoff:datetime.date) -> int:
+  """
+  Journals the files that fell out of the sync window: live files last changed before 'cutoff'
+  (old_date). Each file expires once, players remove it when they apply the entry.
+
+  Args:
+    cutoff (datetime.date): Files older than this date expire.
+
+  Returns:
+    int: The number of files that expired.
+  """
+  if not enabled():
+    return 0
+  with _lock, _locked():
+    _ensure()
+    with open(journal_path(), 'rb') as f:
+      f.readline()
+      entries = [json.loads(line) for line in f if line.endswith(b'\n')]
+    live = replay(entries)
+    now = time.time()
+    expired = [{'op': EXPIRED, 'path': path, 'size': entry['size'], 'sha256': entry['sha256'], 'mtime': entry['mtime'], 't': now}
+               for path, entry in live.items() if datetime.date.fromtimestamp(entry['mtime']) < cutoff]
+    _append(expired)
+    for entry in expired:
+      live.pop(entry['path'])
+
+    if len(entries) + len(expired) > max(compact_after, 4 * len(live)):
+      logger.info('Compacting the library journal: %s entries, %s live files', len(entries) + len(expired), len(live))
+      _write(list(live.values()))
+  return len(expired)
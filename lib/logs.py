@@ -1,13 +1,20 @@
 import os
+import copy
+import json
+import queue
+import atexit
 import logging
 import logging.config
-from logging.handlers import RotatingFileHandler
+import multiprocessing
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = "podcast"
 
+root_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 # Fetch log level from the environment variable (default to 'WARNING')
 log_level_str = os.getenv('log_level', 'info').upper()
 
@@ -16,41 +23,125 @@ try:
 except AttributeError:
   raise ValueError(f"Invalid log level: {log_level_str}. Must be one of: DEBUG, INFO, WARNING, ERROR, CRITICAL.")
 
+text_format = '%(asctime)s %(filename)s:%(levelname)s - %(message)s'
+
+class JsonFormatter(logging.Formatter):
+  """
+  Formats records as JSON lines with the time, level, source file, line and message.
+  """
+  def format(self, record:logging.LogRecord) -> str:
+    entry = {
+      'time': self.formatTime(record),
+      'level': record.levelname,
+      'file': record.filename,
+      'line': record.lineno,
+      'thread': record.threadName,
+      'message': record.getMessage()
+    }
+    if record.exc_info:
+      entry['exception'] = self.formatException(record.exc_info)
+    return json.dumps(entry)
+
+
+class _QueueHandler(QueueHandler):
+  """
+  A QueueHandler that keeps the exception of a record. The default prepare() folds the traceback
+  into the message and drops exc_info, so JsonFormatter could never write its 'exception' field.
+  The queue stays in this process, so the record doesn't have to be picklable.
+  """
+  def prepare(self, record:logging.LogRecord) -> logging.LogRecord:
+    # the message is still merged now, the arguments may change before the writer thread gets to it
+    record = copy.copy(record)
+    record.msg = record.getMessage()
+    record.args = None
+    return record
+
+
+def log_path() -> str:
+  """
+  Returns the log file path, set by 'log_file' (default 'podcast.log' in the project folder).
+  Relative paths are relative to the project folder, not the working directory.
+  """
+  return os.path.join(root_folder, os.getenv('log_file') or f'{app}.log')
+
+
 class Logs:
   """
   A class that sets up logging for the application.
-  
+
   This class provides a logging setup with rotating log files and console output.
   The log level can be configured via an environment variable, and it defaults to 'WARNING'.
   It supports log rotation to prevent log files from becoming too large.
+
+  Records are put on a queue and written by a background thread, so a slow disk
+  never blocks the caller. Set 'log_format=json' to write the log file as JSON lines.
   """
+  __listener = None
+
   def __init__(self, max_bytes: int = 5_000_000, backup_count: int = 5) -> None:
     """
     Initializes the logger and sets up log rotation and console output.
-    
+
     Args:
       max_bytes (int): The maximum size of the log file before it rotates (in bytes). Default is 5 MB.
       backup_count (int): The number of backup log files to keep. Default is 5.
-    """ 
+    """
     self.__logger = logging.getLogger(app)
     self.__logger.setLevel(log_level)
 
     if not self.__logger.hasHandlers():
-      # Create a rotating file handler
-      file_handler = RotatingFileHandler(f'{app}.log', maxBytes=max_bytes, backupCount=backup_count)
-      formatter = logging.Formatter('%(asctime)s %(filename)s:%(levelname)s - %(message)s')
-      file_handler.setFormatter(formatter)
-      self.__logger.addHandler(file_handler)
+      formatter = logging.Formatter(text_format)
+      handlers = []
+
+      # Create a rotating file handler. Spawned worker processes (e.g. the feed parser pool) leave
+      # the file to the main process, several processes rotating one file lose records
+      if multiprocessing.current_process().name == 'MainProcess':
+        path = log_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+        file_handler.setFormatter(JsonFormatter() if os.getenv('log_format', 'text').lower() == 'json' else formatter)
+        handlers.append(file_handler)
 
       # Create a stream handler for console output
       stream_handler = logging.StreamHandler()
       stream_handler.setFormatter(formatter)
-      self.__logger.addHandler(stream_handler)
+      handlers.append(stream_handler)
+
+      log_queue = queue.SimpleQueue()
+      Logs.__listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+      Logs.__listener.start()
+      self.__logger.addHandler(_QueueHandler(log_queue))
+      atexit.register(Logs.stop)
+      os.register_at_fork(after_in_child=Logs.__after_fork)
+
+  @staticmethod
+  def stop() -> None:
+    """
+    Writes any queued records and stops the background writer.
+    """
+    if Logs.__listener and Logs.__listener._thread:
+      Logs.__listener.stop()
+
+  @staticmethod
+  def __after_fork() -> None:
+    # the writer thread doesn't survive fork, so worker processes write directly, and only to the
+    # console: the log file is the main process's, several processes rotating it lose records
+    logger = logging.getLogger(app)
+    listener = Logs.__listener
+    if not listener:
+      return
+    for handler in list(logger.handlers):
+      if isinstance(handler, QueueHandler):
+        logger.removeHandler(handler)
+    for handler in listener.handlers:
+      if not isinstance(handler, logging.FileHandler):
+        logger.addHandler(handler)
+    Logs.__listener = None
 
   def get_logger(self) -> logging:
     """
     Returns the logger instance.
-    
+
     Returns:
       logging: The logger instance configured with file and console handlers.
     """
@@ -63,5 +154,5 @@ if __name__ == "__main__":
   logger.debug("This is a debug message")
   logger.info("This is an info message")
   logger.warning("This is a warning message")
-  logger.error("This is an error message") 
-  logger.critical("This is a critical message") 
\ No newline at end of file
+  logger.error("This is an error message")
+  logger.critical("This is a critical message")
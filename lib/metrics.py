@@ -0,0 +1,222 @@
+import os
+import time
+import json
+import threading
+from contextlib import contextmanager, nullcontext
+
+try:
+  from logs import Logs
+except ModuleNotFoundError:
+  from lib.logs import Logs
+
+logger = Logs().get_logger()
+
+_null = nullcontext()
+
+class _Timer:
+  def __init__(self, metrics, phase:str, feed:str, episode:str) -> None:
+    self.__metrics = metrics
+    self.__phase = phase
+    self.__feed = feed
+    self.__episode = episode
+
+  def __enter__(self):
+    self.__start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc) -> bool:
+    self.__metrics.observe(self.__phase, time.perf_counter() - self.__start, self.__feed, self.__episode)
+    return False
+
+
+class Metrics:
+  """
+  Collects per-phase timings and counters for a run, broken down per feed and per episode.
+
+  Turned on by setting 'metrics_dir' in .env. At the end of a run 'podcast.prom'
+  (Prometheus textfile collector format) and 'metrics.json' are written there, and
+  'sync.prom' and 'sync.json' at the end of a player sync.
+  When turned off, timers are a shared no-op context manager and counters return immediately.
+  """
+  def __init__(self) -> None:
+    self.__folder = os.getenv('metrics_dir')
+    self.enabled = bool(self.__folder)
+    self.__local = threading.local()
+    self.__lock = threading.Lock()
+    self.__hooks = []
+    self.reset()
+
+  def reset(self) -> None:
+    """
+    Clears collected data and restarts the run clock.
+    """
+    self.__start = time.time()
+    self.__phases = {}
+    self.__counters = {}
+    self.__feeds = {}
+
+  def add_hook(self, hook) -> None:
+    """
+    Registers a function called with the phase name whenever a timed phase ends.
+    Used by the profiler to take snapshots at phase boundaries.
+    """
+    self.__hooks.append(hook)
+    self.enabled = True
+
+  def remove_hook(self, hook) -> None:
+    """
+    Unregisters a hook added with add_hook.
+    """
+    self.__hooks.remove(hook)
+    self.enabled = bool(self.__folder or self.__hooks)
+
+  def __labels(self) -> tuple[str, str]:
+    return getattr(self.__local, 'feed', None), getattr(self.__local, 'episode', None)
+
+  @contextmanager
+  def labels(self, feed:str = None, episode:str = None):
+    """
+    Attributes timings and counters recorded inside the block (on this thread) to a feed and episode.
+
+    Args:
+      feed (str): The feed URL.
+      episode (str): The episode file name.
+    """
+    previous = self.__labels()
+    self.__local.feed = feed or previous[0]
+    self.__local.episode = episode
+    try:
+      yield
+    finally:
+      self.__local.feed, self.__local.episode = previous
+
+  def timer(self, phase:str, feed:str = None, episode:str = None):
+    """
+    Times a block as the given phase.
+
+    Args:
+      phase (str): The phase name, e.g. 'download'.
+      feed (str): The feed URL (optional). Defaults to the current labels.
+      episode (str): The episode file name (optional). Defaults to the current labels.
+
+    Returns:
+      A context manager.
+    """
+    if not self.enabled:
+      return _null
+    current = self.__labels()
+    return _Timer(self, phase, feed or current[0], episode or current[1])
+
+  def observe(self, phase:str, seconds:float, feed:str = None, episode:str = None) -> None:
+    """
+    Records the duration of a phase.
+    """
+    if not self.enabled:
+      return
+    for hook in self.__hooks:
+      hook(phase)
+    with self.__lock:
+      total = self.__phases.setdefault(phase, {'count': 0, 'seconds': 0.0})
+      total['count'] += 1
+      total['seconds'] += seconds
+      if feed:
+        entry = self.__feeds.setdefault(feed, {'phases': {}, 'episodes': {}})
+        phases = entry['episodes'].setdefault(episode, {}) if episode else entry['phases']
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+  def count(self, name:str, value:float = 1, feed:str = None) -> None:
+    """
+    Adds to a counter, e.g. bytes downloaded.
+
+    Args:
+      name (str): The counter name.
+      value (float): The amount to add.
+      feed (str): The feed URL (optional). Defaults to the current labels.
+    """
+    if not self.enabled:
+      return
+    feed = feed or self.__labels()[0]
+    with self.__lock:
+      self.__counters[name] = self.__counters.get(name, 0) + value
+      if feed:
+        counters = self.__feeds.setdefault(feed, {'phases': {}, 'episodes': {}}).setdefault('counters', {})
+        counters[name] = counters.get(name, 0) + value
+
+  def summary(self) -> dict:
+    """
+    Returns the collected data as a JSON serializable dict.
+    """
+    with self.__lock:
+      return {
+        'start': self.__start,
+        'seconds': time.time() - self.__start,
+        'phases': self.__phases,
+        'counters': self.__counters,
+        'feeds': self.__feeds
+      }
+
+  def __prometheus(self, data:dict, prefix:str) -> str:
+    # every value covers the last run only, so they are all gauges: a counter that drops back
+    # at each run reads as a reset and rate() turns it into nonsense
+    def escape(value:str) -> str:
+      return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    lines = [
+      f'# HELP {prefix}_phase_seconds Time spent in each phase of the last run.',
+      f'# TYPE {prefix}_phase_seconds gauge'
+    ]
+    lines += [f'{prefix}_phase_seconds{{phase="{phase}"}} {value["seconds"]:.6f}' for phase, value in data['phases'].items()]
+    lines += [
+      f'# HELP {prefix}_phase_count Number of times each phase ran in the last run.',
+      f'# TYPE {prefix}_phase_count gauge'
+    ]
+    lines += [f'{prefix}_phase_count{{phase="{phase}"}} {value["count"]}' for phase, value in data['phases'].items()]
+    lines += [
+      f'# HELP {prefix}_feed_phase_seconds Time spent in each phase per feed in the last run.',
+      f'# TYPE {prefix}_feed_phase_seconds gauge'
+    ]
+    for feed, entry in data['feeds'].items():
+      phases = dict(entry['phases'])
+      for episode_phases in entry['episodes'].values():
+        for phase, seconds in episode_phases.items():
+          phases[phase] = phases.get(phase, 0.0) + seconds
+      lines += [f'{prefix}_feed_phase_seconds{{feed="{escape(feed)}",phase="{phase}"}} {seconds:.6f}' for phase, seconds in phases.items()]
+    for name, value in data['counters'].items():
+      lines += [f'# TYPE {prefix}_{name} gauge', f'{prefix}_{name} {value}']
+    lines += [
+      f'# HELP {prefix}_run_seconds Duration of the last run.',
+      f'# TYPE {prefix}_run_seconds gauge',
+      f'{prefix}_run_seconds {data["seconds"]:.3f}',
+      f'# HELP {prefix}_last_run_timestamp_seconds When the last run started.',
+      f'# TYPE {prefix}_last_run_timestamp_seconds gauge',
+      f'{prefix}_last_run_timestamp_seconds {data["start"]:.0f}'
+    ]
+    return '\n'.join(lines) + '\n'
+
+  def write(self, name:str = 'podcast') -> None:
+    """
+    Writes '<name>.prom' and the JSON summary to 'metrics_dir'. Does nothing when metrics are turned off.
+
+    Each entry point writes its own files, so a player sync doesn't replace the last run's.
+
+    Args:
+      name (str): The entry point, also the metric name prefix. 'podcast' (the default) writes
+        podcast.prom and metrics.json, any other name '<name>.prom' and '<name>.json'.
+    """
+    if not self.__folder:
+      return
+    data = self.summary()
+    summary_name = 'metrics.json' if name == 'podcast' else f'{name}.json'
+    try:
+      os.makedirs(self.__folder, exist_ok=True)
+      for filename, content in [(f'{name}.prom', self.__prometheus(data, name)), (summary_name, json.dumps(data, indent=2))]:
+        path = os.path.join(self.__folder, filename)
+        # textfile collectors may read at any time, so replace the file atomically
+        with open(f'{path}.tmp', 'w') as f:
+          f.write(content)
+        os.replace(f'{path}.tmp', path)
+    except OSError as e:
+      logger.error('Failed writing metrics: %s', e)
+
+
+metrics = Metrics()
@@ -0,0 +1,75 @@
+import xml.etree.ElementTree as ET
+from email.utils import formatdate
+
+def parse_opml(text:str) -> list[dict]:
+  """
+  Reads the feeds listed in an OPML document, including feeds nested in folders.
+
+  Args:
+    text (str): The OPML document.
+
+  Returns:
+    list[dict]: A 'url' and 'title' for each outline with an xmlUrl.
+
+  Raises:
+    ValueError: If the document isn't valid XML.
+  """
+  try:
+    root = ET.fromstring(text)
+  except ET.ParseError as e:
+    raise ValueError(f'Invalid OPML: {e}')
+  feeds = []
+  for outline in root.iter('outline'):
+    url = outline.get('xmlUrl')
+    if url:
+      feeds.append({'url': url.strip(), 'title': outline.get('title') or outline.get('text')})
+  return feeds
+
+
+def parse_url_list(text:str) -> list[dict]:
+  """
+  Reads a plain list of feed URLs, one per line (or comma separated). Blank lines and # comments are skipped.
+
+  Args:
+    text (str): The list.
+
+  Returns:
+    list[dict]: A 'url' and 'title' (None) for each URL.
+  """
+  feeds = []
+  for line in text.splitlines():
+    line = line.split('#', 1)[0].strip()
+    feeds += [{'url': url.strip(), 'title': None} for url in line.split(',') if url.strip()]
+  return feeds
+
+
+def parse_feed_list(text:str) -> list[dict]:
+  """
+  Reads OPML or a plain URL list, whichever the text is.
+  """
+  if text.lstrip().startswith('<'):
+    return parse_opml(text)
+  return parse_url_list(text)
+
+
+def to_opml(feeds:list[dict], title:str = 'podcast.py subscriptions') -> str:
+  """
+  Builds an OPML 2.0 document.
+
+  Args:
+    feeds (list[dict]): A 'url' and 'title' for each feed.
+    title (str): The document title.
+
+  Returns:
+    str: The OPML document.
+  """
+  root = ET.Element('opml', version='2.0')
+  head = ET.SubElement(root, 'head')
+  ET.SubElement(head, 'title').text = title
+  ET.SubElement(head, 'dateCreated').text = formatdate()
+  body = ET.SubElement(root, 'body')
+  for feed in feeds:
+    name = feed.get('title') or feed['url']
+    ET.SubElement(body, 'outline', type='rss', text=name, title=name, xmlUrl=feed['url'])
+  ET.indent(root, space='  ')
+  return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding='unicode') + '\n'
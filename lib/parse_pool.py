@@ -0,0 +1,108 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+  from logs import Logs
+  from episode import Episode, parse_feed
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.episode import Episode, parse_feed
+
+logger = Logs().get_logger()
+
+_lock = threading.Lock()
+_pool = None
+# callers refreshing several feeds at once (see concurrent())
+_concurrent = 0
+
+def threshold() -> int:
+  """
+  Returns the feed size in bytes from which parsing goes to the process pool ('parse_pool_threshold', default 1 MB).
+  """
+  return int(os.getenv('parse_pool_threshold', 1_000_000))
+
+
+def workers() -> int:
+  """
+  Returns the number of parser processes ('parse_pool_workers', default one per CPU, 0 turns the pool off).
+  """
+  value = os.getenv('parse_pool_workers')
+  return int(value) if value else (os.cpu_count() or 1)
+
+
+def parse_records(content:bytes, descriptions:bool = False) -> tuple[dict, list[tuple]]:
+  """
+  Parses a feed in a worker process. Episodes come back as tuples of their fields (in
+  Episode.__slots__ order) instead of objects, so they pickle small and fast.
+  """
+  channel, episodes = parse_feed(content, descriptions)
+  return channel, [tuple(getattr(episode, name) for name in Episode.__slots__) for episode in episodes]
+
+
+def _executor():
+  global _pool
+  with _lock:
+    if _pool is None:
+      import multiprocessing
+      from concurrent.futures import ProcessPoolExecutor
+      # spawned workers don't inherit the parent's threads (downloads, the catalog writer) or their locks.
+      # They import the main module again, which only sets up console logging in a child (see lib/logs.py)
+      _pool = ProcessPoolExecutor(max_workers=workers(), mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+@contextmanager
+def concurrent():
+  """
+  Sends large feeds parsed inside the block to the process pool. Wrap code that refreshes several
+  feeds on a thread pool in it (a run loads its feeds this way, see podcast.load_feeds). A single
+  feed is parsed faster on the calling thread than handed to a worker, so the pool is only used
+  here. The workers stop when the last block ends.
+  """
+  global _concurrent
+  with _lock:
+    _concurrent += 1
+  try:
+    yield
+  finally:
+    with _lock:
+      _concurrent -= 1
+      idle = _concurrent == 0
+    if idle:
+      shutdown()
+
+
+def parse(content:bytes, descriptions:bool = False) -> tuple[dict, list[Episode]]:
+  """
+  Parses a feed like episode.parse_feed. Inside a concurrent() block, feeds of 'parse_pool_threshold'
+  bytes or more are parsed in a pool of worker processes, so several large feeds refreshed at once
+  use more than one core. Everything else is parsed on the calling thread.
+
+  Raises:
+    ValueError: If the XML can't be parsed or has no channel.
+  """
+  if not _concurrent or len(content) < threshold() or workers() < 1:
+    return parse_feed(content, descriptions)
+
+  try:
+    channel, records = _executor().submit(parse_records, content, descriptions).result()
+  except ValueError:
+    raise
+  except Exception as e:
+    # a broken pool (e.g. a worker was killed) doesn't stop the refresh
+    logger.warning('Feed parser process failed, parsing here: %s', e)
+    shutdown()
+    return parse_feed(content, descriptions)
+  return channel, [Episode(**dict(zip(Episode.__slots__, record))) for record in records]
+
+
+def shutdown() -> None:
+  """
+  Stops the worker processes, if any were started.
+  """
+  global _pool
+  with _lock:
+    pool, _pool = _pool, None
+  if pool:
+    pool.shutdown(wait=False, cancel_futures=True)
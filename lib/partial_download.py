@@ -0,0 +1,356 @@
+import os
+import time
+import hashlib
+import threading
+import requests
+
+try:
+  from logs import Logs
+  from headers import headers
+  from circuit_breaker import breaker, host_of, is_host_failure
+  from throughput import record_throughput
+  from metrics import metrics
+  from download import DownloadError, download_lock
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.headers import headers
+  from lib.circuit_breaker import breaker, host_of, is_host_failure
+  from lib.throughput import record_throughput
+  from lib.metrics import metrics
+  from lib.download import DownloadError, download_lock
+
+logger = Logs().get_logger()
+
+chunk_size = 65536
+
+_lock = threading.Lock()
+_active: dict[str, 'PartialDownload'] = {}
+
+def seek_gap() -> int:
+  """
+  Returns how far ahead of the download a read may start before the download jumps to it
+  ('stream_seek_gap' in bytes, default 1 MB). Closer reads just wait for the bytes to arrive.
+  """
+  return int(os.getenv('stream_seek_gap', 1_048_576))
+
+
+def idle_seconds() -> float:
+  """
+  Returns how long playback has to be idle before a finished stream is tagged ('stream_idle', default 30).
+  Tagging rewrites the file, which would move the bytes under a player that is still reading it.
+  """
+  return float(os.getenv('stream_idle', 30))
+
+
+class PartialDownload:
+  """
+  An episode download that can be read while it is still running.
+
+  Data is written to '<path>.part' at its offset in the file, so reads can be answered from
+  whatever ranges are on disk. A read past the download's position (by more than 'stream_seek_gap')
+  moves the download there when the server supports Range requests. Once the end of the file is
+  reached, the gaps left behind by seeking are filled in. The complete file is hashed and moved to
+  'path', like dl_with_progress_bar does.
+  """
+  def __init__(self, url:str, path:str, max_retries:int = 3) -> None:
+    self.url = url
+    self.path = path
+    self.part_path = f'{path}.part'
+    self.size: int = None
+    self.ranges_supported = False
+    self.info: dict = None
+    self.error: Exception = None
+    self.progress_callback = None
+    self.last_read = 0.0
+    self.__max_retries = max_retries
+    self.__ranges: list[list[int]] = []
+    self.__target = 0
+    self.__generation = 0
+    self.__done = False
+    # the first response arrived (the size may still be unknown)
+    self.__responded = False
+    self.__condition = threading.Condition()
+    self.__thread = None
+
+  def start(self) -> 'PartialDownload':
+    self.__thread = threading.Thread(target=self.__run, name='partial-download', daemon=True)
+    self.__thread.start()
+    return self
+
+  @property
+  def done(self) -> bool:
+    return self.__done
+
+  def downloaded(self) -> int:
+    """
+    Returns the number of bytes on disk.
+    """
+    with self.__condition:
+      return sum(end - start for start, end in self.__ranges)
+
+  def __covered(self, offset:int) -> int:
+    # end of the downloaded range containing offset, or None
+    for start, end in self.__ranges:
+      if start <= offset < end:
+        return end
+    return None
+
+  def __add(self, start:int, end:int) -> None:
+    ranges = sorted(self.__ranges + [[start, end]])
+    merged = [ranges[0]]
+    for range_start, range_end in ranges[1:]:
+      if range_start <= merged[-1][1]:
+        merged[-1][1] = max(merged[-1][1], range_end)
+      else:
+        merged.append([range_start, range_end])
+    self.__ranges = merged
+
+  def __next_gap(self) -> tuple[int, int]:
+    # the first missing range at or after the target, wrapping around to the start
+    for origin in (self.__target, 0):
+      position = origin
+      for start, end in self.__ranges:
+        if end <= position:
+          continue
+        if start > position:
+          return position, start
+        position = end
+      if self.size is None or position < self.size:
+        return position, self.size
+    return None
+
+  def wait_for_size(self, timeout:float) -> int:
+    """
+    Waits for the first response, which tells the size of the file if the server sends one.
+
+    Returns:
+      int: The size in bytes, or None if it is unknown until the download ends.
+    """
+    with self.__condition:
+      self.__condition.wait_for(lambda: self.__responded or self.__done or self.error, timeout)
+      if self.error and self.size is None:
+        raise DownloadError(str(self.error))
+      return self.size
+
+  def read(self, offset:int, length:int, timeout:float = 30) -> bytes:
+    """
+    Reads up to 'length' bytes at 'offset', waiting for at least one of them to be downloaded.
+
+    Returns:
+      bytes: The data (shorter than length if only part of it is on disk yet), b'' at the end of the file.
+
+    Raises:
+      DownloadError: If the download failed or nothing arrived within the timeout.
+    """
+    self.last_read = time.time()
+    with self.__condition:
+      if self.size is not None and offset >= self.size:
+        return b''
+      if self.__covered(offset) is None and self.ranges_supported and not self.__done:
+        # wait for bytes just ahead of the download, jump to ones further away
+        gap = self.__next_gap()
+        position = gap[0] if gap and gap[0] >= self.__target else None
+        if position is None or not position <= offset <= position + seek_gap():
+          logger.debug('Seeking download of %s to %s', self.path, offset)
+          self.__target = offset
+          self.__generation += 1
+      if not self.__condition.wait_for(lambda: self.__covered(offset) is not None or self.error or self.__done, timeout):
+        raise DownloadError(f'No data for {os.path.basename(self.path)} at {offset} after {timeout} seconds')
+      end = self.__covered(offset)
+      if end is None and self.info and offset >= self.size:
+        # the end of a file whose size wasn't known up front
+        return b''
+      if end is None:
+        raise DownloadError(str(self.error or 'Download stopped'))
+      sources = [self.path] if self.info else [self.part_path, self.path]
+    for source in sources:
+      try:
+        with open(source, 'rb') as f:
+          f.seek(offset)
+          return f.read(min(length, end - offset))
+      except FileNotFoundError:
+        # moved into place since the check
+        continue
+    raise DownloadError(f'{self.path} is gone')
+
+  def result(self, progress_callback=None) -> dict:
+    """
+    Waits for the download to finish and playback to go idle.
+
+    Returns:
+      dict: 'size', 'sha256', 'etag', 'last_modified' and 'url', like dl_with_progress_bar.
+
+    Raises:
+      DownloadError: If the download failed.
+    """
+    self.progress_callback = progress_callback
+    with self.__condition:
+      self.__condition.wait_for(lambda: self.__done)
+    if self.error:
+      raise DownloadError(str(self.error))
+    while time.time() - self.last_read < idle_seconds():
+      time.sleep(1)
+    return self.info
+
+  def cancel(self) -> None:
+    """
+    Stops the download and removes the partial file.
+    """
+    with self.__condition:
+      self.error = self.error or DownloadError('Cancelled')
+      self.__generation += 1
+      self.__condition.notify_all()
+    if self.__thread:
+      self.__thread.join(5)
+    try:
+      os.remove(self.part_path)
+    except OSError:
+      pass
+
+  def __fetch(self, session:requests.Session, start:int, end:int, generation:int, file) -> None:
+    request_headers = dict(headers)
+    if start or end is not None:
+      request_headers['Range'] = f'bytes={start}-' if end is None else f'bytes={start}-{end - 1}'
+    with metrics.timer('download_connect'):
+      media = session.get(self.url, stream=True, headers=request_headers, timeout=30)
+    media.raise_for_status()
+
+    with self.__condition:
+      if not self.__responded:
+        self.__responded = True
+        total = media.headers.get('content-range', '').rpartition('/')[2]
+        self.size = int(total) if total.isdigit() else int(media.headers.get('content-length') or 0) or None
+        self.ranges_supported = media.headers.get('accept-ranges') == 'bytes' or media.status_code == 206
+        self.__etag = media.headers.get('etag')
+        self.__last_modified = media.headers.get('last-modified')
+        self.__final_url = media.url
+        if self.size:
+          file.truncate(self.size)
+        self.__condition.notify_all()
+      if start and media.status_code != 206:
+        # the server ignored the Range header, only sequential downloading works
+        self.ranges_supported = False
+        self.__ranges = []
+        start = 0
+
+    position = start
+    with media:
+      for data in media.iter_content(chunk_size):
+        file.seek(position)
+        file.write(data)
+        file.flush()
+        metrics.count('bytes_downloaded', len(data))
+        with self.__condition:
+          self.__add(position, position + len(data))
+          position += len(data)
+          self.__condition.notify_all()
+          if generation != self.__generation:
+            return
+          # ran into bytes already on disk, carry on with the next gap
+          if self.__covered(position) is not None:
+            return
+        if self.progress_callback:
+          self.progress_callback(self.downloaded(), self.size or 0, self.__start_time)
+    if self.size is None:
+      with self.__condition:
+        self.size = position
+        self.__condition.notify_all()
+
+  def __run(self) -> None:
+    self.__start_time = round(time.time() * 1000)
+    try:
+      with download_lock(self.path) as locked:
+        if not locked:
+          raise DownloadError(f'{os.path.basename(self.path)} is already being downloaded by another process')
+        try:
+          self.__transfer()
+        except Exception:
+          try:
+            os.remove(self.part_path)
+          except OSError:
+            pass
+          raise
+    except Exception as e:
+      # anything (e.g. a malformed header) has to fail the download, result() relies on error or info
+      logger.error('Streamed download of %s failed: %s', self.path, e)
+      with self.__condition:
+        self.error = e
+    finally:
+      with self.__condition:
+        self.__done = True
+        self.__condition.notify_all()
+
+  def __transfer(self) -> None:
+    retries = 0
+    session = requests.Session()
+    with open(self.part_path, 'wb') as file:
+      while True:
+        with self.__condition:
+          if self.error:
+            return
+          gap = self.__next_gap() if self.__ranges or self.size else (0, None)
+          if gap is None:
+            break
+          generation = self.__generation
+          if not self.ranges_supported and self.__ranges:
+            # without Range requests an interrupted download starts over
+            self.__ranges = []
+            gap = (0, None)
+        if not breaker.allow(self.url):
+          raise DownloadError(f'Circuit open for {host_of(self.url)}. Download skipped.')
+        try:
+          self.__fetch(session, gap[0], gap[1], generation, file)
+          breaker.success(self.url)
+          retries = 0
+        except requests.exceptions.RequestException as e:
+          retries += 1
+          logger.error('An error occurred during the download: %s (Retry %s/%s)', e, retries, self.__max_retries)
+          if is_host_failure(e):
+            breaker.failure(self.url)
+          if retries >= self.__max_retries:
+            raise DownloadError(f'Download failed after {self.__max_retries} retries.')
+          time.sleep(2)
+
+    seconds = max((round(time.time() * 1000) - self.__start_time) / 1000, 0.001)
+    sha = hashlib.sha256()
+    with open(self.part_path, 'rb') as f:
+      for data in iter(lambda: f.read(1048576), b''):
+        sha.update(data)
+    record_throughput(self.size, seconds)
+    with self.__condition:
+      os.replace(self.part_path, self.path)
+      self.info = {
+        'size': self.size,
+        'sha256': sha.hexdigest(),
+        'etag': self.__etag,
+        'last_modified': self.__last_modified,
+        'url': self.__final_url
+      }
+    logger.info('Streamed download completed: %s', os.path.basename(self.path))
+
+
+def start(url:str, path:str) -> PartialDownload:
+  """
+  Starts (or returns the running) streamable download of an episode to 'path'.
+  """
+  with _lock:
+    partial = _active.get(path)
+    if partial is None or partial.error:
+      partial = _active[path] = PartialDownload(url, path).start()
+    return partial
+
+
+def active(path:str) -> PartialDownload:
+  """
+  Returns the streamable download running for 'path', or None.
+  """
+  with _lock:
+    return _active.get(path)
+
+
+def finish(path:str) -> None:
+  """
+  Forgets a streamable download once its file has been recorded and tagged.
+  """
+  with _lock:
+    _active.pop(path, None)
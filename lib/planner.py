@@ -0,0 +1,127 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+  from logs import Logs
+  from resolve_url import resolve
+  from throughput import estimated_rate
+  from retention import parse_size
+  from download import bytes_to_readable_size, bytes_to_readable_rate, seconds_to_readable_time
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.resolve_url import resolve
+  from lib.throughput import estimated_rate
+  from lib.retention import parse_size
+  from lib.download import bytes_to_readable_size, bytes_to_readable_rate, seconds_to_readable_time
+
+logger = Logs().get_logger()
+
+# enclosure lengths outside this range are placeholders (length="1", "0" or seconds instead of bytes)
+min_plausible_length = 100_000
+max_plausible_length = 10 * 1024 ** 3
+
+def plausible_length(length:int) -> bool:
+  """
+  Checks if an enclosure length looks like a real file size.
+  """
+  return length is not None and min_plausible_length <= length <= max_plausible_length
+
+
+def _head_length(url:str) -> int:
+  # the resolver's HEAD follows redirects and caches the chain for the download that may follow
+  length = resolve(url).get('length')
+  try:
+    length = int(length)
+  except (TypeError, ValueError):
+    return None
+  return length if length > 0 else None
+
+
+def size_episodes(episodes:list, workers:int = None) -> list[dict]:
+  """
+  Sizes episodes from their enclosure length, sending HEAD requests (a bounded number at a time)
+  for the ones whose length is missing or implausible.
+
+  Args:
+    episodes (list[Episode]): The episodes.
+    workers (int): Concurrent HEAD requests (default 'plan_concurrency' or 8).
+
+  Returns:
+    list[dict]: 'episode', 'size' (None if still unknown) and 'source' ('feed', 'head' or None) per episode.
+  """
+  workers = workers or int(os.getenv('plan_concurrency', 8))
+  sized = [{'episode': episode, 'size': episode.length, 'source': 'feed'} for episode in episodes]
+  unsized = [item for item in sized if not plausible_length(item['size'])]
+  if not unsized:
+    return sized
+
+  logger.info('Sending HEAD requests for %s episodes without a usable length', len(unsized))
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    lengths = executor.map(_head_length, [item['episode'].url for item in unsized])
+    for item, length in zip(unsized, lengths):
+      item['size'] = length
+      item['source'] = 'head' if length else None
+  return sized
+
+
+def summarize(feeds:list[dict], folder:str) -> dict:
+  """
+  Totals a download plan and checks it against the measured throughput and the free disk space.
+
+  Args:
+    feeds (list[dict]): 'url', 'title' and 'episodes' (size_episodes results) per feed.
+    folder (str): The podcast folder the downloads would go to.
+
+  Returns:
+    dict: Episode counts, 'bytes', 'estimated_bytes' (including unknown sizes at 'assumed_episode_size'),
+    'rate', 'seconds', 'free', 'needed' (including 'min_free_space') and 'fits'.
+  """
+  assumed_size = int(os.getenv('assumed_episode_size', 50_000_000))
+  min_free = os.getenv('min_free_space')
+  min_free = parse_size(min_free) if min_free else 0
+
+  episodes = [item for feed in feeds for item in feed['episodes']]
+  known = sum(item['size'] for item in episodes if item['size'])
+  unknown = sum(1 for item in episodes if not item['size'])
+  estimated = known + unknown * assumed_size
+  rate = estimated_rate()
+  free = shutil.disk_usage(folder).free
+
+  return {
+    'feeds': len(feeds),
+    'episodes': len(episodes),
+    'sized_by_head': sum(1 for item in episodes if item['source'] == 'head'),
+    'unknown_size': unknown,
+    'bytes': known,
+    'estimated_bytes': estimated,
+    'rate': rate,
+    'seconds': estimated / rate if rate else None,
+    'free': free,
+    'needed': estimated + min_free,
+    'fits': estimated + min_free <= free
+  }
+
+
+def report(feeds:list[dict], summary:dict) -> str:
+  """
+  Formats a plan for the terminal.
+  """
+  lines = []
+  for feed in feeds:
+    size = sum(item['size'] or 0 for item in feed['episodes'])
+    lines.append(f'{feed["title"]}: {len(feed["episodes"])} episodes, {bytes_to_readable_size(size)}')
+
+  unknown = ''
+  if summary['unknown_size']:
+    unknown = f' ({summary["unknown_size"]} without a size, estimated {bytes_to_readable_size(summary["estimated_bytes"])} in total)'
+  lines += [
+    '',
+    f'{summary["episodes"]} episodes from {summary["feeds"]} feeds: {bytes_to_readable_size(summary["bytes"])}{unknown}',
+    f'{summary["sized_by_head"]} sized with HEAD requests',
+    f'Estimated time: {seconds_to_readable_time(int(summary["seconds"] or 0))} at {bytes_to_readable_rate(summary["rate"])}',
+    f'Disk space needed: {bytes_to_readable_size(summary["needed"])}, free: {bytes_to_readable_size(summary["free"])}'
+  ]
+  if not summary['fits']:
+    lines.append(f'Not enough space: {bytes_to_readable_size(summary["needed"] - summary["free"])} short')
+  return '\n'.join(lines)
@@ -3,24 +3,49 @@ from urllib.parse import urlparse
 
 try:
   from format_filename import format_filename
+  from integrity import check_file, damaged
+  from logs import Logs
+  from episode import Episode
 except ModuleNotFoundError:
   from lib.format_filename import format_filename
+  from lib.integrity import check_file, damaged
+  from lib.logs import Logs
+  from lib.episode import Episode
 
-def podcast_episode_exists(podcast_title: str, episode: dict) -> dict:
+logger = Logs().get_logger()
+
+def episode_location(podcast_title:str, episode:Episode) -> tuple[str, str]:
+  """
+  Returns the folder name (relative to podcast_folder) and file name an episode is stored under.
+
+  Args:
+    podcast_title (str): The title of the podcast.
+    episode (Episode): The episode, which must have an enclosure URL.
+
+  Returns:
+    tuple[str, str]: The folder name and the file name.
+  """
+  # Extract the file extension from the URL (e.g., .mp3, .m4a)
+  file_ext: str = os.path.splitext(urlparse(episode.url).path)[-1]
+  return format_filename(podcast_title), format_filename(f"{episode.title}{file_ext}").replace(' ', '.')
+
+
+def podcast_episode_exists(podcast_title: str, episode: Episode, manifest: dict = None) -> dict:
   """
   Checks if a podcast episode file exists in the local storage and returns detailed information about the episode.
 
   This function constructs the file path based on the provided podcast title and episode information,
   then checks if the episode file exists in the designated podcast folder. It returns a dictionary
   containing whether the episode exists, the file path, the formatted filename, and the download URL.
+  A file that fails the integrity check (truncated or corrupted) does not count as existing, so it gets downloaded again.
 
   Args:
     podcast_title (str): The title of the podcast. Used to generate the folder path for the podcast.
-    episode (dict): A dictionary containing metadata of the podcast episode, including:
-      - 'enclosure' (dict): Contains the URL to the downloadable episode file.
-      - 'itunes:season' (int): Season number of the episode (optional).
-      - 'itunes:episode' (int): Episode number of the episode (optional).
-      - 'title' (str): The title of the episode.
+    episode (Episode): The episode metadata, including:
+      - url (str): The URL to the downloadable episode file.
+      - title (str): The title of the episode.
+    manifest (dict): The integrity manifest of the podcast's folder (optional). Callers checking many
+      episodes load it once with integrity.load_manifest, otherwise it is read for every episode.
 
   Returns:
     dict: A dictionary with the following keys:
@@ -28,14 +53,15 @@ def podcast_episode_exists(podcast_title: str, episode: dict) -> dict:
       - 'path' (str): The relative file path where the episode file is located, from the podcast folder.
       - 'filename' (str): The formatted filename for the episode.
       - 'url' (str): The URL to download the episode.
+      - 'integrity' (str): The result of the integrity check (see lib/integrity.py).
 
   Example:
-    result = podcast_episode_exists('My Podcast', {
-      'enclosure': {'@url': 'https://example.com/episode.mp3'},
-      'itunes:season': 1,
-      'itunes:episode': 2,
-      'title': 'Episode Title'
-    })
+    result = podcast_episode_exists('My Podcast', Episode(
+      title='Episode Title',
+      url='https://example.com/episode.mp3',
+      season=1,
+      number=2
+    ))
     print(result)
     # Output:
     # {'exists': True, 'path': '/podcasts/MyPodcast/S01.E02.Episode.Title.mp3', 'filename': 'S01.E02.Episode.Title.mp3', 'url': 'https://example.com/episode.mp3'}
@@ -44,27 +70,30 @@ def podcast_episode_exists(podcast_title: str, episode: dict) -> dict:
   # Get the folder path where podcasts are stored, from environment variables
   folder: str = os.getenv('podcast_folder')
   
-  try:
-    # Extract the download URL from the episode metadata
-    download_url: str = episode['enclosure']['@url']
-  except KeyError as e:
-    raise Exception(f'Failed getting an episode url from provided data. Key does not exist: {e}')
+  # Extract the download URL from the episode metadata
+  download_url: str = episode.url
+  if not download_url:
+    raise Exception('Failed getting an episode url from provided data. The item has no enclosure')
   
-  # Extract the file extension from the URL (e.g., .mp3, .m4a)
-  file_ext: str = os.path.splitext(urlparse(download_url).path)[-1]
+  podcast_folder, filename = episode_location(podcast_title, episode)
 
-  filename: str = format_filename(f"{episode['title']}{file_ext}").replace(' ', '.')
-  
   # Create the full directory path for the podcast based on its title
-  location: str = os.path.join(folder, format_filename(podcast_title))
+  location: str = os.path.join(folder, podcast_folder)
   
   # Construct the full path to the episode file
   path: str = os.path.join(location, filename)
   
+  # Compare the file's size with what was recorded when it was downloaded and tagged
+  record: dict = None if manifest is None else manifest.get(filename, {})
+  integrity: str = check_file(path, record)
+  if integrity in damaged:
+    logger.warning('%s is %s, queued for download', filename, integrity)
+
   # Return a dictionary with the file existence status and additional information
   return {
-    'exists': os.path.exists(path) and os.path.isfile(path),  # Check if the file exists and is a file
+    'exists': os.path.isfile(path) and integrity not in damaged,  # Check if the file exists, is a file and is intact
     'path': path.replace(folder, ''),  # Return the relative path, excluding the podcast folder
     'filename': filename,  # Return the formatted filename
-    'url': download_url  # Return the URL to download the episode
+    'url': download_url,  # Return the URL to download the episode
+    'integrity': integrity  # Return the integrity check result
   }
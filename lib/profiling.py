@@ -0,0 +1,138 @@
+import os
+import io
+import time
+import random
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+  from logs import Logs
+  from state import root_folder
+  from metrics import metrics
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.state import root_folder
+  from lib.metrics import metrics
+
+logger = Logs().get_logger()
+
+def profile_folder() -> str:
+  """
+  Returns the folder profiles are written to, set by 'profile_dir' (default 'profiles' in the project folder).
+  """
+  return os.getenv('profile_dir') or os.path.join(root_folder, 'profiles')
+
+
+def sampled() -> bool:
+  """
+  Decides whether an unattended run is profiled, from 'profile_sample' (percent of runs, default 0).
+  """
+  try:
+    percent = float(os.getenv('profile_sample', 0))
+  except ValueError:
+    logger.error('Invalid profile_sample: %s', os.getenv('profile_sample'))
+    return False
+  return random.random() * 100 < percent
+
+
+class _Allocations:
+  """
+  Tracks the peak traced memory of each phase, keeping a snapshot of the phase with the highest peak.
+  """
+  def __init__(self) -> None:
+    self.__lock = threading.Lock()
+    self.phases = {}
+    self.peak = 0
+    self.peak_phase = None
+    self.peak_snapshot = None
+
+  def __call__(self, phase:str) -> None:
+    _, peak = tracemalloc.get_traced_memory()
+    with self.__lock:
+      self.phases[phase] = max(self.phases.get(phase, 0), peak)
+      if peak > self.peak:
+        self.peak = peak
+        self.peak_phase = phase
+        self.peak_snapshot = tracemalloc.take_snapshot()
+      tracemalloc.reset_peak()
+
+
+def _top(snapshot, limit:int) -> list[str]:
+  stats = snapshot.filter_traces([
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')
+  ]).statistics('lineno')
+  return [f'  {stat.size / 1_048_576:8.2f} MB {stat.count:8} blocks  {stat.traceback}' for stat in stats[:limit]]
+
+
+def _report(path:str, profiler, allocations:_Allocations, seconds:float, limit:int) -> None:
+  import pstats
+  out = io.StringIO()
+  out.write(f'{seconds:.2f}s\n\n')
+  pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+
+  if allocations:
+    out.write('Peak traced memory by phase\n')
+    for phase, peak in sorted(allocations.phases.items(), key=lambda item: -item[1]):
+      out.write(f'  {peak / 1_048_576:8.2f} MB  {phase}\n')
+    if allocations.peak_snapshot:
+      out.write(f'\nTop allocations at the end of {allocations.peak_phase} (highest peak, {allocations.peak / 1_048_576:.2f} MB)\n')
+      out.write('\n'.join(_top(allocations.peak_snapshot, limit)) + '\n')
+    out.write('\nTop allocations at the end of the run\n')
+    out.write('\n'.join(_top(tracemalloc.take_snapshot(), limit)) + '\n')
+
+  with open(path, 'w') as f:
+    f.write(out.getvalue())
+
+
+@contextmanager
+def profiled(name:str, enabled:bool = True):
+  """
+  Runs the block under cProfile, optionally tracing memory with tracemalloc.
+
+  Writes '<name>-<time>.prof' (open with pstats or snakeviz) and '<name>-<time>.txt'
+  (top functions by cumulative time, and with 'profile_tracemalloc' set the peak memory
+  of each phase and the top allocations) to the profile folder.
+  Only the thread running the block is profiled.
+
+  Args:
+    name (str): Prefix of the report files, e.g. 'podcast' or 'sync'.
+    enabled (bool): Whether to profile. When False the block just runs.
+  """
+  if not enabled:
+    yield
+    return
+
+  import cProfile
+
+  trace_memory = os.getenv('profile_tracemalloc', 'false').lower() in ['true', '1', 'yes']
+  limit = int(os.getenv('profile_top', 30))
+  allocations = None
+  if trace_memory:
+    tracemalloc.start(int(os.getenv('profile_frames', 5)))
+    allocations = _Allocations()
+    metrics.add_hook(allocations)
+
+  profiler = cProfile.Profile()
+  start = time.perf_counter()
+  profiler.enable()
+  try:
+    yield
+  finally:
+    profiler.disable()
+    seconds = time.perf_counter() - start
+    folder = profile_folder()
+    path = os.path.join(folder, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}')
+    try:
+      os.makedirs(folder, exist_ok=True)
+      profiler.dump_stats(f'{path}.prof')
+      _report(f'{path}.txt', profiler, allocations, seconds, limit)
+      logger.info('Profile written to %s.prof', path)
+    except OSError as e:
+      logger.error('Failed writing profile: %s', e)
+    finally:
+      if allocations:
+        metrics.remove_hook(allocations)
+        tracemalloc.stop()
@@ -0,0 +1,29 @@
+import sys
+
+class _NoProgress:
+  """
+  Stands in for a tqdm bar when output isn't a terminal.
+  """
+  def update(self, n:int = 1) -> None:
+    pass
+
+  def close(self) -> None:
+    pass
+
+
+def progress_bar(iterable=None, **kwargs):
+  """
+  Returns a tqdm progress bar when stderr is a terminal. Under cron, or when output is redirected,
+  tqdm isn't imported and the iterable (or a no-op bar) is returned instead.
+
+  Args:
+    iterable: Iterable to wrap (optional).
+    **kwargs: Passed on to tqdm, e.g. total, unit, desc.
+
+  Returns:
+    A tqdm bar, the iterable, or a no-op object with update() and close().
+  """
+  if not sys.stderr.isatty():
+    return iterable if iterable is not None else _NoProgress()
+  from tqdm import tqdm
+  return tqdm(iterable, **kwargs)
@@ -0,0 +1,20 @@
+import datetime
+
+def parse_pub_date(pub_date:str) -> datetime.datetime:
+  """
+  Parses an RSS pubDate string.
+
+  Args:
+    pub_date (str): The date string from the episode's 'pubDate' field.
+
+  Returns:
+    datetime.datetime: The parsed date.
+
+  Raises:
+    ValueError: If the string is not in RFC 822 format.
+    TypeError: If no string is given.
+  """
+  try:
+    return datetime.datetime.strptime(pub_date, '%a, %d %b %Y %H:%M:%S %z')
+  except ValueError:
+    return datetime.datetime.strptime(pub_date, '%a, %d %b %Y %H:%M:%S %Z')
@@ -0,0 +1,181 @@
+import os
+import re
+import time
+import threading
+import requests
+from urllib.parse import urljoin
+from email.utils import parsedate_to_datetime
+
+try:
+  from logs import Logs
+  from headers import headers
+  from state import state_path, load_state, save_state
+  from metrics import metrics
+  from circuit_breaker import breaker, is_host_failure
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.headers import headers
+  from lib.state import state_path, load_state, save_state
+  from lib.metrics import metrics
+  from lib.circuit_breaker import breaker, is_host_failure
+
+logger = Logs().get_logger()
+
+redirect_codes = [301, 302, 303, 307, 308]
+max_hops = 10
+
+_lock = threading.Lock()
+_cache = None
+_stats = {'resolved': 0, 'cached': 0, 'hops': 0, 'hops_skipped': 0, 'ms_saved': 0}
+
+def _load() -> dict:
+  global _cache
+  if _cache is None:
+    _cache = load_state(state_path('redirects.json'), {})
+  return _cache
+
+
+def _save() -> None:
+  try:
+    save_state(state_path('redirects.json'), _cache)
+  except OSError as e:
+    logger.error('Failed saving redirect cache: %s', e)
+
+
+def _ttl(response) -> float:
+  """
+  Returns how long a response may be cached, from its Cache-Control or Expires headers.
+  """
+  cache_control = response.headers.get('cache-control', '').lower()
+  if 'no-store' in cache_control or 'no-cache' in cache_control:
+    return 0
+  match = re.search(r'max-age=(\d+)', cache_control)
+  if match:
+    return int(match.group(1))
+  if response.headers.get('expires'):
+    try:
+      return parsedate_to_datetime(response.headers['expires']).timestamp() - time.time()
+    except (TypeError, ValueError):
+      return 0
+  return None
+
+
+def _head(url:str):
+  if not breaker.allow(url):
+    raise requests.exceptions.ConnectionError(f'Circuit open for {url}')
+  try:
+    response = requests.head(url, headers=headers, allow_redirects=False, timeout=10)
+    # some hosts don't allow HEAD, fetch only the headers of a GET instead
+    if response.status_code in [403, 405, 501]:
+      response = requests.get(url, headers=headers, allow_redirects=False, timeout=10, stream=True)
+      response.close()
+    response.raise_for_status()
+  except requests.exceptions.RequestException as e:
+    if is_host_failure(e):
+      breaker.failure(url)
+    else:
+      breaker.success(url)
+    raise
+  breaker.success(url)
+  return response
+
+
+def _unresolved(url:str) -> dict:
+  return {'url': url, 'chain': [], 'length': None, 'etag': None, 'expires': 0, 'ms': 0}
+
+
+def resolve(url:str) -> dict:
+  """
+  Follows an enclosure URL's redirect chain, using the cache while the chain hasn't expired.
+
+  The expiry is the shortest Cache-Control max-age or Expires of the hops, or 'redirect_ttl'
+  seconds (default 1 day) when the hops don't say. Responses marked no-cache or no-store aren't cached,
+  and neither are chains longer than max_hops. Hosts with an open circuit aren't contacted, and
+  failing hosts count against their circuit like a failed download.
+
+  Args:
+    url (str): The enclosure URL.
+
+  Returns:
+    dict: The final 'url', the redirect 'chain', the 'length' and 'etag' of the final response,
+    and 'expires'. If resolving fails the original URL is returned with an empty chain.
+  """
+  with _lock:
+    entry = _load().get(url)
+    if entry and entry['expires'] > time.time():
+      _stats['cached'] += 1
+      _stats['hops_skipped'] += len(entry['chain'])
+      _stats['ms_saved'] += entry['ms']
+      return entry
+
+  with metrics.timer('redirect_resolve'):
+    return _resolve(url)
+
+
+def _resolve(url:str) -> dict:
+  start = time.monotonic()
+  chain = []
+  ttls = []
+  current = url
+  try:
+    response = _head(current)
+    while response.status_code in redirect_codes and len(chain) < max_hops:
+      ttls.append(_ttl(response))
+      current = urljoin(current, response.headers['location'])
+      chain.append(current)
+      response = _head(current)
+  except (requests.exceptions.RequestException, KeyError) as e:
+    logger.debug('Failed resolving %s: %s', url, e)
+    return _unresolved(url)
+
+  if response.status_code in redirect_codes:
+    # cut off at max_hops, the download follows the rest. Neither the chain nor the
+    # redirect's headers describe the file, so nothing is cached
+    logger.debug('Stopped resolving %s after %s redirects', url, len(chain))
+    return dict(_unresolved(current), chain=chain)
+
+  ttls.append(_ttl(response))
+  known = [ttl for ttl in ttls if ttl is not None]
+  ttl = min(known) if known else float(os.getenv('redirect_ttl', 86400))
+
+  entry = {
+    'url': current,
+    'chain': chain,
+    'length': response.headers.get('content-length'),
+    'etag': response.headers.get('etag'),
+    'expires': time.time() + ttl,
+    'ms': round((time.monotonic() - start) * 1000)
+  }
+
+  with _lock:
+    _stats['resolved'] += 1
+    _stats['hops'] += len(chain)
+    if ttl > 0:
+      _load()[url] = entry
+      _save()
+
+  if chain:
+    logger.debug('Resolved %s -> %s (%s redirects)', url, current, len(chain))
+  return entry
+
+
+def invalidate(url:str) -> None:
+  """
+  Drops a cached redirect chain, e.g. after the final URL stopped working.
+
+  Args:
+    url (str): The original enclosure URL.
+  """
+  with _lock:
+    if _load().pop(url, None):
+      _save()
+
+
+def log_summary() -> None:
+  """
+  Logs the redirect hops followed and skipped this run, and the time the cache saved.
+  """
+  if not _stats['resolved'] and not _stats['cached']:
+    return
+  logger.info('Redirects: %s hops followed for %s URLs, %s hops skipped for %s cached URLs (%.1fs saved)',
+              _stats['hops'], _stats['resolved'], _stats['hops_skipped'], _stats['cached'], _stats['ms_saved'] / 1000)
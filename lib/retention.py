@@ -0,0 +1,337 @@
+import os
+import time
+import shutil
+import threading
+
+try:
+  from logs import Logs
+  from is_audio import is_audio_file
+  from budget import parse_budget
+  from integrity import forget, load_manifest
+  from subscriptions import feed_folders
+  from download import bytes_to_readable_size
+  import journal
+  import catalog
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.is_audio import is_audio_file
+  from lib.budget import parse_budget
+  from lib.integrity import forget, load_manifest
+  from lib.subscriptions import feed_folders
+  from lib.download import bytes_to_readable_size
+  from lib import journal
+  from lib import catalog
+
+logger = Logs().get_logger()
+
+_lock = threading.Lock()
+# library size as of the last scan plus what was downloaded (or reserved by make_room) since
+_usage = None
+# bytes approved by make_room for downloads that are still running, not yet taken from the free space
+_pending = 0
+# returns the folder names make_room may evict from (None: all), see restrict()
+_writable = None
+
+def parse_size(value:str) -> int:
+  """
+  Parses a size such as '500MB' or '2GB' into bytes.
+
+  Raises:
+    ValueError: If the value isn't a size.
+  """
+  seconds, size = parse_budget(value)
+  if seconds is not None or size is None:
+    raise ValueError(f'Invalid size: {value}')
+  return size
+
+
+def parse_rule(value:str) -> dict:
+  """
+  Parses a retention rule: one or more of 'last:N', 'days:N' and 'size:SIZE' joined by '+'.
+
+  Args:
+    value (str): The rule, e.g. 'last:10' or 'days:90+size:5GB'.
+
+  Returns:
+    dict: 'last', 'days' and 'max_bytes' (None where not set).
+
+  Raises:
+    ValueError: If a part isn't a valid rule.
+  """
+  rule = {'last': None, 'days': None, 'max_bytes': None}
+  for part in value.split('+'):
+    kind, _, amount = part.strip().partition(':')
+    if kind == 'last':
+      rule['last'] = int(amount)
+    elif kind == 'days':
+      rule['days'] = float(amount)
+    elif kind == 'size':
+      rule['max_bytes'] = parse_size(amount)
+    else:
+      raise ValueError(f'Invalid retention rule: {part}')
+  return rule
+
+
+def retention_rules() -> dict[str, dict]:
+  """
+  Fetches per-feed retention rules from the 'retention' environment variable.
+
+  The variable is a comma separated list of feed=rule pairs. The feed is a feed URL or a folder
+  name in podcast_folder, '*' sets the rule for feeds not listed, e.g.
+  '*=days:365,https://example.com/feed.xml=last:10,Daily News=days:7+size:2GB'
+
+  Returns:
+    dict[str, dict]: Folder name (or '*') to parsed rule.
+  """
+  folders = feed_folders()
+  rules = {}
+  for pair in os.getenv('retention', '').split(','):
+    if '=' not in pair:
+      continue
+    feed, rule = pair.rsplit('=', 1)
+    feed = feed.strip()
+    try:
+      rules[folders.get(feed, feed)] = parse_rule(rule)
+    except ValueError as e:
+      logger.error('Invalid retention for %s: %s', feed, e)
+  return rules
+
+
+def _library(folder:str) -> dict[str, list[dict]]:
+  # audio files per podcast folder, newest episode first
+  library = {}
+  for name in os.listdir(folder):
+    path = os.path.join(folder, name)
+    if name.startswith('.') or not os.path.isdir(path):
+      continue
+    files = []
+    with os.scandir(path) as entries:
+      for entry in entries:
+        if not entry.is_file() or not is_audio_file(entry.name):
+          continue
+        stat = entry.stat()
+        files.append({
+          'path': entry.path,
+          'size': stat.st_size,
+          'inode': (stat.st_dev, stat.st_ino),
+          'links': stat.st_nlink,
+          'downloaded': stat.st_mtime,
+          'used': max(stat.st_atime, stat.st_mtime)
+        })
+    _date(name, path, files)
+    library[name] = sorted(files, key=lambda file: (-file['published'], -file['downloaded']))
+  return library
+
+
+def _date(name:str, path:str, files:list[dict]) -> None:
+  # a backfilled or re-downloaded old episode has a new mtime, so files are ranked by the
+  # episode's pubDate: recorded at download, or from the catalog for older downloads
+  manifest = load_manifest(path)
+  dates = None
+  for file in files:
+    published = (manifest.get(os.path.basename(file['path'])) or {}).get('published')
+    if published is None:
+      if dates is None:
+        dates = catalog.published_dates(name)
+      published = dates.get(os.path.basename(file['path']))
+    file['published'] = published if published is not None else file['downloaded']
+
+
+def _plan(folder:str, rules:dict, quota:int, min_free:int, needed:int, now:float,
+          writable:set[str] = None) -> tuple[list[dict], int, bool]:
+  now = now or time.time()
+  library = _library(folder)
+  evict = []
+  kept = []
+  # a hard linked duplicate frees nothing until its last link goes
+  links = {}
+
+  def evicted(file:dict, reason:str) -> dict:
+    links[file['inode']] = links.get(file['inode'], file['links']) - 1
+    return dict(file, reason=reason, frees=file['size'] if links[file['inode']] <= 0 else 0)
+
+  for name, files in library.items():
+    if writable is not None and name not in writable:
+      # counted towards the size, but another node's to delete
+      continue
+    rule = rules.get(name) or rules.get('*')
+    total = 0
+    for ndx, file in enumerate(files):
+      reason = None
+      total += file['size']
+      if ndx > 0 and rule:
+        if rule['last'] is not None and ndx >= rule['last']:
+          reason = f'keep last {rule["last"]}'
+        elif rule['days'] is not None and now - file['published'] > rule['days'] * 86400:
+          reason = f'older than {rule["days"]:g} days'
+        elif rule['max_bytes'] is not None and total > rule['max_bytes']:
+          reason = f'over {bytes_to_readable_size(rule["max_bytes"])}'
+      if reason:
+        evict.append(evicted(file, reason))
+      elif ndx > 0:
+        kept.append(file)
+
+  inodes = {}
+  for files in library.values():
+    for file in files:
+      inodes[file['inode']] = file['size']
+  size = sum(inodes.values()) - sum(file['frees'] for file in evict)
+  free = shutil.disk_usage(folder).free + sum(file['frees'] for file in evict)
+
+  def fits() -> bool:
+    return (quota is None or size + needed <= quota) and (min_free is None or free - needed >= min_free)
+
+  for file in sorted(kept, key=lambda file: file['used']):
+    if fits():
+      break
+    over_quota = quota is not None and size + needed > quota
+    evict.append(evicted(file, 'over disk quota' if over_quota else 'low free space'))
+    size -= evict[-1]['frees']
+    free += evict[-1]['frees']
+
+  return evict, size, fits()
+
+
+def plan(folder:str, rules:dict = None, quota:int = None, min_free:int = None, needed:int = 0, now:float = None) -> list[dict]:
+  """
+  Works out which files to delete. The newest episode of every podcast (by pubDate, falling
+  back to the file's modification time) is always kept, so a regular run doesn't download it again.
+
+  Per-feed rules are applied first. Then, while the library is over the quota or the disk would have less than
+  min_free bytes free after writing 'needed' bytes, the least recently used files are evicted.
+
+  Args:
+    folder (str): The podcast folder.
+    rules (dict): Folder name (or '*') to rule, see retention_rules().
+    quota (int): Maximum library size in bytes (optional).
+    min_free (int): Bytes to keep free on the library's disk (optional).
+    needed (int): Bytes about to be written, e.g. the next download.
+    now (float): The current time (for tests and dry runs).
+
+  Returns:
+    list[dict]: Files to delete, with 'path', 'size', 'frees' and 'reason'.
+  """
+  return _plan(folder, rules or {}, quota, min_free, needed, now)[0]
+
+
+def apply(evictions:list[dict], dry_run:bool = False) -> int:
+  """
+  Deletes the planned files in one batch.
+
+  Args:
+    evictions (list[dict]): The result of plan().
+    dry_run (bool): Only log what would be deleted.
+
+  Returns:
+    int: Bytes freed.
+  """
+  freed = 0
+  for file in evictions:
+    if dry_run:
+      logger.info('Would delete %s (%s)', file['path'], file['reason'])
+      continue
+    try:
+      os.remove(file['path'])
+      forget(file['path'])
+      journal.record(journal.DELETED, file['path'])
+      catalog.set_file_status(os.path.basename(os.path.dirname(file['path'])), os.path.basename(file['path']), catalog.NOT_DOWNLOADED)
+      freed += file['frees']
+      logger.debug('Deleted %s (%s)', file['path'], file['reason'])
+    except OSError as e:
+      logger.error('Failed deleting %s: %s', file['path'], e)
+  if evictions and not dry_run:
+    logger.info('Retention: deleted %s files, %s freed', len(evictions), bytes_to_readable_size(freed))
+  return freed
+
+
+def _limits() -> tuple[int, int]:
+  quota = os.getenv('disk_quota')
+  min_free = os.getenv('min_free_space')
+  return (parse_size(quota) if quota else None, parse_size(min_free) if min_free else None)
+
+
+def enforce(dry_run:bool = False) -> int:
+  """
+  Applies the retention rules, 'disk_quota' and 'min_free_space' from .env to the whole library.
+  Runs once after a run's downloads finish.
+
+  Returns:
+    int: Bytes freed.
+  """
+  folder = os.getenv('podcast_folder')
+  rules = retention_rules()
+  quota, min_free = _limits()
+  if not rules and quota is None and min_free is None:
+    return 0
+  global _usage
+  with _lock:
+    evictions, size, _ = _plan(folder, rules, quota, min_free, 0, None)
+    freed = apply(evictions, dry_run)
+    if not dry_run:
+      # downloads still running aren't on disk yet, their reservations stay counted
+      _usage = size + _pending
+    return freed
+
+
+def restrict(writable) -> None:
+  """
+  Limits make_room to evicting from some folders, e.g. the feeds a sharded node holds leases for.
+  The library-wide enforce() isn't limited, a sharded run only calls it on one node at a time.
+
+  Args:
+    writable (callable): Returns the set of folder names make_room may delete from, None lifts the limit.
+  """
+  global _writable
+  _writable = writable
+
+
+def make_room(length:int) -> bool:
+  """
+  Checks there is room for a download of the given size before it starts, evicting the least
+  recently used episodes when it would break 'disk_quota' or 'min_free_space'. Only folders
+  allowed by restrict() are evicted from.
+
+  The library is only scanned when the free space or the library size tracked since the
+  last scan says the download might not fit.
+
+  Args:
+    length (int): The enclosure length in bytes (None if unknown, then only the limits are checked).
+
+  Returns:
+    bool: False if the download can't fit even after evicting.
+  """
+  global _usage, _pending
+  folder = os.getenv('podcast_folder')
+  quota, min_free = _limits()
+  if quota is None and min_free is None:
+    return True
+  needed = length or 0
+  with _lock:
+    free_ok = min_free is None or shutil.disk_usage(folder).free - _pending - needed >= min_free
+    quota_ok = quota is None or (_usage is not None and _usage + needed <= quota)
+    if not (free_ok and quota_ok):
+      evictions, size, ok = _plan(folder, {}, quota, min_free, needed + _pending, None,
+                                  _writable() if _writable else None)
+      if not ok:
+        # evicting wouldn't make it fit, keep the library as it is
+        return False
+      apply(evictions)
+      # the scan doesn't see the downloads still running, their reservations stay counted
+      _usage = size + _pending
+    if _usage is not None:
+      _usage += needed
+    _pending += needed
+  return True
+
+
+def release(length:int) -> None:
+  """
+  Ends a make_room reservation once its download is on disk (or failed), so concurrent
+  downloads don't all count on the same free space.
+
+  Args:
+    length (int): The length passed to make_room.
+  """
+  global _pending
+  with _lock:
+    _pending = max(0, _pending - (length or 0))
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import bisect
+import socket
+import hashlib
+import threading
+
+try:
+  from logs import Logs
+  from state import save_state, file_lock
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.state import save_state, file_lock
+
+logger = Logs().get_logger()
+
+# lease key of the library-wide retention pass, which only one node runs at a time
+RETENTION = 'retention'
+
+def shard_dir() -> str:
+  """
+  Returns the shared folder nodes coordinate through ('shard_dir', unset turns sharding off).
+  """
+  return os.getenv('shard_dir') or None
+
+
+def enabled() -> bool:
+  """
+  Checks if this process is one of several nodes sharing the subscriptions.
+  """
+  return shard_dir() is not None
+
+
+def node_id() -> str:
+  """
+  Returns this node's name ('shard_node', default the host name). It has to stay the same
+  between runs, the leases a node holds are matched by it.
+  """
+  return os.getenv('shard_node') or socket.gethostname()
+
+
+def lease_seconds() -> float:
+  """
+  Returns how long a node's membership and feed leases last without renewal ('shard_lease',
+  default 3600). Set it longer than the time between cron runs, or nodes drop out in between.
+  """
+  return float(os.getenv('shard_lease', 3600))
+
+
+def _hash(key:str) -> int:
+  return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8], 'big')
+
+
+def _read(path:str) -> dict:
+  try:
+    with open(path, 'r') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+
+class HashRing:
+  """
+  A consistent hash ring. Each node is placed on the ring 'shard_vnodes' times (default 160)
+  and a key belongs to the first node after the key's hash, so adding or removing a node
+  only moves the keys next to its points.
+  """
+  def __init__(self, nodes:list[str], vnodes:int = None) -> None:
+    vnodes = vnodes or int(os.getenv('shard_vnodes', 160))
+    self.nodes = sorted(set(nodes))
+    self.__points = sorted((_hash(f'{node}#{ndx}'), node) for node in self.nodes for ndx in range(vnodes))
+    self.__hashes = [point for point, _ in self.__points]
+
+  def owner(self, key:str) -> str:
+    """
+    Returns the node a key belongs to, or None if the ring is empty.
+    """
+    if not self.__points:
+      return None
+    ndx = bisect.bisect(self.__hashes, _hash(key)) % len(self.__points)
+    return self.__points[ndx][1]
+
+
+class ShardNode:
+  """
+  This process as one node of a sharded deployment.
+
+  Nodes share 'podcast_folder' and a 'shard_dir' folder. Each node announces itself with a
+  membership file in '<shard_dir>/nodes' and places the feeds on a consistent hash ring of
+  the live members. A node only refreshes (and writes the folder of) a feed it holds a lease
+  for in '<shard_dir>/leases', and only takes a lease for a feed the ring gives it. Memberships
+  and leases expire after 'shard_lease' seconds without renewal, so when a node stops, the
+  others drop it from the ring and take over its feeds once its leases run out. A node that
+  finds a feed now belongs to another (one joined) releases the lease for it to pick up.
+  """
+  def __init__(self, folder:str = None, node:str = None, lease:float = None) -> None:
+    self.folder = folder or shard_dir()
+    self.node = node or node_id()
+    self.lease = lease or lease_seconds()
+    self.__held: dict[str, float] = {}
+    # keys the ring gives this node that another node still held at the last claim()
+    self.waiting: list[str] = []
+    self.__lock = threading.Lock()
+    self.__stop = threading.Event()
+    self.__renewer = None
+    os.makedirs(os.path.join(self.folder, 'nodes'), exist_ok=True)
+    os.makedirs(os.path.join(self.folder, 'leases'), exist_ok=True)
+
+  def __node_path(self, node:str) -> str:
+    return os.path.join(self.folder, 'nodes', f'{node}.json')
+
+  def __lease_path(self, key:str) -> str:
+    return os.path.join(self.folder, 'leases', f'{hashlib.sha1(key.encode("utf-8")).hexdigest()}.json')
+
+  def __locked(self, path:str):
+    # a lease is only ever changed by one node at a time. The lock dies with the node holding it,
+    # so there is no stale lock for another node to judge and remove
+    return file_lock(path, remove=True)
+
+  def heartbeat(self) -> None:
+    """
+    Announces (or renews) this node's membership.
+    """
+    save_state(self.__node_path(self.node), {
+      'node': self.node,
+      'host': socket.gethostname(),
+      'pid': os.getpid(),
+      'expires': time.time() + self.lease
+    })
+
+  def members(self) -> list[str]:
+    """
+    Returns the nodes with an unexpired membership, this one included once it has joined.
+    """
+    now = time.time()
+    nodes = []
+    for name in os.listdir(os.path.join(self.folder, 'nodes')):
+      if not name.endswith('.json'):
+        continue
+      data = _read(os.path.join(self.folder, 'nodes', name))
+      if data and data.get('expires', 0) > now:
+        nodes.append(data['node'])
+    return sorted(nodes)
+
+  def ring(self) -> HashRing:
+    return HashRing(self.members())
+
+  def lease_holder(self, key:str) -> dict:
+    """
+    Returns the unexpired lease on a key ({'key', 'node', 'expires'}), or None.
+    """
+    data = _read(self.__lease_path(key))
+    return data if data and data.get('expires', 0) > time.time() else None
+
+  def __acquire(self, key:str) -> bool:
+    path = self.__lease_path(key)
+    with self.__locked(path):
+      current = self.lease_holder(key)
+      if current and current['node'] != self.node:
+        return False
+      expires = time.time() + self.lease
+      save_state(path, {'key': key, 'node': self.node, 'expires': expires})
+    with self.__lock:
+      self.__held[key] = expires
+    return True
+
+  def release(self, key:str) -> None:
+    """
+    Gives up the lease on a key, if this node holds it.
+    """
+    path = self.__lease_path(key)
+    with self.__locked(path):
+      current = _read(path)
+      if current and current.get('node') == self.node:
+        os.remove(path)
+    with self.__lock:
+      self.__held.pop(key, None)
+
+  def claim(self, keys:list[str]) -> list[str]:
+    """
+    Takes the leases on the keys the ring gives this node and releases the ones it
+    gives to another node.
+
+    Args:
+      keys (list[str]): Feed URLs (or other lease keys such as RETENTION).
+
+    Returns:
+      list[str]: The keys this node holds a lease for, in the given order.
+    """
+    ring = self.ring()
+    owned = []
+    waiting = []
+    for key in keys:
+      try:
+        if ring.owner(key) != self.node:
+          if self.holds(key) or (self.lease_holder(key) or {}).get('node') == self.node:
+            logger.info('Handing %s over to %s', key, ring.owner(key))
+            self.release(key)
+          continue
+        if self.__acquire(key):
+          owned.append(key)
+        else:
+          # the previous owner still has it, it lets go on its next run or when its lease runs out
+          waiting.append(key)
+      except OSError as e:
+        logger.error('Failed claiming %s: %s', key, e)
+    self.waiting = waiting
+    logger.info('Node %s of %s holds %s of %s leases (%s waiting for a handover)',
+                self.node, len(ring.nodes), len(owned), len(keys), len(waiting))
+    return owned
+
+  def holds(self, key:str) -> bool:
+    """
+    Checks if this node still holds the lease on a key, with a margin for slow writes.
+    """
+    with self.__lock:
+      expires = self.__held.get(key)
+    return expires is not None and expires - time.time() > min(60, self.lease / 10)
+
+  def renew(self) -> None:
+    """
+    Renews the membership and every lease this node still holds. A lease another node
+    took (after this one failed to renew it in time) is dropped.
+    """
+    self.heartbeat()
+    with self.__lock:
+      keys = list(self.__held)
+    for key in keys:
+      path = self.__lease_path(key)
+      try:
+        with self.__locked(path):
+          current = _read(path)
+          if not current or current.get('node') != self.node:
+            logger.warning('Lost the lease on %s', key)
+            with self.__lock:
+              self.__held.pop(key, None)
+            continue
+          expires = time.time() + self.lease
+          save_state(path, dict(current, expires=expires))
+        with self.__lock:
+          self.__held[key] = expires
+      except OSError as e:
+        logger.error('Failed renewing the lease on %s: %s', key, e)
+
+  def join(self) -> 'ShardNode':
+    """
+    Announces this node and renews its membership and leases every third of 'shard_lease'
+    seconds until leave() is called.
+    """
+    self.heartbeat()
+    self.__stop.clear()
+
+    def renew_loop() -> None:
+      while not self.__stop.wait(self.lease / 3):
+        try:
+          self.renew()
+        except Exception as e:
+          logger.error('Failed renewing shard leases: %s', e)
+
+    self.__renewer = threading.Thread(target=renew_loop, name='shard-renewer', daemon=True)
+    self.__renewer.start()
+    return self
+
+  def leave(self, drain:bool = False) -> None:
+    """
+    Stops renewing. The membership and leases stay until they expire, so the next run of this
+    node picks its feeds up again without a rebalance. drain=True removes them instead, handing
+    the feeds to the other nodes right away.
+    """
+    self.__stop.set()
+    if not drain:
+      return
+    leases = os.path.join(self.folder, 'leases')
+    for name in os.listdir(leases):
+      if name.endswith('.json'):
+        data = _read(os.path.join(leases, name))
+        if data and data.get('node') == self.node:
+          self.release(data['key'])
+    try:
+      os.remove(self.__node_path(self.node))
+    except OSError:
+      pass
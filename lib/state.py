@@ -0,0 +1,131 @@
+import os
+import json
+from contextlib import contextmanager
+
+root_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def state_path(name:str) -> str:
+  """
+  Returns the path of a persisted state file.
+
+  State files live in the folder set by the 'state_folder' environment variable,
+  defaulting to '.state' in the project folder.
+
+  Args:
+    name (str): The file name of the state file.
+
+  Returns:
+    str: The full path to the state file.
+  """
+  folder = os.getenv('state_folder') or os.path.join(root_folder, '.state')
+  return os.path.join(folder, name)
+
+
+def shared_state_path(name:str) -> str:
+  """
+  Returns the path of a state file about the library itself (journal, dedup index, feed folders,
+  filtered episodes). With sharding on it lives in '<shard_dir>/state', so every node sharing the
+  library reads and writes the same file; otherwise it is a normal state file.
+
+  Args:
+    name (str): The file name of the state file.
+
+  Returns:
+    str: The full path to the state file.
+  """
+  shard_dir = os.getenv('shard_dir')
+  if shard_dir:
+    return os.path.join(shard_dir, 'state', name)
+  return state_path(name)
+
+
+def load_state(path:str, default=None):
+  """
+  Loads JSON state from the given path.
+
+  Args:
+    path (str): The path of the state file.
+    default: The value returned when the file is missing or unreadable.
+
+  Returns:
+    The decoded JSON data, or the default value.
+  """
+  try:
+    with open(path, 'r') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return default
+
+
+def save_state(path:str, data) -> None:
+  """
+  Atomically writes JSON state to the given path.
+
+  The data is written to a temporary file next to the target and renamed over it,
+  so an interrupted run never leaves a half written state file.
+
+  Args:
+    path (str): The path of the state file.
+    data: JSON serializable data.
+  """
+  folder = os.path.dirname(path)
+  if folder and not os.path.exists(folder):
+    os.makedirs(folder, exist_ok=True)
+  tmp_path = f'{path}.{os.getpid()}.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(data, f)
+  os.replace(tmp_path, path)
+
+
+@contextmanager
+def file_lock(path:str, blocking:bool = True, remove:bool = False):
+  """
+  Holds an exclusive lock on '<path>.lock' across processes (and threads) while the block runs.
+  Without fcntl (Windows) only the block itself runs, unlocked.
+
+  Args:
+    path (str): The file the lock guards. The lock file is created next to it.
+    blocking (bool): Wait for the lock, or give up at once if another process holds it.
+    remove (bool): Delete the lock file when the block ends, for locks on short-lived paths
+      (e.g. one per download) that would otherwise pile up.
+
+  Yields:
+    bool: True if the lock is held, False if it was busy and blocking is False.
+  """
+  try:
+    import fcntl
+  except ModuleNotFoundError:
+    yield True
+    return
+  folder = os.path.dirname(path)
+  if folder and not os.path.exists(folder):
+    os.makedirs(folder, exist_ok=True)
+  lock_path = f'{path}.lock'
+  while True:
+    f = open(lock_path, 'a')
+    try:
+      fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      f.close()
+      yield False
+      return
+    if not remove:
+      break
+    # the previous holder may have deleted the file after it was opened here, then the lock
+    # is on a file nobody else sees and the current one has to be locked instead
+    try:
+      if os.fstat(f.fileno()).st_ino == os.stat(lock_path).st_ino:
+        break
+    except FileNotFoundError:
+      pass
+    f.close()
+  try:
+    yield True
+  finally:
+    if remove:
+      try:
+        os.remove(lock_path)
+      except OSError:
+        pass
+    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    f.close()
@@ -0,0 +1,195 @@
+import os
+import re
+import sys
+import mimetypes
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+try:
+  from logs import Logs
+  from download import DownloadError
+  from partial_download import PartialDownload
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.download import DownloadError
+  from lib.partial_download import PartialDownload
+
+logger = Logs().get_logger()
+
+chunk_size = 65536
+
+def parse_range(header:str, size:int) -> tuple[int, int]:
+  """
+  Parses a single 'bytes=' Range header against a file size.
+
+  Returns:
+    tuple[int, int]: The first and last byte (inclusive), None for no (or an unsupported) range.
+
+  Raises:
+    ValueError: If the range is outside the file.
+  """
+  match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+  if not match or not (match.group(1) or match.group(2)) or size is None:
+    return None
+  if match.group(1):
+    start = int(match.group(1))
+    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+  else:
+    start = max(0, size - int(match.group(2)))
+    end = size - 1
+  if start > end:
+    raise ValueError(f'Range {header} is outside {size} bytes')
+  return start, end
+
+
+class _StreamHandler(BaseHTTPRequestHandler):
+  """
+  GET /episode?feed=<feed url>&url=<enclosure url>   the episode, with Range support
+  """
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args) -> None:
+    logger.debug('stream: %s', format % args)
+
+  def __reply(self, status:int, body:bytes = b'', extra:dict = None) -> None:
+    self.send_response(status)
+    self.send_header('Content-Type', 'text/plain')
+    self.send_header('Content-Length', str(len(body)))
+    for key, value in (extra or {}).items():
+      self.send_header(key, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_HEAD(self) -> None:
+    self.do_GET()
+
+  def do_GET(self) -> None:
+    url = urlparse(self.path)
+    query = {key: values[0] for key, values in parse_qs(url.query).items()}
+    if url.path != '/episode' or 'feed' not in query or 'url' not in query:
+      return self.__reply(404, b'not found')
+
+    try:
+      target = self.server.open_episode(query['feed'], query['url'])
+    except KeyError:
+      return self.__reply(404, b'no such episode')
+    except Exception as e:
+      logger.error('Failed opening %s for streaming: %s', query['url'], e)
+      return self.__reply(502, str(e).encode())
+
+    timeout = self.server.timeout_seconds
+    try:
+      if isinstance(target, PartialDownload):
+        size = target.wait_for_size(timeout)
+        read = target.read
+        name = target.path
+      else:
+        size = os.path.getsize(target)
+        read = lambda offset, length, timeout: _read_file(target, offset, length)
+        name = target
+    except (DownloadError, OSError) as e:
+      return self.__reply(502, str(e).encode())
+
+    try:
+      byte_range = parse_range(self.headers.get('Range'), size)
+    except ValueError:
+      return self.__reply(416, extra={'Content-Range': f'bytes */{size}'})
+
+    self.send_response(206 if byte_range else 200)
+    self.send_header('Content-Type', mimetypes.guess_type(name)[0] or 'application/octet-stream')
+    self.send_header('Accept-Ranges', 'bytes')
+    if byte_range:
+      start, end = byte_range
+      self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+    else:
+      start, end = 0, (size - 1 if size is not None else None)
+    if end is not None:
+      self.send_header('Content-Length', str(end - start + 1))
+    else:
+      # no size from the server yet, the end of the data is the end of the response
+      self.send_header('Connection', 'close')
+      self.close_connection = True
+    self.end_headers()
+    if self.command == 'HEAD':
+      return
+
+    position = start
+    try:
+      while end is None or position <= end:
+        length = chunk_size if end is None else min(chunk_size, end - position + 1)
+        data = read(position, length, timeout)
+        if not data:
+          break
+        self.wfile.write(data)
+        position += len(data)
+    except DownloadError as e:
+      logger.warning('Stopped streaming %s: %s', os.path.basename(name), e)
+      self.close_connection = True
+    except (ConnectionResetError, BrokenPipeError):
+      # players drop connections all the time when seeking
+      self.close_connection = True
+
+
+def _read_file(path:str, offset:int, length:int) -> bytes:
+  with open(path, 'rb') as f:
+    f.seek(offset)
+    return f.read(length)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+  daemon_threads = True
+
+  def handle_error(self, request, client_address) -> None:
+    if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+      super().handle_error(request, client_address)
+
+
+class StreamServer:
+  """
+  A local HTTP server that plays episodes while they download.
+
+  GET /episode?feed=<feed url>&url=<enclosure url> serves a downloaded episode from disk, or starts
+  downloading it and serves the bytes as they arrive. Range requests are answered from the
+  ranges on disk, waiting up to 'stream_timeout' seconds for bytes that haven't arrived, and
+  seeking far ahead moves the download there (see lib/partial_download.py).
+  """
+  def __init__(self, open_episode, host:str = None, port:int = None, timeout:float = None) -> None:
+    """
+    Args:
+      open_episode (callable): Called with the feed and enclosure URLs, returns the path of the
+        downloaded file or a PartialDownload. Raises KeyError for an unknown episode.
+      host (str): Interface to listen on (default 'stream_host' or 127.0.0.1).
+      port (int): Port to listen on (default 'stream_port' or 8765, 0 for any free port).
+      timeout (float): Seconds to wait for bytes that haven't arrived (default 'stream_timeout' or 30).
+    """
+    self.__open_episode = open_episode
+    self.__host = host or os.getenv('stream_host', '127.0.0.1')
+    self.__port = int(port if port is not None else os.getenv('stream_port', 8765))
+    self.__timeout = float(timeout or os.getenv('stream_timeout', 30))
+    self.__httpd = None
+
+  @property
+  def base(self) -> str:
+    host, port = self.__httpd.server_address[:2]
+    return f'http://{host}:{port}'
+
+  def url(self, feed:str, episode_url:str) -> str:
+    """
+    Returns the local URL that plays an episode.
+    """
+    from urllib.parse import urlencode
+    return f'{self.base}/episode?{urlencode({"feed": feed, "url": episode_url})}'
+
+  def start(self) -> 'StreamServer':
+    self.__httpd = _HTTPServer((self.__host, self.__port), _StreamHandler)
+    self.__httpd.open_episode = self.__open_episode
+    self.__httpd.timeout_seconds = self.__timeout
+    threading.Thread(target=self.__httpd.serve_forever, name='stream-server', daemon=True).start()
+    logger.info('Streaming episodes on %s', self.base)
+    return self
+
+  def stop(self) -> None:
+    if self.__httpd:
+      self.__httpd.shutdown()
+      self.__httpd.server_close()
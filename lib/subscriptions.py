@@ -1,4 +1,13 @@
 import os
+import threading
+from dotenv import set_key, dotenv_values
+
+try:
+  from state import root_folder, shared_state_path, load_state, save_state, file_lock
+except ModuleNotFoundError:
+  from lib.state import root_folder, shared_state_path, load_state, save_state, file_lock
+
+_lock = threading.Lock()
 
 def subscriptions():
   """
@@ -8,4 +17,59 @@ def subscriptions():
     List of podcast URLs (str).
   """
   sub_list: str = os.getenv('subscriptions', '')
-  return sub_list.split(',') if sub_list else []
\ No newline at end of file
+  return sub_list.split(',') if sub_list else []
+
+
+def save_subscriptions(urls:list[str]) -> None:
+  """
+  Writes the subscription list to the .env file in one rewrite, and updates the running process.
+
+  Args:
+    urls (list[str]): The podcast URLs.
+  """
+  value = ','.join(urls)
+  set_key(os.path.join(root_folder, '.env'), 'subscriptions', value)
+  os.environ['subscriptions'] = value
+
+
+def reload_subscriptions() -> list[str]:
+  """
+  Reads the subscription list from the .env file again, for long running processes.
+
+  Returns:
+    List of podcast URLs (str).
+  """
+  value = dotenv_values(os.path.join(root_folder, '.env')).get('subscriptions')
+  if value is not None:
+    os.environ['subscriptions'] = value
+  return subscriptions()
+
+
+def feed_folders() -> dict[str, str]:
+  """
+  Fetches the folder name each feed was last stored under.
+
+  Returns:
+    dict[str, str]: Feed URL to folder name (relative to podcast_folder).
+  """
+  return load_state(shared_state_path('feed_folders.json'), {})
+
+
+def remember_feed_folder(url:str, folder:str) -> None:
+  """
+  Records the folder name a feed's episodes are stored under, so the library
+  can be matched to subscriptions without fetching every feed.
+
+  Args:
+    url (str): The feed URL.
+    folder (str): The folder name (relative to podcast_folder).
+  """
+  with _lock, file_lock(shared_state_path('feed_folders.json')):
+    folders = feed_folders()
+    if folders.get(url) == folder:
+      return
+    folders[url] = folder
+    try:
+      save_state(shared_state_path('feed_folders.json'), folders)
+    except OSError:
+      pass
@@ -0,0 +1,45 @@
+import os
+import threading
+
+try:
+  from state import state_path, load_state, save_state, file_lock
+except ModuleNotFoundError:
+  from lib.state import state_path, load_state, save_state, file_lock
+
+_lock = threading.Lock()
+
+def estimated_rate() -> float:
+  """
+  Returns the measured download rate, averaged over recent downloads.
+
+  Falls back to the 'assumed_throughput' environment variable (bytes per second, default 1 MB/s)
+  when nothing has been measured yet.
+
+  Returns:
+    float: The estimated download rate in bytes per second.
+  """
+  data = load_state(state_path('throughput.json'), {})
+  return data.get('rate') or float(os.getenv('assumed_throughput', 1_048_576))
+
+
+def record_throughput(total_bytes:int, seconds:float) -> None:
+  """
+  Folds a finished download into the persisted rate estimate (exponential moving average).
+
+  Args:
+    total_bytes (int): The number of bytes downloaded.
+    seconds (float): The time the download took.
+  """
+  if total_bytes <= 0 or seconds <= 0:
+    return
+  rate = total_bytes / seconds
+  path = state_path('throughput.json')
+  # the cron run and the daemons share it
+  with _lock, file_lock(path):
+    data = load_state(path, {})
+    previous = data.get('rate')
+    data['rate'] = rate if not previous else previous * 0.7 + rate * 0.3
+    try:
+      save_state(path, data)
+    except OSError:
+      pass
@@ -1,6 +1,5 @@
 import re
 import os
-import datetime
 import tempfile
 import music_tag as id3
 
@@ -8,10 +7,14 @@ try:
   from logs import Logs
   from Coverart import Coverart
   from format_filename import format_filename
+  from metrics import metrics
+  from episode import Episode
 except ModuleNotFoundError:
   from lib.logs import Logs
   from lib.Coverart import Coverart
   from lib.format_filename import format_filename
+  from lib.metrics import metrics
+  from lib.episode import Episode
 
 logger = Logs().get_logger()
 
@@ -31,10 +34,10 @@ def save_image_to_tempfile(img:bytes) -> str:
     tmp_file_path = tmp_file.name
     return tmp_file_path
   except IOError as e:
-    logger.error(f"Error creating temp file: {str(e)}")
+    logger.error('Error creating temp file: %s', e)
     raise
   except Exception as e:
-    logger.error(f"Error saving image to tempfile: {str(e)}")
+    logger.error('Error saving image to tempfile: %s', e)
     raise
 
 # write an Image to audiofile ID3 info
@@ -54,7 +57,7 @@ def id3Image(file: dict, art: bytes) -> None:
     file['artwork'] = art
     logger.debug('Image set directly.')
   except Exception as e:
-    logger.warning(f"Failed to set artwork directly: {e}")
+    logger.warning('Failed to set artwork directly: %s', e)
     try:
       tmp_file_path = save_image_to_tempfile(art)
       if tmp_file_path:
@@ -63,15 +66,15 @@ def id3Image(file: dict, art: bytes) -> None:
           img = Coverart(location=tmp_file_path)
           file['artwork'] = img.bytes()
         except Exception as e:
-          logger.error(f"Failed to load image from temporary file: {e}")
+          logger.error('Failed to load image from temporary file: %s', e)
           raise
       else:
         raise Exception("Failed to create temporary image file.")
     except (IOError, OSError) as e:
-      logger.error(f"File error during temporary image file creation: {e}")
+      logger.error('File error during temporary image file creation: %s', e)
       raise
     except Exception as e:
-      logger.error(f"Unexpected error during temp file workaround: {e}")
+      logger.error('Unexpected error during temp file workaround: %s', e)
       raise
 
   finally:
@@ -79,15 +82,16 @@ def id3Image(file: dict, art: bytes) -> None:
       try:
         if os.path.exists(tmp_file_path):
           os.remove(tmp_file_path)
-          logger.debug(f"Successfully cleaned up temporary image file at {tmp_file_path}")
+          logger.debug('Successfully cleaned up temporary image file at %s', tmp_file_path)
       except OSError as e:
-        logger.error(f"Error cleaning up temporary image file at {tmp_file_path}: {e}")
+        logger.error('Error cleaning up temporary image file at %s: %s', tmp_file_path, e)
 
 
-def update_ID3(podcast_title:str, episode:dict, path:str, epNum, use_fallback_image) -> None:
+def update_ID3(podcast_title:str, episode:Episode, path:str, epNum, use_fallback_image) -> None:
   try:
     logger.debug('Updating ID3 tags')
-    file = id3.load_file(path)
+    with metrics.timer('tag_load'):
+      file = id3.load_file(path)
 
   except FileNotFoundError:
     raise Exception(f'Error: file {path} not found')
@@ -99,83 +103,75 @@ def update_ID3(podcast_title:str, episode:dict, path:str, epNum, use_fallback_im
     raise Exception(f"Error loading ID3 file: {str(e)}")
     
 
-  file['title'] = format_filename(episode['title'])
-  logger.debug(f'Episode title: {file["title"]}')
+  file['title'] = format_filename(episode.title)
+  logger.debug('Episode title: %s', file['title'])
 
   file['artist'] = podcast_title
-  logger.debug(f'Artist: {file["artist"]}')
+  logger.debug('Artist: %s', file['artist'])
 
   file['album'] = podcast_title
-  logger.debug(f'Podcast title: {file["album"]}')
+  logger.debug('Podcast title: %s', file['album'])
 
   file['genre'] = 'Podcast'
   file['album artist'] = 'Various Artist'
 
 
-  # Set comment tag if 'itunes:subtitle' key exists
-  try:
-    file['comment'] = episode['itunes:subtitle']
-  except KeyError:
-    pass
+  # Set comment tag if the episode has an 'itunes:subtitle'
+  if episode.subtitle:
+    file['comment'] = episode.subtitle
 
 
   # Set year tag
-  pub_date = None
-  try:
-    pub_date = datetime.datetime.strptime(episode['pubDate'], '%a, %d %b %Y %H:%M:%S %z')
-  except (ValueError, TypeError) as E:
-    try:
-      pub_date = datetime.datetime.strptime(episode['pubDate'], '%a, %d %b %Y %H:%M:%S %Z')
-    except (ValueError, TypeError) as e:
-      logger.error(f"Error setting year tag: {str(E)}, {str(e)}")
+  pub_date = episode.published
 
   if pub_date:
     try:
       file['year'] = pub_date.year
-      logger.debug(f'year: {file["year"]}')
+      logger.debug('year: %s', file['year'])
     except Exception as e:
-      logger.error(f'Failed setting year: {e}')
+      logger.error('Failed setting year: %s', e)
   else:
     logger.debug('Year: not set')
 
   # Set track number
   try:
     # return list of numbers in episode title (looking for "actual" episode number)
-    numbers_in_string:list[int] = [int(s) for s in re.findall(r'\b\d+\b', episode['title'])]
+    numbers_in_string:list[int] = [int(s) for s in re.findall(r'\b\d+\b', episode.title)]
 
-    # logger.debug(f'{len(numbers_in_string)} numbers in title')
+    # logger.debug('%s numbers in title', len(numbers_in_string))
     if podcast_title in get_ep_number_from_title():
       for num in numbers_in_string:
         if number_is_not_year(num):
-          logger.debug(f'Episode number: {num}')
+          logger.debug('Episode number: %s', num)
           file['tracknumber'] = num
 
     if not file['tracknumber']:
       try:
-        if 'itunes:episode' in episode:
-          logger.debug(f'Episode number: {episode["itunes:episode"]}')
-          file['tracknumber'] = episode['itunes:episode']
+        if episode.number is not None:
+          logger.debug('Episode number: %s', episode.number)
+          file['tracknumber'] = episode.number
         else:
-          logger.debug(f'Episode number: {epNum}')
+          logger.debug('Episode number: %s', epNum)
           file['tracknumber'] = epNum
       except Exception as e:
         raise Exception(e)
   except Exception as e:
-    logger.error(f"Error setting track number: {str(e)}")
+    logger.error('Error setting track number: %s', e)
 
 
   # Set ID3 artwork
   try:
-    if 'itunes:image' in episode:
-      # If the episode metadata contains an 'itunes:image' key
-      try:
-        img = Coverart(url=episode['itunes:image']['@href'])
-        id3Image(file, img.bytes())
-      except Exception as e:
-        logger.error(f'Error setting itunes:image artwork: {e}')
+    with metrics.timer('tag_artwork'):
+      if episode.image:
+        # If the episode metadata contains an 'itunes:image'
+        try:
+          img = Coverart(url=episode.image)
+          id3Image(file, img.bytes())
+        except Exception as e:
+          logger.error('Error setting itunes:image artwork: %s', e)
+          use_fallback_image(file)
+      else:
         use_fallback_image(file)
-    else:
-      use_fallback_image(file)
         
   except Exception as e:
     # Handle any exceptions that occur during setting ID3 artwork
@@ -183,6 +179,7 @@ def update_ID3(podcast_title:str, episode:dict, path:str, epNum, use_fallback_im
 
   # Save the modified ID3 tags
   try:
-    file.save()
+    with metrics.timer('tag_save'):
+      file.save()
   except Exception as e:
     raise Exception(f"Error saving ID3 tags: {str(e)}")
@@ -1,6 +1,6 @@
 # write new podcast episodes to the given directory / player address
 import os
-import tqdm
+import sys
 import time
 import glob
 import shutil
@@ -13,6 +13,11 @@ try:
   from copy_file import copy_file
   from question import question
   from escape_folder import escape_folder
+  from metrics import metrics
+  from profiling import profiled, sampled
+  from progress import progress_bar
+  from state import load_state, save_state
+  import journal
 except ModuleNotFoundError:
   from lib.logs import Logs
   from lib.old_date import old_date
@@ -20,6 +25,11 @@ except ModuleNotFoundError:
   from lib.copy_file import copy_file
   from lib.question import question
   from lib.escape_folder import escape_folder
+  from lib.metrics import metrics
+  from lib.profiling import profiled, sampled
+  from lib.progress import progress_bar
+  from lib.state import load_state, save_state
+  from lib import journal
 
 logger = Logs().get_logger()
 
@@ -31,23 +41,45 @@ def playable_file_count(dir:str) -> int:
   return count
 
 
+# mp3 files in the given directory
+def list_of_files(path:str) -> list[str]:
+  return glob.glob(os.path.join(path, '*.mp3'))
+
+
+# files newer than the 'old_date' variable
+def new_files(files:list[str]) -> list[str]:
+  return [file for file in files if old_date < datetime.datetime.fromtimestamp(os.path.getmtime(file)).date()]
+
+
+# files older then the 'old_date' variable
+def old_files(files:list[str]) -> list[str]:
+  return [file for file in files if old_date > datetime.datetime.fromtimestamp(os.path.getmtime(file)).date()]
+
+
 # list of files newer than the 'old_date' variable
 def list_of_new_files(path:str) -> list[str]:
-  return [
-    file for file in glob.glob(os.path.join(path, '*.mp3'))
-    if old_date < datetime.datetime.fromtimestamp(os.path.getmtime(file)).date()
-  ]
+  return new_files(list_of_files(path))
 
 
 # lsit of files older then the 'old_date' variable
 def list_of_old_files(path:str) -> list[str]:
-  return [
-    file for file in glob.glob(os.path.join(path, '*.mp3'))
-    if old_date > datetime.datetime.fromtimestamp(os.path.getmtime(file)).date()
-  ]
+  return old_files(list_of_files(path))
+
+
+def updatePlayer(player:str, window, bypass=False, rescan=False) -> None:
+  """
+  Syncs the podcast folder to a player: episodes newer than old_date are copied, older ones removed.
 
+  The player keeps a cursor into the library journal (lib/journal.py), so a sync only applies the
+  changes made since the last one. Without a cursor, or when the player doesn't look the way
+  the cursor says, every folder is scanned instead.
 
-def updatePlayer(player:str, window, bypass=False) -> None:
+  Args:
+    player (str): The player's mount point.
+    window (object): UI window for progress updates (if applicable).
+    bypass (bool): Don't log the start or offer to eject the player.
+    rescan (bool): Scan every folder even if the journal could be used.
+  """
   start_time = time.time()
   
   folder = os.getenv('podcast_folder')
@@ -69,23 +101,58 @@ def updatePlayer(player:str, window, bypass=False) -> None:
     except OSError as e:
       raise OSError(f"Error creating folder {podcast_folder_on_player}: {str(e)}")
 
+  synced = False
+  if journal.enabled():
+    journal.expire(old_date)
+    journal_id, journal_end = journal.end()
+    if not rescan:
+      with metrics.timer('player_journal'):
+        synced = journal_sync(folder, podcast_folder_on_player, window)
+
+  if not synced:
+    full_sync(folder, podcast_folder_on_player, window)
+    if journal.enabled():
+      # changes made while scanning are applied again next time, which is harmless
+      save_cursor(podcast_folder_on_player, journal_id, journal_end, folder_counts(podcast_folder_on_player))
+
+  metrics.observe('player_sync', time.time() - start_time)
+  metrics.write('sync')
+
+  if bypass:
+    return 
+  
+  # logger.info(change_log.print(time.time() - start_time))
+  
+  if question(f'Would you like to eject {player} (yes/no) '):
+    logger.warning('Please wait for prompt before removing the drive')
+    os.system(f'diskutil eject {escape_folder(player)}')
+
+
+def full_sync(folder:str, podcast_folder_on_player:str, window) -> None:
+  """
+  Syncs by scanning every podcast folder in the library and on the player.
+  """
   dirs = [dir for dir in os.listdir(folder) if not dir.startswith('.')]
 
   length = len(dirs)
   last_ndx = 0
   # copy/remove files
-  for ndx, dir in enumerate(tqdm(dirs, desc='Updating Podcasts', unit='podcast')):
+  for ndx, dir in enumerate(progress_bar(dirs, desc='Updating Podcasts', unit='podcast')):
     src:str = os.path.join(folder, dir) # where all the files are located
     src_art:str = os.path.join(src, 'cover.jpg')
     dest:str = os.path.join(podcast_folder_on_player, dir) # where we will send the files
     dest_art:str = os.path.join(dest, 'cover.jpg')
-    files_to_add = list_of_new_files(src)
-    files_to_delete = list_of_old_files(dest)
+    with metrics.timer('player_scan'):
+      src_files = list_of_files(src)
+      dest_files = list_of_files(dest)
+    with metrics.timer('player_plan'):
+      files_to_add = new_files(src_files)
+      files_to_delete = old_files(dest_files)
     num_files:int = len(files_to_add)
     # create folder if there are files to write in it
     if not os.path.exists(dest) and num_files > 0:
       try:
-        logger(f'Creating folder {dest}')
+        logger.info('Creating folder %s', dest)
         os.makedirs(dest)
         # change_log.new_folder()
       except OSError as e:
@@ -107,7 +174,8 @@ def updatePlayer(player:str, window, bypass=False) -> None:
       path = os.path.join(dest_dir, filename)
       if not os.path.exists(path):
         try:
-          copy_file(file, dest_dir, path)
+          with metrics.timer('player_copy'):
+            copy_file(file, dest_dir, path)
           # change_log.file_wrote()
         except Exception as e:
           raise Exception(f"Error copying file {file}: {str(e)}")
@@ -118,8 +186,9 @@ def updatePlayer(player:str, window, bypass=False) -> None:
     # remove "old" files from player
     for file in files_to_delete:
       try:
-        logger(f'Remove: {file} -> Trash')
-        os.remove(file)
+        logger.info('Remove: %s -> Trash', file)
+        with metrics.timer('player_delete'):
+          os.remove(file)
         # change_log.file_deleted()
       except Exception as e:
         raise Exception(f"Error deleting file {file}: {str(e)}")
@@ -131,7 +200,7 @@ def updatePlayer(player:str, window, bypass=False) -> None:
         if os.path.exists(hidden_file):
           os.remove(hidden_file)
           # change_log.file_deleted()
-        logger(f'Removing empty folder {dest}')
+        logger.info('Removing empty folder %s', dest)
         shutil.rmtree(dest)
         # change_log.folder_deleted()
         # change_log.folder_contained(1) # cover.jpg
@@ -147,17 +216,164 @@ def updatePlayer(player:str, window, bypass=False) -> None:
     if not dir.startswith('.') and not dir in os.listdir(folder):
       # change_log.folder_contained(nonhidden_file_count(dest))
       try:
-        logger(f'deleting - {dest}')
+        logger.info('deleting - %s', dest)
         shutil.rmtree(dest)
         # change_log.folder_deleted()
       except Exception as e:
         raise Exception(f"Error deleting folder {dest}: {str(e)}")
 
-  if bypass:
-    return 
-  
-  # logger.info(change_log.print(time.time() - start_time))
-  
-  if question(f'Would you like to eject {player} (yes/no) '):
-    logger.warning('Please wait for prompt before removing the drive')
-    os.system(f'diskutil eject {escape_folder(player)}')
\ No newline at end of file
+
+def cursor_path(podcast_folder_on_player:str) -> str:
+  # kept on the player, so a different device mounted at the same place doesn't inherit it
+  return os.path.join(podcast_folder_on_player, '.podcast_journal.json')
+
+
+def save_cursor(podcast_folder_on_player:str, journal_id:str, offset:int, folders:dict[str, int]) -> None:
+  """
+  Records how far into the journal the player is synced and how many episodes each of its folders holds.
+  """
+  try:
+    save_state(cursor_path(podcast_folder_on_player), {
+      'journal': journal_id,
+      'offset': offset,
+      'library': os.path.abspath(os.getenv('podcast_folder')),
+      'folders': folders
+    })
+  except OSError as e:
+    logger.error('Failed saving the sync cursor: %s', e)
+
+
+def folder_counts(podcast_folder_on_player:str, dirs=None) -> dict[str, int]:
+  """
+  Counts the mp3 files per podcast folder on the player. It takes a directory listing per
+  folder but no stat call per file, and catches episodes removed from the player by hand.
+  """
+  if dirs is None:
+    dirs = [dir for dir in os.listdir(podcast_folder_on_player) if not dir.startswith('.')]
+  counts = {}
+  for dir in dirs:
+    dest = os.path.join(podcast_folder_on_player, dir)
+    if os.path.isdir(dest):
+      counts[dir] = len(list_of_files(dest))
+  return counts
+
+
+class JournalMismatch(Exception):
+  """The journal and the player (or the library) disagree, the player needs a full rescan."""
+  pass
+
+
+def journal_sync(folder:str, podcast_folder_on_player:str, window) -> bool:
+  """
+  Syncs by applying the journal entries added since the player's last sync.
+
+  Returns:
+    bool: False if the player has to be scanned instead (no cursor, a different journal,
+    or the player or library don't match what the journal says).
+  """
+  cursor = load_state(cursor_path(podcast_folder_on_player))
+  if not cursor:
+    logger.info('No sync cursor on the player, scanning all folders')
+    return False
+
+  try:
+    header, entries, end = journal.read(cursor['offset'])
+    if header['journal'] != cursor['journal'] or cursor['library'] != os.path.abspath(folder):
+      raise JournalMismatch('the journal was restarted since the last sync')
+    if cursor['offset'] > end:
+      raise JournalMismatch('the journal is shorter than the cursor')
+
+    with metrics.timer('player_plan'):
+      changes = {path: entry for path, entry in journal.latest(entries).items() if path.endswith('.mp3')}
+      touched = {os.path.dirname(path) for path in changes}
+
+    with metrics.timer('player_scan'):
+      on_player = {dir for dir in os.listdir(podcast_folder_on_player) if not dir.startswith('.')}
+      if on_player != set(cursor['folders']):
+        raise JournalMismatch('podcast folders on the player changed outside of syncing')
+      if folder_counts(podcast_folder_on_player, on_player) != cursor['folders']:
+        raise JournalMismatch('episodes on the player changed outside of syncing')
+
+    apply_changes(folder, podcast_folder_on_player, changes, window)
+
+  except JournalMismatch as e:
+    logger.warning('Player and journal disagree (%s), scanning all folders', e)
+    return False
+  except (KeyError, TypeError, ValueError) as e:
+    logger.warning('Invalid sync cursor or journal (%s), scanning all folders', e)
+    return False
+
+  folders = dict(cursor['folders'])
+  for dir in touched:
+    folders.pop(dir, None)
+  folders.update(folder_counts(podcast_folder_on_player, touched))
+  save_cursor(podcast_folder_on_player, header['journal'], end, folders)
+  logger.info('Synced %s changes from the journal', len(changes))
+  return True
+
+
+def apply_changes(folder:str, podcast_folder_on_player:str, changes:dict[str, dict], window) -> None:
+  """
+  Copies and removes the files journal entries name, then removes podcast folders left empty.
+
+  Raises:
+    JournalMismatch: If a file the journal says is in the library isn't (or has another size).
+  """
+  length = len(changes)
+  for ndx, (path, entry) in enumerate(progress_bar(list(changes.items()), desc='Updating Podcasts', unit='file')):
+    dir, filename = os.path.split(path)
+    src = os.path.join(folder, path)
+    dest_dir = os.path.join(podcast_folder_on_player, dir)
+    dest = os.path.join(dest_dir, filename)
+    changed = datetime.datetime.fromtimestamp(entry['mtime']).date() if entry['mtime'] else None
+
+    if entry['op'] in (journal.ADDED, journal.RETAGGED) and changed and old_date < changed:
+      try:
+        size = os.stat(src).st_size
+      except FileNotFoundError:
+        raise JournalMismatch(f'{src} is not in the library')
+      if size != entry['size']:
+        raise JournalMismatch(f'{src} changed outside of podcast.py')
+
+      if not os.path.exists(dest_dir):
+        logger.info('Creating folder %s', dest_dir)
+        os.makedirs(dest_dir)
+      src_art = os.path.join(folder, dir, 'cover.jpg')
+      dest_art = os.path.join(dest_dir, 'cover.jpg')
+      if not os.path.exists(dest_art) and os.path.exists(src_art):
+        copy_file(src_art, dest_dir, dest_art)
+
+      # retagged files are replaced, copy_file keeps an existing file
+      if entry['op'] == journal.RETAGGED and os.path.exists(dest):
+        os.remove(dest)
+      with metrics.timer('player_copy'):
+        copy_file(src, dest_dir, dest)
+
+    elif entry['op'] in (journal.DELETED, journal.EXPIRED) or (changed and old_date > changed):
+      if os.path.exists(dest):
+        logger.info('Remove: %s -> Trash', dest)
+        with metrics.timer('player_delete'):
+          os.remove(dest)
+
+    if window:
+      window.evaluate_js(f'document.querySelector("sync-ui").updateBar("#podcasts-bar", {ndx + 1}, {length});')
+
+  for dir in {os.path.dirname(path) for path in changes}:
+    dest = os.path.join(podcast_folder_on_player, dir)
+    if os.path.exists(dest) and playable_file_count(dest) == 0:
+      logger.info('Removing empty folder %s', dest)
+      shutil.rmtree(dest)
+
+
+# usage: python lib/update_player.py PLAYER [--profile] [--rescan]
+if __name__ == '__main__':
+  forced = '--profile' in sys.argv
+  rescan = '--rescan' in sys.argv
+  args = [arg for arg in sys.argv[1:] if arg not in ('--profile', '--rescan')]
+  if len(args) != 1:
+    print('usage: update_player.py PLAYER [--profile] [--rescan]')
+    sys.exit(1)
+
+  metrics.reset()
+  with profiled('sync', forced or sampled()):
+    updatePlayer(args[0], None, bypass=True, rescan=rescan)
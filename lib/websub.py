@@ -0,0 +1,89 @@
+import os
+import time
+import threading
+
+try:
+  from state import state_path, shared_state_path, load_state, save_state, file_lock
+except ModuleNotFoundError:
+  from lib.state import state_path, shared_state_path, load_state, save_state, file_lock
+
+_lock = threading.Lock()
+
+def find_hub(xml:dict) -> tuple[str, str]:
+  """
+  Finds the WebSub hub a feed advertises with <atom:link rel="hub">.
+
+  Args:
+    xml (dict): The parsed feed ({'rss': {'channel': {...}}}).
+
+  Returns:
+    tuple[str, str]: The hub URL and the topic (the rel="self" URL), or (None, None) without a hub.
+  """
+  channel = xml.get('rss', {}).get('channel', {})
+  links = []
+  # the atom prefix varies between feeds (atom:link, atom10:link)
+  for key, value in channel.items():
+    if key.endswith('link'):
+      links += value if isinstance(value, list) else [value]
+
+  hub = topic = None
+  for link in links:
+    if not isinstance(link, dict):
+      continue
+    rel = (link.get('@rel') or '').lower()
+    if rel == 'hub' and not hub:
+      hub = link.get('@href')
+    elif rel == 'self' and not topic:
+      topic = link.get('@href')
+  return (hub, topic) if hub and topic else (None, None)
+
+
+def feed_hubs() -> dict[str, dict]:
+  """
+  Fetches the hub each feed advertised when it was last loaded.
+
+  Returns:
+    dict[str, dict]: Feed URL to {'hub': ..., 'topic': ...}.
+  """
+  return load_state(shared_state_path('feed_hubs.json'), {})
+
+
+def remember_hub(url:str, hub:str, topic:str) -> None:
+  """
+  Records the hub a feed advertises (or that it has none), so the subscriber
+  daemon can find it without fetching the feed.
+
+  Args:
+    url (str): The feed URL.
+    hub (str): The hub URL, or None.
+    topic (str): The topic URL, or None.
+  """
+  with _lock, file_lock(shared_state_path('feed_hubs.json')):
+    hubs = feed_hubs()
+    record = {'hub': hub, 'topic': topic} if hub else None
+    if hubs.get(url) == record:
+      return
+    if record:
+      hubs[url] = record
+    else:
+      hubs.pop(url, None)
+    try:
+      save_state(shared_state_path('feed_hubs.json'), hubs)
+    except OSError:
+      pass
+
+
+def pushed_feeds() -> set[str]:
+  """
+  Returns the feeds a running subscriber daemon gets pushed updates for, so a polling
+  run can skip them. Empty if the daemon hasn't checked in recently.
+
+  Returns:
+    set[str]: Feed URLs with a verified, unexpired lease.
+  """
+  data = load_state(state_path('websub.json'), {})
+  now = time.time()
+  interval = float(os.getenv('websub_check_interval', 300))
+  if now - data.get('heartbeat', 0) > interval * 2:
+    return set()
+  return {url for url, sub in data.get('feeds', {}).items() if sub.get('verified') and sub.get('expires', 0) > now}
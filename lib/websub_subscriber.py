@@ -0,0 +1,337 @@
+import os
+import hmac
+import time
+import queue
+import hashlib
+import secrets
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+try:
+  from logs import Logs
+  from headers import headers
+  from state import state_path, load_state, save_state
+except ModuleNotFoundError:
+  from lib.logs import Logs
+  from lib.headers import headers
+  from lib.state import state_path, load_state, save_state
+
+logger = Logs().get_logger()
+
+signature_methods = {'sha1': hashlib.sha1, 'sha256': hashlib.sha256, 'sha384': hashlib.sha384, 'sha512': hashlib.sha512}
+
+def signature_valid(secret:str, header:str, body:bytes) -> bool:
+  """
+  Checks an X-Hub-Signature header ('method=hexdigest') against the body.
+
+  Args:
+    secret (str): The hub.secret sent when subscribing.
+    header (str): The X-Hub-Signature header, or None.
+    body (bytes): The notification body.
+
+  Returns:
+    bool: True if the signature matches.
+  """
+  method, _, digest = (header or '').partition('=')
+  if method not in signature_methods:
+    return False
+  expected = hmac.new(secret.encode(), body, signature_methods[method]).hexdigest()
+  return hmac.compare_digest(expected, digest.strip().lower())
+
+
+class _CallbackHandler(BaseHTTPRequestHandler):
+  """
+  GET  /<token>?hub.mode=...&hub.topic=...&hub.challenge=...   intent verification
+  POST /<token>                                                content distribution
+  """
+  def log_message(self, format, *args) -> None:
+    logger.debug('websub: %s', format % args)
+
+  def __reply(self, status:int, body:bytes = b'') -> None:
+    self.send_response(status)
+    self.send_header('Content-Type', 'text/plain')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def __token(self) -> str:
+    return urlparse(self.path).path.rstrip('/').rsplit('/', 1)[-1]
+
+  def do_GET(self) -> None:
+    query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+    challenge = self.server.subscriber.verify(self.__token(), query)
+    if challenge is None:
+      return self.__reply(404)
+    self.__reply(200, challenge.encode())
+
+  def do_POST(self) -> None:
+    body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+    known = self.server.subscriber.notify(self.__token(), self.headers.get('X-Hub-Signature'), body)
+    # a 2xx for a bad signature too, so the hub can't be used to probe the secret
+    self.__reply(202 if known else 410)
+
+
+class Subscriber:
+  """
+  Keeps WebSub subscriptions for feeds that advertise a hub and runs a callback
+  whenever a hub pushes a content notification.
+
+  Subscriptions are persisted in 'websub.json' in the state folder. The callback server
+  listens on 'websub_host':'websub_port' and must be reachable by hubs at 'websub_callback'.
+  """
+  def __init__(self, on_update, callback:str = None, host:str = None, port:int = None, lease:int = None) -> None:
+    """
+    Args:
+      on_update (callable): Called with the feed URL when a notification arrives.
+      callback (str): Public base URL of the callback server (default 'websub_callback').
+      host (str): Interface to listen on (default 'websub_host' or 0.0.0.0).
+      port (int): Port to listen on (default 'websub_port', or the callback URL's port).
+      lease (int): Lease to ask hubs for, in seconds (default 'websub_lease' or 5 days).
+    """
+    self.__callback = (callback or os.getenv('websub_callback') or '').rstrip('/')
+    if not self.__callback:
+      raise ValueError('websub_callback is not set')
+    self.__host = host or os.getenv('websub_host', '0.0.0.0')
+    if port is None:
+      port = os.getenv('websub_port') or urlparse(self.__callback).port or 8080
+    self.__port = int(port)
+    self.__lease = int(lease or os.getenv('websub_lease', 432000))
+    self.__on_update = on_update
+    self.__path = state_path('websub.json')
+    self.__lock = threading.Lock()
+    self.__feeds: dict[str, dict] = load_state(self.__path, {}).get('feeds', {})
+    self.__queue = queue.Queue()
+    self.__queued = set()
+    self.__httpd = None
+
+  def __save(self, alive:bool = True) -> None:
+    try:
+      save_state(self.__path, {'heartbeat': time.time() if alive else 0, 'feeds': self.__feeds})
+    except OSError as e:
+      logger.error('Failed saving WebSub state: %s', e)
+
+  def __by_token(self, token:str) -> tuple[str, dict]:
+    for url, sub in self.__feeds.items():
+      if sub['token'] == token:
+        return url, sub
+    return None, None
+
+  def start(self) -> 'Subscriber':
+    """
+    Starts the callback server and the thread that runs on_update.
+    """
+    self.__httpd = ThreadingHTTPServer((self.__host, self.__port), _CallbackHandler)
+    self.__httpd.daemon_threads = True
+    self.__httpd.subscriber = self
+    threading.Thread(target=self.__httpd.serve_forever, daemon=True).start()
+    threading.Thread(target=self.__worker, daemon=True).start()
+    logger.info('WebSub callback listening on %s:%s', self.__host, self.__httpd.server_address[1])
+    return self
+
+  def stop(self) -> None:
+    """
+    Stops the server. Leases are kept for the next start, polling runs check every feed again meanwhile.
+    """
+    if self.__httpd:
+      self.__httpd.shutdown()
+      self.__httpd.server_close()
+    self.__queue.put(None)
+    with self.__lock:
+      self.__save(alive=False)
+
+  @property
+  def port(self) -> int:
+    return self.__httpd.server_address[1] if self.__httpd else self.__port
+
+  @property
+  def feeds(self) -> dict[str, dict]:
+    with self.__lock:
+      return {url: dict(sub) for url, sub in self.__feeds.items()}
+
+  def __request(self, url:str, mode:str) -> bool:
+    import requests
+    with self.__lock:
+      sub = self.__feeds[url]
+      sub['pending'] = mode
+      sub['requested'] = time.time()
+      data = {
+        'hub.mode': mode,
+        'hub.topic': sub['topic'],
+        'hub.callback': f'{self.__callback}/{sub["token"]}'
+      }
+      if mode == 'subscribe':
+        data['hub.lease_seconds'] = str(self.__lease)
+        data['hub.secret'] = sub['secret']
+      self.__save()
+
+    try:
+      # the hub may verify before it answers, the pending record is saved first
+      res = requests.post(sub['hub'], data=data, headers=headers, timeout=30)
+      res.raise_for_status()
+      logger.info('WebSub %s requested for %s at %s', mode, url, sub['hub'])
+      return True
+    except requests.exceptions.RequestException as e:
+      logger.error('WebSub %s failed for %s: %s', mode, url, e)
+      return False
+
+  def subscribe(self, url:str, hub:str, topic:str) -> bool:
+    """
+    Asks a hub to push updates for a feed. The subscription is active once the hub verifies it.
+
+    Args:
+      url (str): The feed URL (as subscribed).
+      hub (str): The hub URL.
+      topic (str): The topic URL the feed advertises.
+
+    Returns:
+      bool: True if the hub accepted the request.
+    """
+    with self.__lock:
+      sub = self.__feeds.get(url)
+      if not sub or sub['hub'] != hub or sub['topic'] != topic:
+        # the callback token is random, anyone knowing the feed URL could otherwise forge callbacks
+        self.__feeds[url] = {
+          'hub': hub,
+          'topic': topic,
+          'token': secrets.token_hex(16),
+          'secret': secrets.token_hex(20),
+          'verified': False,
+          'expires': 0
+        }
+      elif sub['token'] == hashlib.sha1(url.encode()).hexdigest()[:16]:
+        # saved before tokens were random, moved to a new callback with this request
+        sub['token'] = secrets.token_hex(16)
+    return self.__request(url, 'subscribe')
+
+  def unsubscribe(self, url:str) -> bool:
+    """
+    Asks the hub to stop pushing updates for a feed.
+    """
+    if url not in self.__feeds:
+      return False
+    return self.__request(url, 'unsubscribe')
+
+  def verify(self, token:str, query:dict) -> str:
+    """
+    Answers a hub's intent verification.
+
+    Args:
+      token (str): The callback path token.
+      query (dict): The hub.* query parameters.
+
+    Returns:
+      str: The challenge to echo back, or None to refuse.
+    """
+    mode = query.get('hub.mode')
+    with self.__lock:
+      url, sub = self.__by_token(token)
+      if not sub or query.get('hub.topic') != sub['topic']:
+        return None
+
+      if mode == 'denied':
+        # only an answer to our own subscribe request, not a way for anyone to cancel it
+        if sub.get('pending') != 'subscribe':
+          return None
+        logger.warning('WebSub hub denied %s: %s', url, query.get('hub.reason'))
+        sub.update(verified=False, expires=0, pending=None, denied=time.time())
+        self.__save()
+        return ''
+
+      if mode != sub.get('pending') or 'hub.challenge' not in query:
+        return None
+
+      if mode == 'subscribe':
+        lease = int(query.get('hub.lease_seconds') or self.__lease)
+        sub.update(verified=True, expires=time.time() + lease, lease=lease, pending=None)
+        logger.info('WebSub subscription verified for %s, lease %ss', url, lease)
+      else:
+        del self.__feeds[url]
+        logger.info('WebSub unsubscribed from %s', url)
+      self.__save()
+      return query['hub.challenge']
+
+  def notify(self, token:str, signature:str, body:bytes) -> bool:
+    """
+    Handles a content notification, queueing the feed for on_update.
+
+    Returns:
+      bool: False if the token isn't a current subscription.
+    """
+    with self.__lock:
+      url, sub = self.__by_token(token)
+      if not sub:
+        return False
+      if not signature_valid(sub['secret'], signature, body):
+        logger.warning('WebSub notification for %s has a bad signature, ignored', url)
+        return True
+    logger.info('WebSub notification for %s', url)
+    self.enqueue(url)
+    return True
+
+  def enqueue(self, url:str) -> None:
+    """
+    Queues a feed for on_update, unless it's already waiting. Updates run one at a time on the
+    subscriber's thread, so anything else that downloads from these feeds (e.g. a catch-up
+    after start) goes through here instead of racing a pushed update of the same feed.
+
+    Args:
+      url (str): The feed URL.
+    """
+    with self.__lock:
+      if url in self.__queued:
+        return
+      self.__queued.add(url)
+    self.__queue.put(url)
+
+  def drain(self) -> None:
+    """
+    Waits until every queued update has run.
+    """
+    self.__queue.join()
+
+  def __worker(self) -> None:
+    # one feed at a time, repeated notifications for a queued feed are merged
+    while True:
+      url = self.__queue.get()
+      if url is None:
+        self.__queue.task_done()
+        return
+      with self.__lock:
+        self.__queued.discard(url)
+      try:
+        self.__on_update(url)
+      except Exception as e:
+        logger.error('WebSub update of %s failed: %s', url, e)
+      finally:
+        self.__queue.task_done()
+
+  def maintain(self, hubs:dict[str, dict]) -> None:
+    """
+    Brings subscriptions in line with the feeds' hubs: subscribes new hub-enabled feeds,
+    renews leases in their last tenth, retries unverified requests after an hour (denied ones
+    after a day), and unsubscribes feeds that were removed or dropped their hub.
+
+    Args:
+      hubs (dict[str, dict]): Subscribed feed URL to {'hub': ..., 'topic': ...}.
+    """
+    now = time.time()
+    for url, sub in self.feeds.items():
+      if url not in hubs:
+        if sub.get('pending') != 'unsubscribe' or now - sub.get('requested', 0) > 3600:
+          self.unsubscribe(url)
+
+    for url, record in hubs.items():
+      sub = self.feeds.get(url)
+      if sub and now - sub.get('denied', 0) < 86400:
+        continue
+      if not sub or sub['hub'] != record['hub'] or sub['topic'] != record['topic']:
+        self.subscribe(url, record['hub'], record['topic'])
+      elif sub.get('pending'):
+        if now - sub.get('requested', 0) > 3600:
+          self.subscribe(url, record['hub'], record['topic'])
+      elif sub['expires'] - now < sub.get('lease', self.__lease) / 10:
+        self.subscribe(url, record['hub'], record['topic'])
+
+    with self.__lock:
+      self.__save()
@@ -3,26 +3,39 @@
 import os
 import sys
 import shutil
+import threading
 import requests
-import xmltodict
-from dotenv import load_dotenv, set_key
 
-from lib.Coverart import Coverart
 from lib.question import question
 from lib.format_filename import format_filename
 from lib.headers import headers
-from lib.update_id3 import update_ID3, id3Image
 from lib.logs import Logs
-from lib.download import dl_with_progress_bar
+from lib.download import dl_with_progress_bar, DownloadError
 from lib.podcast_episode_exists import podcast_episode_exists
+from lib.episode import Episode
 from lib.is_live_url import is_live_url, is_connected, is_valid_url
 from lib.get_image_url import get_image_url
-from lib.subscriptions import subscriptions
+from lib.subscriptions import subscriptions, save_subscriptions, reload_subscriptions, remember_feed_folder, feed_folders
+from lib.opml import parse_feed_list, to_opml
+from lib import dedup
+from lib import resolve_url
+from lib import retention
+from lib import websub
+from lib import filters
+from lib import catalog
+from lib import journal
+from lib import parse_pool
+from lib import partial_download
+from lib import shard
+from lib.metrics import metrics
+from lib.profiling import profiled, sampled
+from lib.integrity import record_download, record_tagged, damaged_files, damaged, load_manifest
+from lib.circuit_breaker import breaker
+from lib.throughput import estimated_rate
+from lib.budget import Budget, parse_budget, order_pending, feed_priorities, load_carryover, load_quarantine, save_carryover, policies
 
 logger = Logs().get_logger()
 
-load_dotenv()
-
 file_path = os.path.abspath(__file__)
 script_folder = os.path.dirname(file_path)
 
@@ -32,16 +45,22 @@ class Podcast:
   downloading episodes, updating ID3 tags, fetching cover art, etc.
   """
 
-  def __init__(self, url: str) -> None:
+  def __init__(self, url: str, probe: bool = True) -> None:
     """
     Initialize a Podcast instance by validating the URL, checking connection,
     and parsing the XML feed to extract podcast metadata.
     
     Args:
       url (str): The URL to the podcast RSS feed.
+      probe (bool): Check the internet connection and the feed URL before fetching it.
+        Bulk operations check the connection once and skip this.
     """
-    if not is_connected():
-      raise Exception('Error connecting to the internet. Please check network connection and try again')
+    if probe:
+      with metrics.timer('connectivity'):
+        connected = is_connected()
+
+      if not connected:
+        raise Exception('Error connecting to the internet. Please check network connection and try again')
 
     self.__podcast_folder: str = os.getenv('podcast_folder')
 
@@ -53,24 +72,47 @@ class Podcast:
     if not is_valid_url(self.__xml_url):
       raise Exception(f'Invalid URL address: {self.__xml_url}')
 
-    if not is_live_url(self.__xml_url):
-      raise Exception(f'Error connecting to: {self.__xml_url}')
+    if probe:
+      with metrics.timer('feed_probe', feed=self.__xml_url):
+        live = is_live_url(self.__xml_url)
+
+      if not live:
+        raise Exception(f'Error connecting to: {self.__xml_url}')
 
     try:
-      logger.debug(f'Fetching data from: {self.__xml_url}')
-      res = requests.get(self.__xml_url, headers=headers)
-      res.raise_for_status()
-      xml = xmltodict.parse(res.content)
+      logger.debug('Fetching data from: %s', self.__xml_url)
+      with metrics.timer('feed_fetch', feed=self.__xml_url):
+        res = requests.get(self.__xml_url, headers=headers, timeout=30)
+        res.raise_for_status()
+      metrics.count('feed_bytes', len(res.content), feed=self.__xml_url)
+
+      rules = filters.load_filters()
+      with metrics.timer('xml_parse', feed=self.__xml_url):
+        xml, episodes = parse_pool.parse(res.content, descriptions=rules.needs_description)
 
       self.__title: str = xml['rss']['channel']['title']
-      self.__list: list[dict] = xml['rss']['channel']['item']
+      self.__list: list[Episode] = episodes
+      if not self.__list:
+        raise KeyError('item')
       self.__location: str = os.path.join(self.__podcast_folder, format_filename(self.__title))
+      remember_feed_folder(self.__xml_url, format_filename(self.__title))
+
+      # episode index -> name of the filter rule that excludes it
+      self.__filtered: dict[int, str] = {}
+      if rules:
+        for ndx, episode in enumerate(self.__list):
+          reason = rules.match(episode, self.__xml_url, format_filename(self.__title))
+          if reason:
+            self.__filtered[ndx] = reason
+      websub.remember_hub(self.__xml_url, *websub.find_hub(xml))
 
       self.__img_url: str = get_image_url(xml)
       if not self.__img_url:
         raise Exception(f'Failed to find an image url in xml data')
 
-      logger.info(f'{self.__title}: {str(self.episodeCount())} episodes')
+      catalog.update_feed(self.__xml_url, self.__title, self.__img_url, self.__list, self.__filtered)
+
+      logger.info('%s: %s episodes', self.__title, self.episodeCount())
 
     except requests.exceptions.RequestException as e:
       raise Exception(f'Error getting XML data from {self.__xml_url}: {e}')
@@ -90,11 +132,13 @@ class Podcast:
       file (str): Path to the downloaded podcast file.
     """
     logger.debug('Using fallback image')
+    from lib.Coverart import Coverart
+    from lib.update_id3 import id3Image
     if hasattr(self, '__img'):
       try:
         id3Image(file, self.__img.bytes())
       except Exception as e:
-        logger.error(f'Failed setting image from __img variable: {e}')
+        logger.error('Failed setting image from __img variable: %s', e)
         self.__img = None
         self.__fallback_image(file)
     else:
@@ -102,49 +146,254 @@ class Podcast:
         self.__img = Coverart(location=os.path.join(self.__location, 'cover.jpg'))
         id3Image(file, self.__img.bytes())
       except Exception as e:
-        logger.error(f'Failed to load art from file: {e}')
+        logger.error('Failed to load art from file: %s', e)
 
-  def __fileDL(self, episode, epNum, window) -> None:
+  def __missing(self, episode, manifest:dict = None) -> dict:
     """
-    Downloads a podcast episode and applies ID3 tags to the downloaded file.
-    
+    Checks if an episode still has to be downloaded.
+
     Args:
-      episode (dict): The metadata of the episode (from the XML).
-      epNum (int): The episode number.
-      window (object): UI window for progress updates (if applicable).
+      episode (Episode): The metadata of the episode (from the XML).
+      manifest (dict): The folder's integrity manifest (optional), see podcast_episode_exists.
+
+    Returns:
+      dict: The episode's podcast_episode_exists result, or None if it is already downloaded (or the check failed).
     """
     try:
-      stats = podcast_episode_exists(self.__title, episode)
+      stats = podcast_episode_exists(self.__title, episode, manifest)
     except Exception as e:
       logger.debug(episode)
-      logger.critical(f'Failed checking episode status: {e}')
-      return
+      logger.critical('Failed checking episode status: %s', e)
+      return None
 
     if stats['exists']:
-      logger.info(f'{stats["filename"]} already downloaded')
-      return
+      logger.info('%s already downloaded', stats['filename'])
+      return None
 
     if stats['path'].startswith('\\') or stats['path'].startswith('/'):
       stats['path'] = stats['path'][1:]
+    return stats
+
+  def __fileDL(self, episode, epNum, window) -> str:
+    """
+    Downloads a podcast episode and applies ID3 tags to the downloaded file.
+    
+    Args:
+      episode (Episode): The metadata of the episode (from the XML).
+      epNum (int): The episode number.
+      window (object): UI window for progress updates (if applicable).
+
+    Returns:
+      str: The path of the downloaded file, or None if nothing was downloaded.
+    """
+    stats = self.__missing(episode)
+    if not stats:
+      return None
+
+    with metrics.labels(feed=self.__xml_url, episode=stats['filename']):
+      return self.__store(episode, epNum, stats, window)
+
+  def __fileDLMany(self, episodes:list[tuple[Episode, int]], window) -> list[str]:
+    """
+    Downloads several episodes at once with the download engine ('download_concurrency' at a time,
+    'per_host_concurrency' per host) and tags each as soon as it is on disk.
+
+    Args:
+      episodes (list[tuple[Episode, int]]): The episodes and their episode numbers.
+      window (object): UI window for progress updates (if applicable).
+
+    Returns:
+      list[str]: The paths of the downloaded files.
+    """
+    from lib.download_engine import DownloadEngine
+    engine = DownloadEngine()
+    if engine.concurrency == 1 or len(episodes) < 2:
+      return [path for path in (self.__fileDL(episode, epNum, window) for episode, epNum in episodes) if path]
+
+    def job(episode, epNum:int, stats:dict) -> tuple:
+      def fetch() -> str:
+        with metrics.labels(feed=self.__xml_url, episode=stats['filename']):
+          return self.__fetch(episode, epNum, stats, window)
+
+      def finish(path:str) -> str:
+        with metrics.labels(feed=self.__xml_url, episode=stats['filename']):
+          return self.__tag(episode, epNum, path)
+
+      return stats['url'], fetch, finish
+
+    jobs = []
+    manifest = load_manifest(self.__location)
+    for episode, epNum in episodes:
+      stats = self.__missing(episode, manifest)
+      if stats:
+        jobs.append(job(episode, epNum, stats))
+    return [path for path in engine.run(jobs) if path]
 
+  def __store(self, episode, epNum, stats:dict, window) -> str:
+    """
+    Downloads (or links a duplicate of) an episode that isn't on disk yet and tags it.
+
+    Args:
+      episode (Episode): The metadata of the episode (from the XML).
+      epNum (int): The episode number.
+      stats (dict): The episode's podcast_episode_exists result.
+      window (object): UI window for progress updates (if applicable).
+
+    Returns:
+      str: The path of the downloaded file, or None if the download failed.
+    """
+    path = self.__fetch(episode, epNum, stats, window)
+    return self.__tag(episode, epNum, path) if path else None
+
+  def __fetch(self, episode, epNum, stats:dict, window) -> str:
+    """
+    Downloads (or links a duplicate of) an episode that isn't on disk yet, without tagging it.
+
+    Returns:
+      str: The path of the downloaded file, or None if the download failed.
+    """
     def prog_update(downloaded, total, start_time):
       if window:
         window.evaluate_js(f'document.querySelector("audiosync-podcasts").update("{self.__xml_url}", {downloaded}, {total}, {start_time}, "{stats["filename"]}")')
 
     path: str = os.path.join(self.__podcast_folder, stats['path'])
+    tags = dedup.tag_identity(self.__title, episode, epNum)
 
-    logger.info(f'Downloading - {stats["filename"]}')
+    with metrics.timer('dedup_check'):
+      info = self.__from_duplicate(stats['url'], path, tags) if dedup.enabled() else None
+
+    reserved = False
     try:
-      dl_with_progress_bar(stats['url'], path, progress_callback=prog_update)
+      if not info:
+        reserved = retention.make_room(episode.length)
+        if not reserved:
+          raise Exception(f'Not enough disk space for {stats["filename"]}')
+        logger.info('Downloading - %s', stats['filename'])
+        info = self.__download(stats['url'], path, prog_update)
+        if dedup.enabled():
+          info = self.__dedup_download(path, info, tags)
+      # retention ranks files by the episode's date, not by when they were downloaded
+      record_download(path, dict(info, published=episode.published.timestamp() if episode.published else None))
+      journal.record(journal.ADDED, path, info.get('sha256'))
+      catalog.set_status(self.__xml_url, episode.url, catalog.DOWNLOADED)
     except Exception as e:
-      logger.error(f'Failed to download file: {str(e)}')
-      return
+      logger.error('Failed to download file: %s', e)
+      return None
+    finally:
+      if reserved:
+        retention.release(episode.length)
 
+    return path
+
+  def __tag(self, episode, epNum, path:str) -> str:
+    """
+    Sets the ID3 tags of a downloaded episode. A failure is logged and the file kept untagged.
+
+    Returns:
+      str: The path of the file.
+    """
     try:
-      update_ID3(self.__title, episode, path, epNum, self.__fallback_image)
+      # music_tag and PIL are only imported once there is something to tag
+      from lib.update_id3 import update_ID3
+      with metrics.timer('tagging'):
+        update_ID3(self.__title, episode, path, epNum, self.__fallback_image)
+      record_tagged(path)
+      journal.record(journal.RETAGGED, path)
     except Exception as e:
-      logger.error(f'Failed setting ID3 info: {str(e)}')
-      return
+      logger.error('Failed setting ID3 info: %s', e)
+
+    return path
+
+  def __download(self, url:str, path:str, progress_callback) -> dict:
+    """
+    Downloads an enclosure from the end of its (cached) redirect chain,
+    falling back to the original URL if the resolved one fails.
+
+    Returns:
+      dict: The download info returned by dl_with_progress_bar.
+    """
+    partial = partial_download.active(path)
+    if partial:
+      # already being streamed, the download finishes there
+      return partial.result(progress_callback)
+
+    resolved = resolve_url.resolve(url)['url']
+    try:
+      return dl_with_progress_bar(resolved, path, progress_callback=progress_callback)
+    except DownloadError:
+      if resolved == url:
+        raise
+      logger.warning('Resolved URL failed, retrying %s', url)
+      resolve_url.invalidate(url)
+      return dl_with_progress_bar(url, path, progress_callback=progress_callback)
+
+  def __same_tags(self, entry:dict, tags:str) -> bool:
+    """
+    Checks if a file would get the same tags as an indexed duplicate, by the tag_identity of both.
+    """
+    return entry.get('tags') is not None and entry['tags'] == tags
+
+  def __from_duplicate(self, url:str, path:str, tags:str) -> dict:
+    """
+    Stores an episode by linking to an already downloaded copy, matched by the enclosure's
+    final URL or its content-length and ETag.
+
+    Args:
+      url (str): The enclosure URL.
+      path (str): Where the episode should be saved.
+      tags (str): The episode's dedup.tag_identity.
+
+    Returns:
+      dict: Download info for the integrity record, or None if there is no duplicate.
+    """
+    entry = dedup.find_before_download(url, path)
+    if not entry:
+      return None
+
+    try:
+      method = dedup.link_duplicate(entry['path'], path, self.__same_tags(entry, tags))
+    except OSError as e:
+      logger.error('Failed linking duplicate %s: %s', entry['path'], e)
+      return None
+
+    logger.info('%s already downloaded as %s, stored as %s', os.path.basename(path), entry['path'], method)
+    return {
+      'size': os.path.getsize(path),
+      'sha256': None,
+      'etag': entry.get('etag'),
+      'last_modified': entry.get('last_modified'),
+      'url': entry.get('url')
+    }
+
+  def __dedup_download(self, path:str, info:dict, tags:str) -> dict:
+    """
+    Replaces a fresh download with a link to an existing copy that has the same content hash,
+    or adds it to the dedup index if it is new.
+
+    Args:
+      path (str): The downloaded file.
+      info (dict): The download info returned by dl_with_progress_bar.
+      tags (str): The episode's dedup.tag_identity.
+
+    Returns:
+      dict: Download info for the integrity record.
+    """
+    entry = dedup.find_by_hash(info['sha256'], path)
+    if not entry:
+      dedup.register(path, self.__title, info, tags)
+      return info
+
+    try:
+      method = dedup.link_duplicate(entry['path'], path, self.__same_tags(entry, tags), allow_copy=False)
+    except OSError as e:
+      logger.error('Failed linking duplicate %s: %s', entry['path'], e)
+      return info
+
+    if not method:
+      return info
+
+    logger.info('%s is a duplicate of %s, stored as %s', os.path.basename(path), entry['path'], method)
+    return dict(info, size=os.path.getsize(path), sha256=None)
 
   def __mkdir(self) -> None:
     """
@@ -155,18 +404,66 @@ class Podcast:
       raise Exception(f'Error accessing location {self.__podcast_folder}, Check if drive is mounted')
 
     if not os.path.exists(self.__location):
-      logger.debug(f'Creating folder {self.__location}')
+      logger.debug('Creating folder %s', self.__location)
       try:
         os.makedirs(self.__location)
       except OSError as e:
         raise OSError(f"Error creating folder {self.__location}: {str(e)}")
 
+  def __newest(self, record:bool = True) -> int:
+    """
+    Returns the index of the newest episode the filter rules don't exclude (None if they exclude all),
+    recording the newest as skipped if it is excluded.
+    """
+    for ndx in range(self.episodeCount()):
+      if ndx not in self.__filtered:
+        return ndx
+      # without filters only the newest one would have been downloaded
+      if ndx == 0 and record:
+        self.__skip(ndx)
+    return None
+
+  def __skip(self, ndx:int) -> None:
+    """
+    Records a filtered episode as avoided, unless it is on disk already.
+    """
+    episode = self.__list[ndx]
+    try:
+      if podcast_episode_exists(self.__title, episode)['exists']:
+        return
+    except Exception:
+      return
+    filters.record_skip(self.__xml_url, episode, self.__filtered[ndx])
+
+  def __repair(self, window) -> None:
+    """
+    Downloads again any episode whose file failed the integrity check (truncated or corrupted).
+
+    Args:
+      window (object): UI window for progress updates (if applicable).
+    """
+    if not damaged_files(self.__location):
+      return
+
+    manifest = load_manifest(self.__location)
+    for ndx, episode in enumerate(self.__list):
+      if ndx in self.__filtered:
+        continue
+      try:
+        stats = podcast_episode_exists(self.__title, episode, manifest)
+      except Exception:
+        continue
+      if stats['integrity'] in damaged:
+        self.__fileDL(episode, self.episodeCount() - ndx, window)
+
   def __get_cover(self):
+    from lib.Coverart import Coverart
     cover_loc = os.path.join(self.__location, 'cover.jpg')
     if not os.path.exists(cover_loc):
       try: 
-        self.__img = Coverart(url=self.__img_url)
-        self.__img.save(self.__location)
+        with metrics.timer('cover', feed=self.__xml_url):
+          self.__img = Coverart(url=self.__img_url)
+          self.__img.save(self.__location)
       except Exception as e:
         raise Exception(e)
 
@@ -179,6 +476,68 @@ class Podcast:
     """
     return len(self.__list)
 
+  def podcastTitle(self) -> str:
+    """
+    Returns the podcast's title from the feed.
+    """
+    return self.__title
+
+  def pendingEpisodes(self, urls:list[str] = None, record_skips:bool = True) -> list[tuple[Episode, int]]:
+    """
+    Returns the episodes a regular run would download that are not on disk yet:
+    the newest episode, episodes whose file failed the integrity check,
+    plus any episodes with the given enclosure URLs. Episodes excluded by filter rules are left out.
+
+    Args:
+      urls (list[str]): Enclosure URLs of extra episodes to include (e.g. carried over from a budgeted run).
+      record_skips (bool): Count a filtered newest episode as avoided (off for dry runs).
+
+    Returns:
+      list[tuple[Episode, int]]: (episode, episode number) pairs.
+    """
+    urls = urls or []
+    has_damaged = len(damaged_files(self.__location)) > 0
+    newest = self.__newest(record_skips)
+    manifest = load_manifest(self.__location)
+    pending = []
+    for ndx, episode in enumerate(self.__list):
+      if ndx in self.__filtered:
+        continue
+      wanted = ndx == newest or episode.url in urls
+      if not wanted and not has_damaged:
+        continue
+      try:
+        stats = podcast_episode_exists(self.__title, episode, manifest)
+      except Exception as e:
+        logger.error('Failed checking episode status: %s', e)
+        continue
+      if stats['exists'] or not (wanted or stats['integrity'] in damaged):
+        continue
+      pending.append((episode, self.episodeCount() - ndx))
+    return pending
+
+  def missingEpisodes(self) -> list[tuple[Episode, int]]:
+    """
+    Returns the episodes downloadAll would download: every episode not on disk (or damaged)
+    that the filter rules don't exclude.
+
+    Returns:
+      list[tuple[Episode, int]]: (episode, episode number) pairs.
+    """
+    missing = []
+    manifest = load_manifest(self.__location)
+    for ndx, episode in enumerate(self.__list):
+      if ndx in self.__filtered:
+        continue
+      try:
+        stats = podcast_episode_exists(self.__title, episode, manifest)
+      except Exception:
+        # items without an enclosure have nothing to download
+        continue
+      if not stats['exists']:
+        missing.append((episode, self.episodeCount() - ndx))
+    return missing
+
   def subscribe(self, window, confirmation:str) -> None:
     """
     Subscribes to the podcast by adding it to the subscription list
@@ -189,14 +548,14 @@ class Podcast:
     """
     subs = subscriptions()
     if self.__xml_url in subs:
-      logger.info(f'Already Subscribed to {self.__title}')
+      logger.info('Already Subscribed to %s', self.__title)
       if window:
         window.evaluate_js(f'document.querySelector("audiosync-podcasts").subResponse("Already Subscribed to {self.__title}");')
       return
 
     subs.append(self.__xml_url)
 
-    set_key(os.path.join(script_folder, '.env'), 'subscriptions', ','.join(subs))
+    save_subscriptions(subs)
 
     logger.info('Subscribed!')
     if window:
@@ -216,16 +575,18 @@ class Podcast:
       subs = subscriptions()
       if self.__xml_url in subs:
         updated = [url for url in subs if url != self.__xml_url]
-        set_key(os.path.join(script_folder, '.env'), 'subscriptions', ','.join(updated))
+        save_subscriptions(updated)
+        catalog.remove_feed(self.__xml_url)
         logger.info('Unsubscribed!')
         if window:
           try:
+            journal.record_deleted_tree(self.__location)
             shutil.rmtree(self.__location)
-            logger.info(f'Deleting directory {self.__location}')
+            logger.info('Deleting directory %s', self.__location)
           except:
             pass
       else:
-        logger.info(f'You are not subscribed to {self.__xml_url}.')
+        logger.info('You are not subscribed to %s.', self.__xml_url)
 
     if window:
       go()
@@ -235,10 +596,11 @@ class Podcast:
       go()
       if confirmation == '1' or question('Remove all downloaded files? (yes/no) ') and question('Files cannot be recovered. Are you sure? (yes/no) '):
         try:
+          journal.record_deleted_tree(self.__location)
           shutil.rmtree(self.__location)
-          logger.info(f'Deleting directory {self.__location}')
+          logger.info('Deleting directory %s', self.__location)
         except:
-          logger.error(f'Failed deletion: {self.__location}')
+          logger.error('Failed deletion: %s', self.__location)
 
   def downloadNewest(self, window) -> None:
     """
@@ -250,16 +612,96 @@ class Podcast:
     try:
       self.__mkdir()
     except Exception as e:
-      logger.critical(f'Error creating directory: {e}')
+      logger.critical('Error creating directory: %s', e)
       return
 
     try:
       self.__get_cover()
     except Exception as e:
-      logger.critical(f'Failed getting cover.jpg: {e}')
+      logger.critical('Failed getting cover.jpg: %s', e)
       return
 
-    self.__fileDL(self.__list[0], self.episodeCount(), window)
+    newest = self.__newest()
+    if newest is not None:
+      self.__fileDL(self.__list[newest], self.episodeCount() - newest, window)
+    self.__repair(window)
+
+  def downloadEpisode(self, episode:Episode, epNum:int, window) -> str:
+    """
+    Downloads a single episode from the podcast.
+
+    Args:
+      episode (Episode): The metadata of the episode (from the XML).
+      epNum (int): The episode number.
+      window (object): UI window for progress updates (if applicable).
+
+    Returns:
+      str: The path of the downloaded file, or None if nothing was downloaded.
+    """
+    try:
+      self.__mkdir()
+    except Exception as e:
+      logger.critical('Error creating directory: %s', e)
+      return None
+
+    try:
+      self.__get_cover()
+    except Exception as e:
+      logger.critical('Failed getting cover.jpg: %s', e)
+      return None
+
+    return self.__fileDL(episode, epNum, window)
+
+  def streamEpisode(self, url:str):
+    """
+    Opens an episode for playing while it downloads. An episode that isn't on disk yet is
+    downloaded in the background (recorded and tagged like any other download) and can be
+    read from as the bytes arrive.
+
+    Args:
+      url (str): The episode's enclosure URL.
+
+    Returns:
+      str | PartialDownload: The path of the downloaded file, or the running download.
+
+    Raises:
+      KeyError: If the feed has no episode with that URL.
+    """
+    for ndx, episode in enumerate(self.__list):
+      if episode.url == url:
+        break
+    else:
+      raise KeyError(url)
+
+    stats = podcast_episode_exists(self.__title, episode)
+    stats['path'] = stats['path'].lstrip('\\/')
+    path: str = os.path.join(self.__podcast_folder, stats['path'])
+    if stats['exists']:
+      return path
+
+    partial = partial_download.active(path)
+    if partial and not partial.error:
+      return partial
+
+    self.__mkdir()
+    partial = partial_download.start(resolve_url.resolve(url)['url'], path)
+
+    def download() -> None:
+      try:
+        try:
+          self.__get_cover()
+        except Exception as e:
+          logger.critical('Failed getting cover.jpg: %s', e)
+        # not through __fileDL, a short episode can be on disk before it checks and would be skipped unrecorded
+        with metrics.labels(feed=self.__xml_url, episode=stats['filename']):
+          self.__store(episode, self.episodeCount() - ndx, stats, None)
+      finally:
+        if not partial.done:
+          partial.cancel()
+        partial_download.finish(path)
+
+    threading.Thread(target=download, name='stream-download', daemon=True).start()
+    return partial
 
   def downloadAll(self, window) -> None:
     """
@@ -271,17 +713,22 @@ class Podcast:
     try:
       self.__mkdir()
     except Exception as e:
-      logger.critical(f'Error creating directory: {e}')
+      logger.critical('Error creating directory: %s', e)
       return
 
     try:
       self.__get_cover()
     except Exception as e:
-      logger.critical(f'Failed getting cover.jpg: {e}')
+      logger.critical('Failed getting cover.jpg: %s', e)
       return
 
+    episodes = []
     for ndx, episode in enumerate(self.__list):
-      self.__fileDL(episode, self.episodeCount() - ndx, window)
+      if ndx in self.__filtered:
+        self.__skip(ndx)
+        continue
+      episodes.append((episode, self.episodeCount() - ndx))
+    self.__fileDLMany(episodes, window)
 
   def downloadCount(self, count, window) -> None:
     """
@@ -294,19 +741,541 @@ class Podcast:
     try:
       self.__mkdir()
     except Exception as e:
-      logger.critical(f'Error creating directory: {e}')
+      logger.critical('Error creating directory: %s', e)
       return
 
     try:
       self.__get_cover()
     except Exception as e:
-      logger.critical(f'Failed getting cover.jpg: {e}')
+      logger.critical('Failed getting cover.jpg: %s', e)
       return
 
-    for ndx in range(count):
-      self.__fileDL(self.__list[ndx], self.episodeCount() - ndx, window)
+    # filtered episodes don't count towards the number asked for
+    episodes = []
+    for ndx, episode in enumerate(self.__list):
+      if len(episodes) >= count:
+        break
+      if ndx in self.__filtered:
+        self.__skip(ndx)
+        continue
+      episodes.append((episode, self.episodeCount() - ndx))
+    self.__fileDLMany(episodes, window)
+
+def pop_option(args:list[str], name:str) -> str:
+  """
+  Removes a '--name value' or '--name=value' option from the argument list.
+
+  Args:
+    args (list[str]): The argument list (modified in place).
+    name (str): The option name including the leading dashes.
+
+  Returns:
+    str: The option's value, or None if the option was not given.
+  """
+  for ndx, arg in enumerate(args):
+    if arg == name and ndx + 1 < len(args):
+      value = args[ndx + 1]
+      del args[ndx:ndx + 2]
+      return value
+    if arg.startswith(f'{name}='):
+      del args[ndx]
+      return arg.split('=', 1)[1]
+  return None
+
+def load_feeds(urls:list[str], probe:bool = True) -> list[tuple[str, 'Podcast']]:
+  """
+  Fetches and parses feeds concurrently ('feed_concurrency' at once, default 8), so a run
+  spends the network round trips side by side and large feeds go to the parser pool
+  (lib/parse_pool.py). Nothing is downloaded.
+
+  Args:
+    urls (list[str]): Feed URLs.
+    probe (bool): Check the connection and each feed URL first (see Podcast).
+
+  Returns:
+    list[tuple[str, Podcast]]: (url, podcast) in the order of urls, podcast is None if the feed failed to load.
+  """
+  from concurrent.futures import ThreadPoolExecutor
+
+  def load(url:str):
+    try:
+      with metrics.timer('feed_load', feed=url):
+        return Podcast(url, probe)
+    except Exception as e:
+      logger.critical('podcast.py failed: %s', e)
+      return None
+
+  with parse_pool.concurrent(), ThreadPoolExecutor(max_workers=int(os.getenv('feed_concurrency', 8))) as executor:
+    return list(zip(urls, executor.map(load, urls)))
+
+def budgeted_run(subs:list[str], budget_value:str, policy:str, node:shard.ShardNode = None) -> None:
+  """
+  Downloads pending episodes across all subscriptions in policy order, starting transfers
+  only while they are expected to finish inside the budget. The rest, and the downloads that
+  failed, are carried over to the next run.
+
+  Args:
+    subs (list[str]): Subscribed feed URLs.
+    budget_value (str): The budget, e.g. '45m', '2GB' or '45m,2GB'.
+    policy (str): 'newest', 'smallest' or 'priority'.
+    node (ShardNode): This node when sharded, episodes of feeds whose lease lapsed are carried over.
+  """
+  seconds, max_bytes = parse_budget(budget_value)
+  budget = Budget(seconds, max_bytes)
+  carryover = load_carryover()
+  quarantine = load_quarantine()
+  priorities = feed_priorities()
+  assumed_size = int(os.getenv('assumed_episode_size', 50_000_000))
+
+  pending = []
+  leftover = []
+  for url, podcast in load_feeds(subs):
+    if not podcast:
+      leftover.extend({'feed': url, 'url': ep_url} for ep_url in carryover.get(url, []))
+      continue
+
+    for episode, epNum in podcast.pendingEpisodes(list(carryover.get(url, {}))):
+      if episode.url in quarantine.get(url, []):
+        continue
+      pending.append({
+        'podcast': podcast,
+        'feed': url,
+        'url': episode.url,
+        'episode': episode,
+        'epNum': epNum,
+        'length': episode.length,
+        'published': episode.published.timestamp() if episode.published else 0,
+        'priority': priorities.get(url, 0)
+      })
+
+  logger.info('%s pending episodes, budget: %s, policy: %s', len(pending), budget_value, policy)
+
+  for item in order_pending(pending, policy):
+    if not budget.fits(item['length'] or assumed_size, estimated_rate()):
+      leftover.append(item)
+      continue
+    if node and not node.holds(item['feed']):
+      leftover.append(item)
+      continue
+    path = item['podcast'].downloadEpisode(item['episode'], item['epNum'], False)
+    if not path:
+      # failed (or refused, e.g. no room on disk), it gets another chance next run, up to 'carryover_max_attempts' runs
+      leftover.append(dict(item, failed=True))
+    elif os.path.exists(path):
+      budget.spend(os.path.getsize(path))
+
+  save_carryover(leftover, carryover)
+  logger.info('Budget spent: %s. %s episodes carried over to next run', budget.summary(), len(leftover))
+
+def audit_library(args:list[str]) -> None:
+  """
+  Audits the library for truncated, untagged, missing artwork and orphaned files.
+
+  Usage: podcast.py audit [--fix] [--workers N]
+
+  Args:
+    args (list[str]): Command line arguments after 'audit'.
+  """
+  from lib.audit import audit
+  workers = pop_option(args, '--workers')
+  fix = '--fix' in args
+  folder = os.getenv('podcast_folder')
+
+  if not folder or not os.path.exists(folder):
+    raise Exception(f'Folder {folder} does not exist. Check .env')
+
+  # folder names are recorded whenever a feed is loaded, only unknown feeds are fetched
+  subs = subscriptions()
+  for url in subs:
+    if url not in feed_folders():
+      try:
+        Podcast(url)
+      except Exception as e:
+        logger.error('Failed loading %s: %s', url, e)
+  folders = feed_folders()
+
+  audit(folder, [folders[url] for url in subs if url in folders], fix=fix, workers=int(workers) if workers else None)
+
+def import_subscriptions(args:list[str]) -> None:
+  """
+  Subscribes to every feed in an OPML file or URL list (one per line).
+
+  All feeds are fetched concurrently to check they are valid podcasts, then the
+  subscription list is written once.
+
+  Usage: podcast.py import FILE [--workers N] [--download]
+
+  Args:
+    args (list[str]): Command line arguments after 'import'.
+  """
+  from concurrent.futures import ThreadPoolExecutor
+  workers = int(pop_option(args, '--workers') or 16)
+  download = '--download' in args
+  files = [arg for arg in args if not arg.startswith('--')]
+
+  if len(files) != 1:
+    raise Exception('Usage: podcast.py import FILE [--workers N] [--download]')
+
+  if files[0] == '-':
+    feeds = parse_feed_list(sys.stdin.read())
+  else:
+    with open(files[0], 'r', encoding='utf-8') as f:
+      feeds = parse_feed_list(f.read())
+
+  subs = subscriptions()
+  urls = []
+  for feed in feeds:
+    if feed['url'] in subs or feed['url'] in urls:
+      continue
+    if not is_valid_url(feed['url']):
+      logger.error('Invalid URL address: %s', feed['url'])
+      continue
+    urls.append(feed['url'])
+
+  logger.info('%s feeds listed, %s new', len(feeds), len(urls))
+  if not urls:
+    return
+
+  if not is_connected():
+    raise Exception('Error connecting to the internet. Please check network connection and try again')
+
+  def load(url:str):
+    try:
+      return Podcast(url, probe=False)
+    except Exception as e:
+      logger.error('Failed loading %s: %s', url, e)
+      return None
+
+  with parse_pool.concurrent(), ThreadPoolExecutor(max_workers=workers) as executor:
+    podcasts = list(executor.map(load, urls))
+
+  added = [(url, podcast) for url, podcast in zip(urls, podcasts) if podcast]
+  save_subscriptions(subs + [url for url, _ in added])
+  logger.info('Subscribed to %s feeds, %s failed', len(added), len(urls) - len(added))
+
+  if download:
+    for url, podcast in added:
+      try:
+        podcast.downloadNewest(False)
+      except Exception as e:
+        logger.error('Failed downloading from %s: %s', url, e)
+
+
+def export_subscriptions(args:list[str]) -> None:
+  """
+  Writes the subscriptions as OPML, to a file or stdout.
+
+  Usage: podcast.py export [FILE]
+
+  Args:
+    args (list[str]): Command line arguments after 'export'.
+  """
+  # titles come from the folder names recorded when feeds were loaded, no feed is fetched
+  folders = feed_folders()
+  opml = to_opml([{'url': url, 'title': folders.get(url)} for url in subscriptions()])
+  if args:
+    with open(args[0], 'w', encoding='utf-8') as f:
+      f.write(opml)
+    logger.info('Exported %s subscriptions to %s', len(subscriptions()), args[0])
+  else:
+    sys.stdout.write(opml)
+
+def plan_downloads(args:list[str]) -> None:
+  """
+  Shows what a run would download without downloading anything: the missing episodes,
+  their total size, the estimated time at the measured throughput and the disk space needed.
+
+  Without URLs the plan is for a regular run over all subscriptions. With --all it is for
+  downloading every missing episode (downloadAll).
+
+  Usage: podcast.py plan [URL ...] [--all] [--workers N] [--json]
+
+  Args:
+    args (list[str]): Command line arguments after 'plan'.
+  """
+  import json
+  from concurrent.futures import ThreadPoolExecutor
+  from lib import planner
+  workers = pop_option(args, '--workers')
+  everything = '--all' in args
+  as_json = '--json' in args
+  urls = [arg for arg in args if not arg.startswith('--')] or subscriptions()
+  folder = os.getenv('podcast_folder')
+
+  if not folder or not os.path.exists(folder):
+    raise Exception(f'Folder {folder} does not exist. Check .env')
+
+  if not is_connected():
+    raise Exception('Error connecting to the internet. Please check network connection and try again')
+
+  def load(url:str) -> dict:
+    try:
+      podcast = Podcast(url, probe=False)
+    except Exception as e:
+      logger.error('Failed loading %s: %s', url, e)
+      return None
+    episodes = podcast.missingEpisodes() if everything else podcast.pendingEpisodes(record_skips=False)
+    return {'url': url, 'title': podcast.podcastTitle(), 'episodes': [episode for episode, _ in episodes]}
+
+  with parse_pool.concurrent(), ThreadPoolExecutor(max_workers=int(workers or 8)) as executor:
+    feeds = [feed for feed in executor.map(load, urls) if feed]
+
+  sized = planner.size_episodes([episode for feed in feeds for episode in feed['episodes']], int(workers) if workers else None)
+  for feed in feeds:
+    feed['episodes'], sized = sized[:len(feed['episodes'])], sized[len(feed['episodes']):]
+
+  summary = planner.summarize(feeds, folder)
+  if as_json:
+    for feed in feeds:
+      feed['episodes'] = [{'title': item['episode'].title, 'url': item['episode'].url, 'size': item['size'], 'source': item['source']}
+                          for item in feed['episodes']]
+    print(json.dumps({'feeds': feeds, 'summary': summary}, indent=2))
+  else:
+    print(planner.report(feeds, summary))
+
+def refresh_catalog(window=None, urls:list[str] = None):
+  """
+  Refreshes the episode catalog in the background, so UI queries (catalog.episodes) are
+  answered from the local database right away and pick up new episodes when it is done.
+  Nothing is downloaded.
+
+  Args:
+    window (object): UI window to notify when the catalog has been updated (if applicable).
+    urls (list[str]): The feeds to refresh (default all subscriptions).
+
+  Returns:
+    threading.Thread: The refresh thread.
+  """
+  import threading
+  from concurrent.futures import ThreadPoolExecutor
+
+  def load(url:str) -> None:
+    try:
+      Podcast(url, probe=False)
+    except Exception as e:
+      logger.error('Failed refreshing %s: %s', url, e)
+
+  def refresh() -> None:
+    if not is_connected():
+      logger.error('Not refreshing the catalog, no internet connection')
+      return
+    with parse_pool.concurrent(), ThreadPoolExecutor(max_workers=int(os.getenv('catalog_concurrency', 8))) as executor:
+      list(executor.map(load, urls or subscriptions()))
+    catalog.flush()
+    if window:
+      window.evaluate_js('document.querySelector("audiosync-podcasts").catalogUpdated();')
+
+  thread = threading.Thread(target=refresh, name='catalog-refresh', daemon=True)
+  thread.start()
+  return thread
+
+def query_catalog(args:list[str]) -> None:
+  """
+  Prints episodes from the local catalog as JSON, without fetching any feed.
+  --refresh fetches the subscriptions into the catalog first.
+
+  Usage: podcast.py catalog [--feed URL] [--search TEXT] [--status STATUS] [--type TYPE]
+                            [--season N] [--since DATE] [--until DATE] [--order ORDER]
+                            [--page N] [--per-page N] [--feeds] [--refresh]
+
+  Args:
+    args (list[str]): Command line arguments after 'catalog'.
+  """
+  import json
+  if '--refresh' in args:
+    refresh_catalog().join()
+  if '--feeds' in args:
+    print(json.dumps(catalog.feeds(), indent=2))
+    return
+
+  season = pop_option(args, '--season')
+  results = catalog.episodes(
+    feed=pop_option(args, '--feed'),
+    search=pop_option(args, '--search'),
+    status=pop_option(args, '--status'),
+    episode_type=pop_option(args, '--type'),
+    season=int(season) if season else None,
+    since=pop_option(args, '--since'),
+    until=pop_option(args, '--until'),
+    order=pop_option(args, '--order') or 'newest',
+    page=int(pop_option(args, '--page') or 1),
+    per_page=int(pop_option(args, '--per-page') or 50)
+  )
+  print(json.dumps(results, indent=2))
+
+def apply_retention(args:list[str]) -> None:
+  """
+  Applies the retention rules and disk limits to the library now.
+
+  Usage: podcast.py retention [--dry-run]
+
+  Args:
+    args (list[str]): Command line arguments after 'retention'.
+  """
+  retention.enforce(dry_run='--dry-run' in args)
+
+def websub_daemon(args:list[str]) -> None:
+  """
+  Runs the WebSub subscriber: downloads the newest episodes once, subscribes to the hubs
+  of feeds that advertise one, then downloads from a feed as soon as its hub pushes an update.
+  Leases are renewed and new subscriptions picked up every 'websub_check_interval' seconds.
+  While it runs, polling runs skip the feeds it has a lease for.
+
+  Usage: podcast.py websub [--port N]
+
+  Args:
+    args (list[str]): Command line arguments after 'websub'.
+  """
+  import time
+  import signal
+  from lib.websub_subscriber import Subscriber
+  port = pop_option(args, '--port')
+  interval = float(os.getenv('websub_check_interval', 300))
+
+  def update(url:str) -> None:
+    Podcast(url, probe=False).downloadNewest(False)
+    retention.enforce()
+
+  subscriber = Subscriber(update, port=int(port) if port else None).start()
+  signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+  loaded = set()
+  try:
+    while True:
+      subs = reload_subscriptions()
+      # feeds are fetched once to catch up and find their hub, later updates are pushed (or polled by cron).
+      # The catch-up runs on the subscriber's thread, so it never downloads alongside a pushed update
+      for url in subs:
+        if url not in loaded:
+          loaded.add(url)
+          subscriber.enqueue(url)
+      subscriber.drain()
+
+      hubs = websub.feed_hubs()
+      subscriber.maintain({url: hubs[url] for url in subs if url in hubs})
+      time.sleep(interval)
+  finally:
+    subscriber.stop()
+
+def stream_daemon(args:list[str]) -> None:
+  """
+  Runs a local server that plays episodes while they download. A player pointed at
+  http://127.0.0.1:8765/episode?feed=<feed url>&url=<enclosure url> starts playing once the
+  first bytes arrive instead of after the whole file, and seeking moves the download along.
+  Finished episodes are recorded and tagged like any other download. Only subscribed feeds
+  are served, and a feed is fetched again for an unknown episode at most once every
+  'stream_refresh_interval' seconds.
+
+  Usage: podcast.py stream [--port N]
+
+  Args:
+    args (list[str]): Command line arguments after 'stream'.
+  """
+  import time
+  import signal
+  from lib.stream_server import StreamServer
+  port = pop_option(args, '--port')
+  lock = threading.Lock()
+
+  # feed URL -> (Podcast, when it was fetched)
+  podcasts: dict[str, tuple[Podcast, float]] = {}
+  interval = float(os.getenv('stream_refresh_interval', 300))
+
+  def open_episode(feed:str, url:str):
+    # only subscribed feeds, any page open in a local browser can send requests here
+    if feed not in reload_subscriptions():
+      raise KeyError(feed)
+    with lock:
+      podcast, fetched = podcasts.get(feed, (None, 0))
+      if podcast is None:
+        podcast, fetched = podcasts[feed] = (Podcast(feed, probe=False), time.time())
+    try:
+      return podcast.streamEpisode(url)
+    except KeyError:
+      # maybe a newer episode than the feed we have, the feed is fetched again at most once per interval
+      with lock:
+        if podcasts[feed][1] == fetched:
+          if time.time() - fetched < interval:
+            raise
+          podcasts[feed] = (Podcast(feed, probe=False), time.time())
+        podcast = podcasts[feed][0]
+      return podcast.streamEpisode(url)
+
+  server = StreamServer(open_episode, port=int(port) if port else None).start()
+  signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+  try:
+    while True:
+      time.sleep(60)
+  finally:
+    server.stop()
+
+def shard_status(args:list[str]) -> None:
+  """
+  Prints the live nodes sharing 'shard_dir' and, for each subscription, the node the ring
+  gives it to and the node holding its lease. --leave removes this node's membership and
+  leases so the others take its feeds over on their next run.
+
+  Usage: podcast.py shard [--leave]
+
+  Args:
+    args (list[str]): Command line arguments after 'shard'.
+  """
+  import json
+  if not shard.enabled():
+    print('Sharding is off, set shard_dir in .env')
+    return
+  node = shard.ShardNode()
+  if '--leave' in args:
+    node.leave(drain=True)
+    logger.info('Node %s left, its feeds go to %s', node.node, ', '.join(node.members()) or 'no one')
+    return
+  ring = node.ring()
+  feeds = {}
+  for url in subscriptions() + [shard.RETENTION]:
+    holder = node.lease_holder(url)
+    feeds[url] = {'owner': ring.owner(url), 'lease': holder['node'] if holder else None}
+  print(json.dumps({'node': node.node, 'members': ring.nodes, 'feeds': feeds}, indent=2))
+
+commands = {
+  'audit': audit_library,
+  'plan': plan_downloads,
+  'catalog': query_catalog,
+  'retention': apply_retention,
+  'websub': websub_daemon,
+  'stream': stream_daemon,
+  'shard': shard_status,
+  'import': import_subscriptions,
+  'export': export_subscriptions
+}
 
 def main() -> None:
+  forced = '--profile' in sys.argv
+  if forced:
+    sys.argv.remove('--profile')
+
+  # 'profile_sample' only applies to unattended (cron) runs
+  with profiled('podcast', forced or (len(sys.argv) == 1 and sampled())):
+    run()
+
+
+def run() -> None:
+  if len(sys.argv) > 1 and sys.argv[1] in commands:
+    try:
+      commands[sys.argv[1]](sys.argv[2:])
+    except KeyboardInterrupt:
+      pass
+    except Exception as e:
+      logger.critical('podcast.py %s failed: %s', sys.argv[1], e)
+    return
+
+  metrics.reset()
+  budget_value = pop_option(sys.argv, '--budget')
+  policy = pop_option(sys.argv, '--policy') or 'newest'
+  node = None
+
+  if policy not in policies:
+    logger.critical('Invalid policy: %s. Must be one of: %s', policy, ', '.join(policies))
+    return
+
   try:
     if len(sys.argv) > 1:
       podcast_url: str = sys.argv[1]
@@ -326,7 +1295,7 @@ def main() -> None:
           try:
             options[answer]()
           except Exception as e:
-            logger.critical(f'podcast.py failed: {e}')
+            logger.critical('podcast.py failed: %s', e)
           break
         else:
           action = None
@@ -334,20 +1303,64 @@ def main() -> None:
           
     else:
       subs = subscriptions()
+      # feeds a running 'podcast.py websub' gets pushed updates for aren't polled
+      pushed = websub.pushed_feeds()
+      polled = [url for url in subs if url not in pushed]
+      if pushed:
+        logger.info('Skipping %s feeds with WebSub push', len(subs) - len(polled))
 
-      for url in subs:
+      if shard.enabled():
+        # the feeds (and their folders) are split between the nodes sharing 'shard_dir'
+        node = shard.ShardNode().join()
+        polled = node.claim(polled)
+        # making room for a download only deletes from this node's feeds, the rest is left to the retention lease holder
+        retention.restrict(lambda: {folder for url, folder in feed_folders().items() if node.holds(url)})
+
+      if budget_value:
         try:
-          Podcast(url).downloadNewest(False)
-        except Exception as e:
-          logger.critical(f'podcast.py failed: {e}')
+          budgeted_run(polled, budget_value, policy, node)
+        except ValueError as e:
+          logger.critical('podcast.py failed: %s', e)
+      else:
+        while True:
+          for url, podcast in load_feeds(polled):
+            if node and not node.holds(url):
+              logger.warning('Lease on %s lapsed, left to the other nodes', url)
+              continue
+            if not podcast:
+              continue
+            try:
+              with metrics.timer('feed_refresh', feed=url):
+                podcast.downloadNewest(False)
+            except Exception as e:
+              logger.critical('podcast.py failed: %s', e)
+          # feeds their previous owner handed over while this node was busy
+          polled = node.claim(node.waiting) if node and node.waiting else []
+          if not polled:
+            break
         
       if not len(subs):
         logger.info('No subscriptions found.')
 
+      # deletions run in one batch after the downloads are done, on one node at a time
+      try:
+        if not node or node.claim([shard.RETENTION]):
+          retention.enforce()
+      except Exception as e:
+        logger.error('Retention failed: %s', e)
+
+      breaker.log_summary()
+      resolve_url.log_summary()
+      filters.log_summary()
 
   except KeyboardInterrupt:
     pass
 
+  finally:
+    if node:
+      node.leave()
+    metrics.write()
+
 
 if __name__ == "__main__":
   main()
\ No newline at end of file